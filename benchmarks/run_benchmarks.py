@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+
+# Benchmarks for the acquisition, transform, and export hot paths
+
+# Summary: Runs TobiiHelper against the simulated eyetracker, so no hardware
+# is needed, and measures the cost of the gaze callback per sample (with and
+# without event detection), the latency of getCurrentData, the throughput of
+# the coordinate converters, the sample loss rate at 60, 300, 600, and
+# 1200 Hz, the time needed to process a calibration result with
+# calculateCalibration, the write throughput of the gaze recorder, and the
+# time needed to import the package. Results are written as JSON so they can
+# be compared between releases.
+
+# Usage: python benchmarks/run_benchmarks.py [--output results.json]
+#        [--duration seconds] [--seed number]
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import numpy as np
+
+# run from a source checkout without installing
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tobii_pro_wrapper as tpw
+from tobii_pro_wrapper.recorder import (GazeRecorder, INDEX_SUFFIX,
+                                        MARKS_SUFFIX)
+from tobii_pro_wrapper.simulated_tracker import SimulatedBackend
+
+
+_timer = timeit.default_timer
+
+
+# -----Helpers-----
+
+# stand-in for the psychopy monitor created by setMonitor(), the converters
+# only need its size
+class BenchmarkMonitor:
+
+    def __init__(self, sizePix = (1920, 1080)):
+        self.sizePix = list(sizePix)
+
+    def getSizePix(self):
+        return self.sizePix
+
+
+# create a TobiiHelper connected to a simulated eyetracker
+def makeHelper(seed, frequency = 600.0, bufferCapacity = 72000, **options):
+
+    helper = tpw.TobiiHelper(bufferCapacity = bufferCapacity,
+                             backend = SimulatedBackend(seed = seed,
+                                                        frequency = frequency,
+                                                        **options))
+    helper.findTracker()
+    helper.getTrackerSpace()
+    helper.win = BenchmarkMonitor()
+    helper._updateCoordinateTransform()
+    return helper
+
+
+# summary statistics of timings given in seconds, reported in microseconds
+def describe(timings):
+
+    timings = np.asarray(timings, dtype = np.float64) * 1e6
+    return {'count': int(len(timings)),
+            'mean_us': float(np.mean(timings)),
+            'p50_us': float(np.percentile(timings, 50)),
+            'p99_us': float(np.percentile(timings, 99)),
+            'max_us': float(np.max(timings))}
+
+
+# -----Benchmarks-----
+
+# cost of the SDK gaze callback per sample, optionally with online event
+# detection ('ivt' or 'idt') running in the callback
+def benchCallback(seed, numSamples = 20000, eventDetection = None):
+
+    helper = makeHelper(seed)
+    if eventDetection is not None:
+        helper.startEventDetection(eventDetection)
+    tracker = helper.eyetracker
+    # pregenerate samples so only the callback is timed
+    start = time.time()
+    samples = [tracker._makeSample(start + i / 600.0)
+               for i in range(numSamples)]
+
+    timings = []
+    for sample in samples:
+        t0 = _timer()
+        helper.gazeDataCallback(sample)
+        timings.append(_timer() - t0)
+    return describe(timings)
+
+
+# latency of getCurrentData while the simulated eyetracker is streaming:
+# how long each call takes (mostly waiting for the next sample) and how old
+# the returned sample is
+def benchGetCurrentData(seed, duration):
+
+    helper = makeHelper(seed, frequency = 600.0)
+    helper.startGazeData()
+    # let the stream start
+    helper.waitForNextSample()
+
+    callTimes, sampleAges = [], []
+    endTime = _timer() + duration
+    while _timer() < endTime:
+        t0 = _timer()
+        row = helper.getCurrentData()
+        callTimes.append(_timer() - t0)
+        sampleAges.append(row['SampleAge'] / 1000.0)
+    helper.stopGazeData()
+
+    # cost of summarizing a sample, without waiting
+    snapshotTimes = []
+    helper.tracking = True
+    for i in range(2000):
+        t0 = _timer()
+        helper.getSnapshot()
+        snapshotTimes.append(_timer() - t0)
+    helper.tracking = False
+
+    return {'call': describe(callTimes),
+            'sample_age': describe(sampleAges),
+            'snapshot': describe(snapshotTimes)}
+
+
+# conversions per second for the single coordinate and array converters
+def benchConverters(seed, numPoints = 100000, numCalls = 20000):
+
+    helper = makeHelper(seed)
+    rng = np.random.RandomState(seed)
+    points = rng.uniform(0.0, 1.0, (numPoints, 2))
+    pointTuples = [tuple(point) for point in points[:numCalls]]
+
+    results = {}
+    for name in ('tb2Ada', 'tb2PsychoNorm', 'ada2PsychoPix', 'ada2MonPix'):
+        converter = getattr(helper, name)
+        t0 = _timer()
+        for point in pointTuples:
+            converter(point)
+        scalarTime = _timer() - t0
+
+        arrayConverter = getattr(helper, name + 'Array')
+        t0 = _timer()
+        arrayConverter(points)
+        arrayTime = _timer() - t0
+
+        results[name] = {'scalar_per_s': numCalls / scalarTime,
+                         'array_per_s': numPoints / arrayTime}
+    return results
+
+
+# fraction of emitted samples that never reached a consumer draining the
+# gaze buffer once per 60 Hz frame
+def benchSampleLoss(seed, duration, frequencies = (60, 300, 600, 1200)):
+
+    results = {}
+    for frequency in frequencies:
+        helper = makeHelper(seed, frequency = float(frequency))
+        tracker = helper.eyetracker
+        helper.startGazeData()
+
+        drained = 0
+        endTime = _timer() + duration
+        while _timer() < endTime:
+            time.sleep(1.0 / 60)
+            drained += len(helper.gazeBuffer.drain())
+        helper.stopGazeData()
+        drained += len(helper.gazeBuffer.drain())
+
+        emitted = tracker.sampleCount
+        results[str(frequency)] = {
+                'emitted': emitted,
+                'received': helper.gazeBuffer.writeCount,
+                'drained': drained,
+                'overruns': helper.gazeBuffer.overrunCount,
+                'loss_rate': 1.0 - float(drained) / emitted if emitted else 0.0,
+                'achieved_hz': emitted / duration}
+    return results
+
+
+# time needed to process the result of a 9 point calibration
+def benchCalibration(seed, repeats = 50):
+
+    helper = makeHelper(seed, collectDuration = 0.0)
+    calibration = helper.backend.ScreenBasedCalibration(helper.eyetracker)
+    calibration.enter_calibration_mode()
+    for x in (0.1, 0.5, 0.9):
+        for y in (0.1, 0.5, 0.9):
+            calibration.collect_data(x, y)
+    calibResult = calibration.compute_and_apply()
+    calibration.leave_calibration_mode()
+
+    timings = []
+    for i in range(repeats):
+        t0 = _timer()
+        helper.calculateCalibration(calibResult)
+        timings.append(_timer() - t0)
+    return describe(timings)
+
+
+# samples and bytes per second written by the gaze recorder
+def benchRecorder(seed, numSamples = 200000):
+
+    helper = makeHelper(seed, bufferCapacity = numSamples)
+    sample = helper.eyetracker._makeSample(time.time())
+
+    fileHandle, fileName = tempfile.mkstemp(suffix = '.gaze')
+    os.close(fileHandle)
+    try:
+        # the writer thread stays asleep, so stop() writes every sample in
+        # one pass
+        recorder = GazeRecorder(helper.gazeBuffer, fileName,
+                                flushInterval = 3600.0, fsync = 'close')
+        recorder.start()
+        for i in range(numSamples):
+            helper.gazeBuffer.append(sample)
+        t0 = _timer()
+        recorder.stop()
+        elapsed = _timer() - t0
+        fileSize = os.path.getsize(fileName)
+    finally:
+        for name in (fileName, fileName + INDEX_SUFFIX,
+                     fileName + MARKS_SUFFIX):
+            if os.path.exists(name):
+                os.remove(name)
+
+    return {'samples': recorder.sampleCount,
+            'samples_per_s': recorder.sampleCount / elapsed,
+            'mb_per_s': fileSize / elapsed / 1e6}
+
+
+# modules that must not be imported by `import tobii_pro_wrapper`
+HEAVY_MODULES = ('gtk', 'pygtk', 'psychopy', 'scipy', 'tobii_research')
+
+# run in a fresh interpreter, prints the import time and the heavy modules
+# that were imported along the way
+_IMPORT_SCRIPT = """
+import json, sys, timeit
+t0 = timeit.default_timer()
+import tobii_pro_wrapper
+elapsed = timeit.default_timer() - t0
+heavy = sorted(set(name.split('.')[0] for name in sys.modules
+                   if name.split('.')[0] in %r))
+print(json.dumps({'seconds': elapsed, 'heavy_modules': heavy}))
+"""
+
+
+# time needed to import the package in a fresh interpreter
+def benchImportTime(repeats = 5):
+
+    # import the source checkout, not an installed copy
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+            [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] +
+            [path for path in [env.get('PYTHONPATH')] if path])
+
+    timings, heavyModules = [], set()
+    for i in range(repeats):
+        output = subprocess.check_output(
+                [sys.executable, '-c', _IMPORT_SCRIPT % (HEAVY_MODULES,)],
+                env = env)
+        result = json.loads(output.decode('ascii').strip().splitlines()[-1])
+        timings.append(result['seconds'])
+        heavyModules.update(result['heavy_modules'])
+
+    results = describe(timings)
+    results['heavy_modules'] = sorted(heavyModules)
+    return results
+
+
+# -----Run everything-----
+def main():
+
+    parser = argparse.ArgumentParser(
+            description = 'Benchmark the tobii_pro_wrapper hot paths.')
+    parser.add_argument('--output', default = 'benchmark_results.json',
+                        help = 'file to write the results to')
+    parser.add_argument('--duration', type = float, default = 2.0,
+                        help = 'seconds to stream for timed benchmarks')
+    parser.add_argument('--seed', type = int, default = 1)
+    args = parser.parse_args()
+
+    results = {'python': platform.python_version(),
+               'numpy': np.__version__,
+               'platform': platform.platform(),
+               'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'benchmarks': {}}
+    benchmarks = [('callback', lambda: benchCallback(args.seed)),
+                  ('callback_ivt',
+                   lambda: benchCallback(args.seed, eventDetection = 'ivt')),
+                  ('callback_idt',
+                   lambda: benchCallback(args.seed, eventDetection = 'idt')),
+                  ('get_current_data',
+                   lambda: benchGetCurrentData(args.seed, args.duration)),
+                  ('converters', lambda: benchConverters(args.seed)),
+                  ('sample_loss',
+                   lambda: benchSampleLoss(args.seed, args.duration)),
+                  ('calculate_calibration',
+                   lambda: benchCalibration(args.seed)),
+                  ('recorder', lambda: benchRecorder(args.seed)),
+                  ('import_time', lambda: benchImportTime())]
+
+    for name, benchmark in benchmarks:
+        print ("Running " + name)
+        results['benchmarks'][name] = benchmark()
+
+    # importing the package must stay fast and free of GUI dependencies
+    heavyModules = results['benchmarks']['import_time']['heavy_modules']
+    if heavyModules:
+        print ("WARNING: importing tobii_pro_wrapper imported " +
+               ", ".join(heavyModules))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent = 2, sort_keys = True)
+    print ("Results written to " + args.output)
+
+
+if __name__ == '__main__':
+    main()
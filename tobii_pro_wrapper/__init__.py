@@ -1 +1,6 @@
 from .tobii_pro_wrapper import *
+from .recorder import GazeSession, readRecording
+from .gaze_contingent import GazeContingentDisplay
+from .calibration_store import CalibrationStore
+from .multi_tracker import MultiTrackerManager
+from .gaze_stream import GazeSubscriber
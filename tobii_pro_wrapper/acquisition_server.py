@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+# Receiving gaze data in a separate process
+
+# Summary: The SDK calls the gaze callback from a thread of the process that
+# subscribed, so in an experiment the callback competes for the GIL with
+# psychopy drawing, event handling, and waiting, and each delays the other.
+# An AcquisitionServer moves the subscription to a process of its own. That
+# process writes every sample into a SharedGazeRing, a ring buffer of gaze
+# samples in shared memory (multiprocessing.RawArray, available on every
+# Python version this package supports), and the experiment process reads
+# the same memory through numpy views, with the reader functions of a
+# GazeRingBuffer. There is a single writer, so no lock is shared between the
+# processes: the writer stores a sample and only then publishes the new
+# sample count, and a reader checks the count again after copying, dropping
+# any samples the writer could have overwritten in the meantime.
+
+import ctypes
+import multiprocessing
+import time
+
+import numpy as np
+
+from .gaze_buffer import GAZE_DTYPE, unpackGazeData
+from .lazy_import import LazyModule
+
+tobii = LazyModule('tobii_research')
+
+
+# -----Class for a gaze ring buffer in shared memory-----
+class SharedGazeRing:
+
+    # clock as for GazeRingBuffer, it is not shared, so each process sets
+    # its own. Readers waiting for a sample check every pollInterval seconds
+    def __init__(self, capacity = 72000, clock = None, pollInterval = 0.0005):
+
+        # check argument values
+        if capacity is None or int(capacity) < 2:
+            raise ValueError("Buffer capacity must be at least two samples.")
+
+        self.capacity = int(capacity)
+        self.clock = clock
+        self.pollInterval = pollInterval
+
+        # shared memory for the samples, the time each was received, and
+        # the total number of samples written
+        self.rawData = multiprocessing.RawArray(
+                ctypes.c_char, self.capacity * GAZE_DTYPE.itemsize)
+        self.rawReceiveTimes = multiprocessing.RawArray(ctypes.c_int64,
+                                                        self.capacity)
+        self.rawCounts = multiprocessing.RawArray(ctypes.c_int64, 1)
+        self._attach()
+
+        # position of drain() and samples it lost to overruns, for the 
+        # readers of this process, as for GazeRingBuffer
+        self.readCount = 0
+        self.overrunCount = 0
+
+
+    # numpy views of the shared memory, made again in every process
+    def _attach(self):
+
+        self.data = np.frombuffer(self.rawData, dtype = GAZE_DTYPE)
+        self.receiveTimes = np.frombuffer(self.rawReceiveTimes,
+                                          dtype = np.int64)
+        self.counts = np.frombuffer(self.rawCounts, dtype = np.int64)
+
+
+    # only the shared memory is handed to a new process
+    def __getstate__(self):
+
+        return {'capacity': self.capacity, 'pollInterval': self.pollInterval,
+                'rawData': self.rawData,
+                'rawReceiveTimes': self.rawReceiveTimes,
+                'rawCounts': self.rawCounts}
+
+
+    def __setstate__(self, state):
+
+        self.__dict__.update(state)
+        self.clock = None
+        self.readCount = 0
+        self.overrunCount = 0
+        self._attach()
+
+
+    # total number of samples ever written
+    @property
+    def writeCount(self):
+        return int(self.counts[0])
+
+
+    # function for copying one SDK gaze data dictionary into the ring, only
+    # ever called by the one writing process
+    def append(self, gazeData):
+
+        receiveTime = self.clock() if self.clock is not None else 0
+        record = unpackGazeData(gazeData)
+
+        writeCount = int(self.counts[0])
+        index = writeCount % self.capacity
+        self.data[index] = record
+        self.receiveTimes[index] = receiveTime
+        # publish the sample only once it is complete
+        self.counts[0] = writeCount + 1
+
+
+    # function for getting every sample written since the last call, as for
+    # GazeRingBuffer.drain()
+    def drain(self):
+
+        stop = self.writeCount
+        start = max(self.readCount, stop - self.capacity)
+        samples, first = self._copyRange(start, stop)
+        # samples overwritten before or while they were copied
+        self.overrunCount += first - self.readCount
+        self.readCount = stop
+        return samples
+
+
+    # function for reading without draining, as for
+    # GazeRingBuffer.readSince()
+    def readSince(self, sampleCount):
+
+        stop = self.writeCount
+        start = max(sampleCount, stop - self.capacity)
+        return self._copyRange(start, stop)[0], stop
+
+
+    # function for waiting until more than sampleCount samples have been
+    # written, or until timeout (in seconds) runs out. Returns the number of
+    # samples written so far
+    def waitForSample(self, sampleCount, timeout = None):
+
+        endTime = None if timeout is None else time.time() + timeout
+        writeCount = self.writeCount
+        while writeCount <= sampleCount:
+            if endTime is not None and time.time() >= endTime:
+                break
+            time.sleep(self.pollInterval)
+            writeCount = self.writeCount
+        return writeCount
+
+
+    # function for getting the most recent sample as a one record array,
+    # empty if nothing arrived yet
+    def latest(self):
+
+        stop = self.writeCount
+        if stop == 0:
+            return np.zeros(0, dtype = GAZE_DTYPE)
+        return self._copyRange(stop - 1, stop)[0]
+
+
+    # function for getting the most recent count samples, oldest first, and
+    # the time the newest one was received, as for
+    # GazeRingBuffer.latestReceived()
+    def latestReceived(self, count = 1):
+
+        stop = self.writeCount
+        if stop == 0:
+            return np.zeros(0, dtype = GAZE_DTYPE), 0
+        start = max(0, stop - count, stop - self.capacity)
+        receiveTime = int(self.receiveTimes[(stop - 1) % self.capacity])
+        samples, first = self._copyRange(start, stop)
+        # the newest sample itself was overwritten
+        if first >= stop:
+            return samples, 0
+        return samples, receiveTime
+
+
+    # copy samples start to stop out of the ring, returns them and the
+    # position of the first one that is returned. Samples the writer may
+    # have overwritten during the copy are left out
+    def _copyRange(self, start, stop):
+
+        if start >= stop:
+            return np.zeros(0, dtype = GAZE_DTYPE), stop
+
+        first, last = start % self.capacity, stop % self.capacity
+        if first < last:
+            samples = self.data[first:last].copy()
+        else:
+            samples = np.concatenate((self.data[first:], self.data[:last]))
+
+        # the writer may be storing the sample after the last one published
+        firstIntact = self.writeCount + 1 - self.capacity
+        if firstIntact > start:
+            samples = samples[min(firstIntact, stop) - start:]
+            start = min(firstIntact, stop)
+        return samples, start
+
+
+    # number of samples waiting to be drained
+    def __len__(self):
+        return self.writeCount - self.readCount
+
+
+# -----Class for running the gaze subscription in another process-----
+class AcquisitionServer:
+
+    # serialNumber picks the eyetracker, the first one found if None.
+    # backendFactory is called in the new process to get the backend, e.g.
+    # simulated_tracker.SimulatedBackend, by default the Tobii Pro SDK.
+    # start() waits at most startTimeout seconds for the eyetracker
+    def __init__(self, serialNumber = None, capacity = 72000,
+                 backendFactory = None, startTimeout = 10.0):
+
+        self.serialNumber = serialNumber
+        self.backendFactory = backendFactory
+        self.startTimeout = startTimeout
+        self.ring = SharedGazeRing(capacity)
+        self.stopEvent = multiprocessing.Event()
+        self.process = None
+
+        # eyetracker the server subscribed to, known once it has started
+        self.address = None
+        self.frequency = None
+
+
+    # function for starting the server process, returns once it is
+    # receiving gaze data
+    def start(self):
+
+        if self.process is not None:
+            raise ValueError("The acquisition server is already running.")
+
+        receiver, sender = multiprocessing.Pipe(duplex = False)
+        self.stopEvent.clear()
+        self.process = multiprocessing.Process(
+                target = _serve, name = 'AcquisitionServer',
+                args = (self.ring, self.serialNumber, self.backendFactory,
+                        self.stopEvent, sender))
+        self.process.daemon = True
+        self.process.start()
+        sender.close()
+
+        # wait for the server to report that it subscribed, or why not
+        if not receiver.poll(self.startTimeout):
+            receiver.close()
+            self.stop()
+            raise ValueError("The acquisition server did not start within " +
+                             str(self.startTimeout) + " seconds.")
+        message = receiver.recv()
+        receiver.close()
+        if message[0] == 'error':
+            self.stop()
+            raise ValueError("The acquisition server could not start: " +
+                             message[1])
+        self.address, self.serialNumber, self.frequency = message[1:]
+
+
+    # function for unsubscribing and ending the server process
+    def stop(self, timeout = 5.0):
+
+        if self.process is None:
+            return
+        self.stopEvent.set()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.process = None
+
+
+    # function for checking that the server process is still running
+    def isAlive(self):
+        return self.process is not None and self.process.is_alive()
+
+
+# server process: subscribe the shared ring to gaze data until told to stop
+def _serve(ring, serialNumber, backendFactory, stopEvent, connection):
+
+    try:
+        backend = backendFactory() if backendFactory is not None \
+            else tobii._load()
+        ring.clock = backend.get_system_time_stamp
+        matches = [eyetracker for eyetracker in backend.find_all_eyetrackers()
+                   if serialNumber is None or
+                   eyetracker.serial_number == serialNumber]
+        if not matches:
+            raise ValueError("Cannot find eyetracker " + str(serialNumber))
+        eyetracker = backend.EyeTracker(matches[0].address)
+        eyetracker.subscribe_to(backend.EYETRACKER_GAZE_DATA, ring.append,
+                                as_dictionary = True)
+    except Exception as error:
+        connection.send(('error', str(error)))
+        connection.close()
+        return
+
+    connection.send(('ready', eyetracker.address, eyetracker.serial_number,
+                     eyetracker.get_gaze_output_frequency()))
+    connection.close()
+    try:
+        stopEvent.wait()
+    finally:
+        eyetracker.unsubscribe_from(backend.EYETRACKER_GAZE_DATA, ring.append)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+# Collecting calibration data on a worker thread
+
+# Summary: ScreenBasedCalibration.collect_data blocks until the eyetracker
+# has collected data at a point, which freezes the calibration display.
+# A CalibrationCollector runs collect_data on a worker thread instead, and
+# retries it a set number of times if it fails. collect() returns a
+# CollectionFuture right away, so the caller can keep drawing frames and
+# check done(), wait with result(timeout), or register a callback. Only one
+# collection runs at a time, since the SDK calibration object is not meant
+# to be used from several threads at once, so a caller whose collection
+# timed out checks isRunning() and keeps drawing until it has finished.
+
+import threading
+
+
+# -----Class for the result of a collection that may still be running-----
+class CollectionFuture:
+
+    def __init__(self, x, y):
+
+        # calibration point in ada units
+        self.point = (x, y)
+        # last status returned by collect_data, and the number of calls
+        self.status = None
+        self.attempts = 0
+        # exception raised by collect_data, if any
+        self.error = None
+
+        self.doneEvent = threading.Event()
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+
+    # function for checking whether collection has finished
+    def done(self):
+        return self.doneEvent.is_set()
+
+
+    # function for waiting until collection has finished, for at most
+    # timeout seconds. Returns the final status of collect_data, or None if
+    # it is still running, and raises the exception collect_data raised
+    def result(self, timeout = None):
+
+        if not self.doneEvent.wait(timeout):
+            return None
+        if self.error is not None:
+            raise self.error
+        return self.status
+
+
+    # function for calling callback(future) once collection has finished,
+    # on the worker thread, or right away if it already has
+    def addDoneCallback(self, callback):
+
+        with self.lock:
+            if not self.done():
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+
+    # store the outcome and wake up everyone waiting for it
+    def _finish(self, status, error):
+
+        with self.lock:
+            self.status = status
+            self.error = error
+            self.doneEvent.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+# -----Class for running collect_data on a worker thread-----
+class CalibrationCollector:
+
+    # successStatus is the SDK's CALIBRATION_STATUS_SUCCESS, collect_data is
+    # called again up to maxRetries times until it returns it
+    def __init__(self, calibration, successStatus, maxRetries = 3):
+
+        # check argument values
+        if calibration is None:
+            raise ValueError("No calibration object given.")
+        if maxRetries is None or maxRetries < 0:
+            raise ValueError("maxRetries must be zero or more.")
+
+        self.calibration = calibration
+        self.successStatus = successStatus
+        self.maxRetries = maxRetries
+        self.thread = None
+
+
+    # function for starting collection at a point, returns a
+    # CollectionFuture. Raises an error if a collection is still running
+    def collect(self, x, y):
+
+        if self.isRunning():
+            raise ValueError("Still collecting at the last point.\n" +
+                             "Wait until isRunning() is False.")
+        future = CollectionFuture(x, y)
+        self.thread = threading.Thread(target = self._run, args = (future,),
+                                       name = 'CalibrationCollector')
+        self.thread.daemon = True
+        self.thread.start()
+        return future
+
+
+    # function for checking whether a collection is still running
+    def isRunning(self):
+        return self.thread is not None and self.thread.is_alive()
+
+
+    # function for waiting until the running collection, if any, has
+    # finished, e.g. before computing the calibration
+    def join(self, timeout = None):
+
+        if self.thread is not None:
+            self.thread.join(timeout)
+            if not self.thread.is_alive():
+                self.thread = None
+
+
+    # worker thread, collects until success or the retries are used up
+    def _run(self, future):
+
+        status, error = None, None
+        try:
+            for attempt in range(self.maxRetries + 1):
+                future.attempts += 1
+                status = self.calibration.collect_data(future.point[0],
+                                                       future.point[1])
+                if status == self.successStatus:
+                    break
+        except Exception as collectError:
+            # kept for result() to raise in the thread that is waiting
+            error = collectError
+        future._finish(status, error)
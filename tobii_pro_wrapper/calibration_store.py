@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+# Keeping calibrations between sessions
+
+# Summary: A CalibrationStore is a directory of calibrations retrieved from
+# eyetrackers with retrieve_calibration_data(), so a returning participant
+# can start from their last calibration instead of from scratch. A
+# calibration only fits the participant, the eyetracker, and the display it
+# was made with, so each one is stored under all three: the participant ID,
+# the serial number of the eyetracker, and the display geometry (positions
+# of the active display area corners and the monitor size in pixels). Each
+# entry is a pair of files, the calibration data as the SDK returned it
+# (.bin) and a JSON description of what it was made with (.json). Files are
+# written to a temporary name first and then renamed, so an entry is never
+# left half written.
+
+import hashlib
+import json
+import os
+import re
+import time
+
+
+# -----Class for storing calibrations on disk-----
+class CalibrationStore:
+
+    def __init__(self, directory):
+
+        # check argument values
+        if not directory:
+            raise ValueError("No directory given for the calibration store.")
+
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+
+    # function for saving calibration data (bytes) made by participant on
+    # the eyetracker with serialNumber and the display with geometry, a
+    # sequence of numbers. Replaces an earlier calibration with the same key
+    def save(self, participant, serialNumber, geometry, calibrationData):
+
+        if not calibrationData:
+            raise ValueError("No calibration data to save.")
+        fileName = self._fileName(participant, serialNumber, geometry)
+        info = {'Participant': str(participant),
+                'SerialNumber': str(serialNumber),
+                'Geometry': self._roundGeometry(geometry),
+                'SavedAt': time.time(),
+                'Size': len(calibrationData)}
+
+        self._writeFile(fileName + '.bin', bytes(calibrationData))
+        self._writeFile(fileName + '.json',
+                        json.dumps(info, sort_keys = True).encode('ascii'))
+
+
+    # function for loading the calibration data saved with the same key,
+    # returns None if there is none
+    def load(self, participant, serialNumber, geometry):
+
+        fileName = self._fileName(participant, serialNumber, geometry)
+        if not os.path.isfile(fileName + '.bin'):
+            return None
+        with open(fileName + '.bin', 'rb') as f:
+            return f.read()
+
+
+    # function for deleting the calibration saved with the same key, e.g. one
+    # that failed validation. Returns True if there was one
+    def remove(self, participant, serialNumber, geometry):
+
+        fileName = self._fileName(participant, serialNumber, geometry)
+        found = False
+        for extension in ('.bin', '.json'):
+            if os.path.isfile(fileName + extension):
+                os.remove(fileName + extension)
+                found = True
+        return found
+
+
+    # function for listing the descriptions of every stored calibration,
+    # optionally only those of one participant
+    def entries(self, participant = None):
+
+        found = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                info = json.loads(f.read().decode('ascii'))
+            if participant is None or info['Participant'] == str(participant):
+                found.append(info)
+        return found
+
+
+    # geometry rounded to 0.1 mm (or pixel), so the same display always
+    # gives the same key despite floating point noise
+    @staticmethod
+    def _roundGeometry(geometry):
+        return [round(float(value), 1) for value in geometry]
+
+
+    # path of an entry without extension: the readable part of the key, and
+    # a hash of the whole key so IDs can not clash after cleaning
+    def _fileName(self, participant, serialNumber, geometry):
+
+        if participant is None or str(participant) == '':
+            raise ValueError("No participant ID given.")
+        key = json.dumps([str(participant), str(serialNumber),
+                          self._roundGeometry(geometry)])
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+        readable = re.sub(r'[^A-Za-z0-9_-]+', '-',
+                          str(participant) + '_' + str(serialNumber))
+        return os.path.join(self.directory, readable + '_' + digest)
+
+
+    # write a whole file at once, replacing the old one only when complete
+    def _writeFile(self, fileName, data):
+
+        tempName = fileName + '.tmp'
+        with open(tempName, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # os.rename does not replace existing files on Windows
+        if os.name == 'nt' and os.path.exists(fileName):
+            os.remove(fileName)
+        os.rename(tempName, fileName)
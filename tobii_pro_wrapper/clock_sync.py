@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+# Mapping eyetracker time to computer time from time synchronization data
+
+# Summary: The eyetracker stamps samples with its own clock (device time),
+# which runs at a slightly different rate from the computer's monotonic
+# clock (system time, the clock of system_time_stamp and
+# get_system_time_stamp()). Time synchronization packets give a device time
+# together with the system times a request was sent and answered. A
+# ClockModel keeps the most recent packets in fixed size arrays and fits
+# system time as a linear function of device time, an offset plus a drift,
+# taking each packet's system time as the middle of its round trip. The fit
+# is robust: packets with a round trip much slower than usual are left out,
+# since the device time could be anywhere within it, and so are packets far
+# from a first fit. The fit is redone for every packet and published as a
+# single tuple, so other threads can map device times to system times, one
+# at a time or as whole arrays, while packets keep arriving.
+
+import numpy as np
+
+
+# -----Class for fitting system time to device time-----
+class ClockModel:
+
+    # capacity is the number of recent packets fitted (two per second from
+    # the SDK). Packets with a round trip over maxRoundTripRatio times the
+    # median are left out, and so are packets further than outlierScale
+    # robust standard deviations (but at least minTolerance microseconds)
+    # from the first fit
+    def __init__(self, capacity = 600, maxRoundTripRatio = 2.0,
+                 outlierScale = 3.0, minTolerance = 50.0):
+
+        # check argument values
+        if capacity is None or capacity < 2:
+            raise ValueError("The clock model must hold at least two " +
+                             "packets.")
+        if maxRoundTripRatio < 1 or outlierScale <= 0:
+            raise ValueError("maxRoundTripRatio must be at least 1 and " +
+                             "outlierScale positive.")
+
+        self.capacity = int(capacity)
+        self.maxRoundTripRatio = float(maxRoundTripRatio)
+        self.outlierScale = float(outlierScale)
+        self.minTolerance = float(minTolerance)
+        self.reset()
+
+
+    # function for forgetting every packet, e.g. for another eyetracker
+    def reset(self):
+
+        # times relative to the first packet, so float64 keeps sub
+        # microsecond resolution over days
+        self.deviceTimes = np.zeros(self.capacity, dtype = np.float64)
+        self.systemTimes = np.zeros(self.capacity, dtype = np.float64)
+        self.roundTrips = np.zeros(self.capacity, dtype = np.float64)
+        self.packetCount = 0
+        self.deviceRef = None
+        self.systemRef = None
+
+        # (deviceRef, systemRef, slope, intercept), None until fitted
+        self.fit = None
+        # spread of the packets used around the fit, and how many were used
+        self.residualSD = float('nan')
+        self.usedPackets = 0
+
+
+    # function for adding a time synchronization packet, as the dictionary
+    # the SDK passes to the callback, and refitting
+    def addSyncData(self, syncData):
+
+        request = syncData['system_request_time_stamp']
+        response = syncData['system_response_time_stamp']
+        if self.deviceRef is None:
+            self.deviceRef = int(syncData['device_time_stamp'])
+            self.systemRef = int(request)
+
+        slot = self.packetCount % self.capacity
+        self.deviceTimes[slot] = syncData['device_time_stamp'] - self.deviceRef
+        self.systemTimes[slot] = (request - self.systemRef) + \
+            (response - request) / 2.0
+        self.roundTrips[slot] = response - request
+        self.packetCount += 1
+        self._refit()
+
+
+    # function for checking whether device times can be mapped yet
+    def isFitted(self):
+        return self.fit is not None
+
+
+    # function for mapping device time stamps (microseconds, a single value
+    # or an array) to system time stamps, returned as float64 microseconds
+    def deviceToSystem(self, deviceTimes):
+
+        deviceRef, systemRef, slope, intercept = self._getFit()
+        deviceTimes = np.asarray(deviceTimes)
+        systemTimes = systemRef + (intercept + slope *
+                                   (deviceTimes - deviceRef).astype(np.float64))
+        return systemTimes if systemTimes.ndim else float(systemTimes)
+
+
+    # function for mapping system time stamps (microseconds) to device time
+    # stamps, the inverse of deviceToSystem
+    def systemToDevice(self, systemTimes):
+
+        deviceRef, systemRef, slope, intercept = self._getFit()
+        systemTimes = np.asarray(systemTimes)
+        deviceTimes = deviceRef + ((systemTimes - systemRef).astype(np.float64) -
+                                   intercept) / slope
+        return deviceTimes if deviceTimes.ndim else float(deviceTimes)
+
+
+    # function for getting the drift of the device clock relative to the
+    # system clock in parts per million, and the offset of system time from
+    # device time (microseconds) at the first packet
+    def getDrift(self):
+
+        deviceRef, systemRef, slope, intercept = self._getFit()
+        return {'DriftPPM': (1.0 / slope - 1.0) * 1e6,
+                'Offset': systemRef + intercept - deviceRef,
+                'ResidualSD': self.residualSD,
+                'UsedPackets': self.usedPackets,
+                'PacketCount': self.packetCount}
+
+
+    # the published fit, or an error before the first packet
+    def _getFit(self):
+
+        fit = self.fit
+        if fit is None:
+            raise ValueError("No time synchronization data yet.\n" +
+                             "Try running startSyncData().")
+        return fit
+
+
+    # robust linear fit of system time to device time over the stored packets
+    def _refit(self):
+
+        count = min(self.packetCount, self.capacity)
+        device = self.deviceTimes[:count]
+        system = self.systemTimes[:count]
+        roundTrips = self.roundTrips[:count]
+
+        # the device time of a slow round trip is uncertain
+        keep = roundTrips <= self.maxRoundTripRatio * \
+            max(np.median(roundTrips), 1.0)
+        if keep.sum() < 2 or np.ptp(device[keep]) <= 0:
+            # offset only, from the fastest round trip
+            best = np.argmin(roundTrips)
+            slope, intercept = 1.0, system[best] - device[best]
+        else:
+            # fit, leave out packets far from it, and fit again
+            for fitPass in range(2):
+                slope, intercept = np.polyfit(device[keep], system[keep], 1)
+                residuals = system - (intercept + slope * device)
+                if fitPass == 0:
+                    spread = 1.4826 * np.median(np.abs(residuals[keep]))
+                    tolerance = max(self.outlierScale * spread,
+                                    self.minTolerance)
+                    refined = keep & (np.abs(residuals) <= tolerance)
+                    if refined.sum() < 2:
+                        break
+                    keep = refined
+
+        residuals = system[keep] - (intercept + slope * device[keep])
+        self.residualSD = float(np.std(residuals)) if keep.sum() > 1 \
+            else float('nan')
+        self.usedPackets = int(keep.sum())
+        self.fit = (self.deviceRef, self.systemRef, float(slope),
+                    float(intercept))
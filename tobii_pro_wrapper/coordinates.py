@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+# Vectorized conversions between Tobii and Psychopy coordinate systems
+
+# Summary: Every conversion TobiiHelper offers between the Tobii trackbox,
+# the Tobii active display area (ada), and Psychopy window and monitor pixels
+# scales and shifts each axis independently. Each conversion is therefore
+# stored as an axis aligned affine transform and applied to whole arrays of
+# (x, y) coordinates at once. Axes are transformed separately, so a nan in
+# one axis never spreads to the other. A CoordinateTransform object
+# composes the transforms between every pair of coordinate systems once, 
+# from the eyetracker and monitor geometry, so converting a coordinate is a
+# single multiply-add.
+
+import numpy as np
+
+
+# -----Functions for building and applying transforms-----
+
+# function for creating an axis aligned affine transform, stored as a (2, 2)
+# array where row 0 holds the x and y scale and row 1 the x and y offset
+def affine(scale, offset = (0.0, 0.0)):
+    return np.array([scale, offset], dtype = np.float64)
+
+
+# function for applying a transform to an (N, 2) array (or a single (x, y)
+# pair) of coordinates, returns a new array of the same shape
+def applyAffine(transform, xyCoors):
+
+    xyCoors = np.asarray(xyCoors, dtype = np.float64)
+    # check argument values
+    if xyCoors.ndim < 1 or xyCoors.shape[-1] != 2:
+        raise ValueError("Coordinates must be given as (x, y) pairs.")
+
+    return xyCoors * transform[0] + transform[1]
+
+
+# function for combining two transforms into one that applies first, then
+# second
+def composeAffine(first, second):
+    return affine(first[0] * second[0], first[1] * second[0] + second[1])
+
+
+# function for getting the transform that undoes a transform
+def invertAffine(transform):
+    return affine(1.0 / transform[0], -transform[1] / transform[0])
+
+
+# -----Functions for the transforms used by TobiiHelper-----
+
+# trackbox coordinates (mm) to normalized active display area coordinates,
+# from the trackbox and ada dictionaries filled by getTrackerSpace()
+def tb2AdaTransform(tbCoordinates, adaCoordinates):
+
+    tbLowLeft = tbCoordinates.get('bottomLeft')
+    adaLowLeft = ((adaCoordinates.get('width') / -2),
+                  (adaCoordinates.get('height') / -2))
+    # ratios for x and y coordinates
+    return affine((tbLowLeft[0] / adaLowLeft[0], tbLowLeft[1] / adaLowLeft[1]))
+
+
+# normalized ada coordinates to psychopy window 'norm' units, shifted so the
+# center of the trackbox is the center of the window
+def ada2PsychoNormTransform(tbCoordinates, adaCoordinates):
+
+    ratios = tb2AdaTransform(tbCoordinates, adaCoordinates)[0]
+    return affine((1.0, 1.0), (-ratios[0] / 2, -ratios[1] / 2))
+
+
+# normalized ada coordinates, where (0,0) is the upper left corner, to
+# psychopy window 'pix' units, where (0,0) is the center of the window.
+# Results still need to be truncated to whole pixels
+def ada2PsychoPixTransform(sizePix):
+
+    wShift, hShift = sizePix[0] / 2 , sizePix[1] / 2
+    return affine((sizePix[0], -sizePix[1]), (-wShift, hShift))
+
+
+# normalized ada coordinates to monitor pixels, where (0,0) is the upper
+# left corner. Results still need to be truncated to whole pixels
+def ada2MonPixTransform(sizePix):
+    return affine((sizePix[0], sizePix[1]))
+
+
+# -----Class holding the transforms between all coordinate systems-----
+class CoordinateTransform:
+
+    # coordinate systems that can be converted between
+    SPACES = ('trackbox', 'ada', 'psychoNorm', 'psychoPix', 'monPix')
+
+    def __init__(self, tbCoordinates = None, adaCoordinates = None, 
+                 sizePix = None):
+
+        # monitor size the transforms were built from, compared against the
+        # current one by TobiiHelper to spot changes
+        self.sizePix = None if sizePix is None else tuple(sizePix)
+
+        # transforms from the ada to each coordinate system, all others 
+        # are composed from these
+        fromAda = {'ada': affine((1.0, 1.0))}
+        if tbCoordinates and adaCoordinates:
+            fromAda['trackbox'] = invertAffine(
+                    tb2AdaTransform(tbCoordinates, adaCoordinates))
+            fromAda['psychoNorm'] = ada2PsychoNormTransform(tbCoordinates,
+                                                            adaCoordinates)
+        if sizePix is not None:
+            fromAda['psychoPix'] = ada2PsychoPixTransform(sizePix)
+            fromAda['monPix'] = ada2MonPixTransform(sizePix)
+
+        # transforms to the ada, computed directly where possible so 
+        # that converting from trackbox units is exact
+        toAda = dict((space, invertAffine(transform)) 
+                     for space, transform in fromAda.items())
+        if 'trackbox' in fromAda:
+            toAda['trackbox'] = tb2AdaTransform(tbCoordinates, adaCoordinates)
+
+        # compose the transform between every pair of coordinate systems
+        self.transforms = {}
+        for source in toAda:
+            for target in fromAda:
+                self.transforms[(source, target)] = composeAffine(
+                        toAda[source], fromAda[target])
+
+
+    # function for getting the transform from one coordinate system to another
+    def get(self, source, target):
+
+        try:
+            return self.transforms[(source, target)]
+        except KeyError:
+            # explain what is missing
+            for space in (source, target):
+                if space not in self.SPACES:
+                    raise ValueError("Unknown coordinate system: " + str(space))
+            if 'trackbox' in (source, target) or 'psychoNorm' in (source, target):
+                raise ValueError("Missing trackbox coordinates. \n" +\
+                                 "Try running getTrackerSpace()")
+            raise ValueError('No experimental monitor has been specified.\n' +\
+                             'Try running setMonitor().')
+
+
+    # function for converting an (N, 2) array of coordinates from one 
+    # coordinate system to another
+    def convert(self, source, target, xyCoors):
+        return applyAffine(self.get(source, target), xyCoors)
@@ -0,0 +1,479 @@
+# -*- coding: utf-8 -*-
+
+# Online detection of fixations, saccades, and blinks in the live gaze stream
+
+# Summary: An EventDetector is fed every gaze data dictionary from the SDK
+# callback thread and classifies it as it arrives, with a constant amount of
+# work per sample, so experiment logic can react to events instead of polling
+# raw gaze positions every frame. Two classifiers are available:
+#   'ivt'  velocity threshold (I-VT). Gaze velocity is measured over a short
+#          window of recent samples and compared to velocityThreshold.
+#   'idt'  dispersion threshold (I-DT). Samples are added to a window for as
+#          long as its dispersion (x range plus y range) stays below
+#          dispersionThreshold. Range minima and maxima are kept in monotonic
+#          queues, so extending or shrinking the window costs O(1).
+# Both classifiers report runs of samples without gaze as blinks. Gaze is
+# converted from ada units to degrees of visual angle with the display area
+# size and the current eye distance (small angle approximation).
+
+# Events are dictionaries with an 'EventType' ('fixation', 'saccade', or
+# 'blink'), 'StartTime' and 'EndTime' (system time stamps in microseconds,
+# the same clock as SystemTimeStamp), 'Duration' (ms), and 'SampleCount'.
+# Fixations add AvgGazePointX and AvgGazePointY (ada units), and with I-DT
+# their Dispersion (degrees). Saccades add StartGazePointX/Y,
+# EndGazePointX/Y, Amplitude (degrees), and PeakVelocity (degrees per
+# second). An event is emitted once it has ended.
+
+import collections
+import math
+import threading
+
+
+# -----Event types and classifiers-----
+FIXATION = 'fixation'
+SACCADE = 'saccade'
+BLINK = 'blink'
+EVENT_TYPES = (FIXATION, SACCADE, BLINK)
+
+METHODS = ('ivt', 'idt')
+
+# dictionary keys used for each eye, looked up once per sample
+_EYE_KEYS = tuple((eye + '_gaze_point_validity',
+                   eye + '_gaze_point_on_display_area',
+                   eye + '_gaze_origin_validity',
+                   eye + '_gaze_origin_in_user_coordinate_system')
+                  for eye in ('left', 'right'))
+
+
+# function for reducing an SDK gaze data dictionary to the gaze points of
+# the left and right eye in ada units (None where invalid) and the average
+# eye distance in mm (None if neither eye position is valid)
+def _gazeSample(gazeData):
+
+    points = []
+    dist = 0.0
+    distCount = 0
+    for gazeValidity, gazeKey, originValidity, originKey in _EYE_KEYS:
+        points.append(gazeData[gazeKey] if gazeData[gazeValidity] == 1
+                      else None)
+        if gazeData[originValidity] == 1:
+            origin = gazeData[originKey]
+            dist += math.sqrt(origin[0] ** 2 + origin[1] ** 2 + origin[2] ** 2)
+            distCount += 1
+
+    return points[0], points[1], (dist / distCount if distCount else None)
+
+
+# function for building an event dictionary, times in microseconds
+def _makeEvent(eventType, startTime, endTime, sampleCount, **values):
+
+    event = {'EventType': eventType,
+             'StartTime': startTime,
+             'EndTime': endTime,
+             'Duration': (endTime - startTime) / 1000.0,
+             'SampleCount': sampleCount}
+    event.update(values)
+    return event
+
+
+# -----Class for collecting the samples of one fixation or saccade-----
+class _Run:
+
+    # a run starts at a sample (t, x, y, xDeg, yDeg), which is only used as
+    # its start point, samples added later are counted as part of the run
+    def __init__(self, eventType, start):
+
+        self.eventType = eventType
+        self.start = start
+        self.end = start
+        self.count = 0
+        self.sumX = 0.0
+        self.sumY = 0.0
+        self.peakVelocity = 0.0
+
+
+    def add(self, sample, velocity):
+
+        self.end = sample
+        self.count += 1
+        self.sumX += sample[1]
+        self.sumY += sample[2]
+        if velocity > self.peakVelocity:
+            self.peakVelocity = velocity
+
+
+    def duration(self):
+        return self.end[0] - self.start[0]
+
+
+    def toEvent(self):
+
+        if self.eventType == FIXATION:
+            return _makeEvent(FIXATION, self.start[0], self.end[0], self.count,
+                              AvgGazePointX = self.sumX / self.count,
+                              AvgGazePointY = self.sumY / self.count)
+        return _makeEvent(SACCADE, self.start[0], self.end[0], self.count,
+                          StartGazePointX = self.start[1],
+                          StartGazePointY = self.start[2],
+                          EndGazePointX = self.end[1],
+                          EndGazePointY = self.end[2],
+                          Amplitude = math.hypot(self.end[3] - self.start[3],
+                                                 self.end[4] - self.start[4]),
+                          PeakVelocity = self.peakVelocity)
+
+
+# -----Class for classifying gaze samples as they arrive-----
+class EventDetector:
+
+    # displaySize is the (width, height) of the active display area in mm.
+    # Thresholds are in degrees and degrees per second, durations in seconds
+    def __init__(self, displaySize, method = 'ivt', velocityThreshold = 30.0,
+                 dispersionThreshold = 1.0, minFixationDuration = 0.1,
+                 velocityWindow = 0.02, minBlinkDuration = 0.05,
+                 maxBlinkDuration = 0.5, maxEvents = 1000):
+
+        # check argument values
+        if method not in METHODS:
+            raise ValueError("method must be one of " + ", ".join(METHODS) +
+                             ".")
+        if displaySize is None or len(displaySize) != 2 or \
+                min(displaySize) <= 0:
+            raise ValueError("Display size must be given as (width, height) " +
+                             "in mm.")
+        if velocityThreshold <= 0 or dispersionThreshold <= 0:
+            raise ValueError("Thresholds must be positive.")
+        if minBlinkDuration > maxBlinkDuration:
+            raise ValueError("minBlinkDuration must not be longer than " +
+                             "maxBlinkDuration.")
+
+        self.method = method
+        self.displaySize = (float(displaySize[0]), float(displaySize[1]))
+        self.velocityThreshold = float(velocityThreshold)
+        self.dispersionThreshold = float(dispersionThreshold)
+        # durations are compared to time stamps in microseconds
+        self.minFixationDuration = minFixationDuration * 1e6
+        self.velocityWindow = velocityWindow * 1e6
+        self.minBlinkDuration = minBlinkDuration * 1e6
+        self.maxBlinkDuration = maxBlinkDuration * 1e6
+
+        # callbacks as (function, event types or None for all)
+        self.subscribers = []
+        self.subscriberLock = threading.Lock()
+        # most recent events, for consumers that prefer polling
+        self.recentEvents = collections.deque(maxlen = maxEvents)
+        # the SDK thread adds samples while other threads may flush
+        self.lock = threading.Lock()
+        # events emitted while holding the lock, passed to the subscribers
+        # once it is released
+        self.pendingEvents = []
+
+        self.sampleCount = 0
+        self.eventCount = 0
+        # last exception raised by a subscriber
+        self.error = None
+        # eye distance used while no eye position is valid
+        self.eyeDistance = 650.0
+        # last difference between the left and right eye gaze points
+        self.eyeOffset = (0.0, 0.0)
+        # system time stamp of the first sample of a run without gaze
+        self.gapStart = None
+        self._resetState()
+
+
+    # function for calling callback(event) for every event of the given
+    # types (all types if None). Callbacks run on the SDK callback thread,
+    # so they must return quickly. They are called after the detector is
+    # unlocked, so they may call flush() or popEvents()
+    def subscribe(self, callback, eventTypes = None):
+
+        if eventTypes is not None:
+            eventTypes = frozenset(eventTypes)
+            for eventType in eventTypes:
+                if eventType not in EVENT_TYPES:
+                    raise ValueError("Unknown event type: " + str(eventType))
+        with self.subscriberLock:
+            self.subscribers = self.subscribers + [(callback, eventTypes)]
+
+
+    def unsubscribe(self, callback):
+
+        with self.subscriberLock:
+            self.subscribers = [subscriber for subscriber in self.subscribers
+                                if subscriber[0] != callback]
+
+
+    # function for getting every event emitted since the last call, oldest
+    # first, for polling from a frame loop
+    def popEvents(self):
+
+        events = []
+        while self.recentEvents:
+            events.append(self.recentEvents.popleft())
+        return events
+
+
+    # function for classifying one SDK gaze data dictionary
+    def addSample(self, gazeData):
+
+        with self.lock:
+            self._classify(gazeData)
+            events, self.pendingEvents = self.pendingEvents, []
+        self._notify(events)
+
+
+    # function for emitting the event in progress, e.g. when gaze data is
+    # stopped, and starting over
+    def flush(self):
+
+        with self.lock:
+            self._endEvents()
+            self.gapStart = None
+            events, self.pendingEvents = self.pendingEvents, []
+        self._notify(events)
+
+
+    # classify a sample, called with the lock held
+    def _classify(self, gazeData):
+
+        left, right, dist = _gazeSample(gazeData)
+        t = gazeData['system_time_stamp']
+        self.sampleCount += 1
+        if dist is not None:
+            self.eyeDistance = dist
+        gaze = self._binocularGaze(left, right)
+
+        # no gaze, possibly a blink
+        if gaze is None:
+            if self.gapStart is None:
+                self.gapStart = t
+            return
+
+        # gaze is back, anything that was going on ends with a long gap
+        if self.gapStart is not None:
+            gap = t - self.gapStart
+            if gap >= self.minBlinkDuration:
+                self._endEvents()
+                if gap <= self.maxBlinkDuration:
+                    self._emit(_makeEvent(BLINK, self.gapStart, t, 0))
+            self.gapStart = None
+
+        # ada units to degrees of visual angle
+        degPerMm = 57.29577951308232 / self.eyeDistance
+        sample = (t, gaze[0], gaze[1],
+                  gaze[0] * self.displaySize[0] * degPerMm,
+                  gaze[1] * self.displaySize[1] * degPerMm)
+        velocity = self._velocity(sample)
+        if self.method == 'ivt':
+            self._addIVT(sample, velocity)
+        else:
+            self._addIDT(sample, velocity)
+
+
+    # -----Shared state-----
+
+    # average gaze point of both eyes. The eyes rarely agree exactly, so when
+    # only one eye is found it is shifted by half the last difference between
+    # the eyes, otherwise every lost eye would look like a small saccade
+    def _binocularGaze(self, left, right):
+
+        if left is not None and right is not None:
+            self.eyeOffset = (left[0] - right[0], left[1] - right[1])
+            return ((left[0] + right[0]) / 2.0, (left[1] + right[1]) / 2.0)
+        if left is not None:
+            return (left[0] - self.eyeOffset[0] / 2.0,
+                    left[1] - self.eyeOffset[1] / 2.0)
+        if right is not None:
+            return (right[0] + self.eyeOffset[0] / 2.0,
+                    right[1] + self.eyeOffset[1] / 2.0)
+        return None
+
+
+    def _resetState(self):
+
+        # recent samples for measuring velocity
+        self.recentSamples = collections.deque()
+        # I-VT: fixation or saccade in progress
+        self.run = None
+        # I-DT: window of samples (t, x, y, xDeg, yDeg, velocity, index),
+        # monotonic queues of (value, index) for the range of each axis, and
+        # the saccade leading away from the last fixation
+        self.window = collections.deque()
+        self.minX, self.maxX = collections.deque(), collections.deque()
+        self.minY, self.maxY = collections.deque(), collections.deque()
+        self.windowSumX = self.windowSumY = 0.0
+        self.fixationConfirmed = False
+        self.saccadeRun = None
+        self.sampleIndex = 0
+
+
+    # gaze velocity in degrees per second over the last velocityWindow
+    def _velocity(self, sample):
+
+        recent = self.recentSamples
+        recent.append(sample)
+        while len(recent) > 2 and sample[0] - recent[1][0] >= \
+                self.velocityWindow:
+            recent.popleft()
+        first = recent[0]
+        dt = sample[0] - first[0]
+        if dt <= 0:
+            return 0.0
+        return math.hypot(sample[3] - first[3], sample[4] - first[4]) * \
+            1e6 / dt
+
+
+    # emit whatever is in progress, then start over
+    def _endEvents(self):
+
+        if self.method == 'ivt':
+            self._endRun()
+        elif self.fixationConfirmed:
+            self._emitWindow()
+        self._resetState()
+
+
+    # called with the lock held, subscribers are told once it is released
+    def _emit(self, event):
+
+        self.eventCount += 1
+        self.recentEvents.append(event)
+        self.pendingEvents.append(event)
+
+
+    # pass events to the subscribers, called without the lock
+    def _notify(self, events):
+
+        if not events:
+            return
+        subscribers = self.subscribers
+        for event in events:
+            for callback, eventTypes in subscribers:
+                if eventTypes is None or event['EventType'] in eventTypes:
+                    try:
+                        callback(event)
+                    except Exception as error:
+                        # never let a subscriber break the SDK callback
+                        self.error = error
+
+
+    # -----Velocity threshold (I-VT)-----
+
+    def _addIVT(self, sample, velocity):
+
+        eventType = SACCADE if velocity > self.velocityThreshold else FIXATION
+        if self.run is None or self.run.eventType != eventType:
+            # the new run starts where the last one ended
+            start = self.run.end if self.run is not None else sample
+            self._endRun()
+            self.run = _Run(eventType, start)
+        self.run.add(sample, velocity)
+
+
+    def _endRun(self):
+
+        run, self.run = self.run, None
+        if run is None or run.count == 0:
+            return
+        # fixations that are too short are dropped
+        if run.eventType == SACCADE or \
+                run.duration() >= self.minFixationDuration:
+            self._emit(run.toEvent())
+
+
+    # -----Dispersion threshold (I-DT)-----
+
+    def _addIDT(self, sample, velocity):
+
+        entry = sample + (velocity, self.sampleIndex)
+        self.sampleIndex += 1
+
+        if self.window and self._dispersionWith(entry) > \
+                self.dispersionThreshold:
+            if self.fixationConfirmed:
+                # the fixation is over, a saccade leads away from its end
+                lastSample = self.window[-1]
+                self._emitWindow()
+                self._clearWindow()
+                self.saccadeRun = _Run(SACCADE, lastSample[:5])
+            else:
+                # drop the oldest samples until the new one fits
+                while self.window and self._dispersionWith(entry) > \
+                        self.dispersionThreshold:
+                    dropped = self._popWindow()
+                    if self.saccadeRun is not None:
+                        self.saccadeRun.add(dropped[:5], dropped[5])
+
+        self._pushWindow(entry)
+
+        # the window becomes a fixation once it lasts long enough
+        if not self.fixationConfirmed and \
+                self.window[-1][0] - self.window[0][0] >= \
+                self.minFixationDuration:
+            self.fixationConfirmed = True
+            saccade, self.saccadeRun = self.saccadeRun, None
+            if saccade is not None:
+                first = self.window[0]
+                saccade.add(first[:5], first[5])
+                self._emit(saccade.toEvent())
+
+
+    # x range plus y range of the window if entry were added
+    def _dispersionWith(self, entry):
+
+        if not self.window:
+            return 0.0
+        return (max(self.maxX[0][0], entry[3]) -
+                min(self.minX[0][0], entry[3]) +
+                max(self.maxY[0][0], entry[4]) -
+                min(self.minY[0][0], entry[4]))
+
+
+    def _pushWindow(self, entry):
+
+        self.window.append(entry)
+        self.windowSumX += entry[1]
+        self.windowSumY += entry[2]
+        index = entry[6]
+        for queue, value, keepLess in ((self.minX, entry[3], True),
+                                       (self.maxX, entry[3], False),
+                                       (self.minY, entry[4], True),
+                                       (self.maxY, entry[4], False)):
+            # values that can never be the extreme again are dropped
+            if keepLess:
+                while queue and queue[-1][0] >= value:
+                    queue.pop()
+            else:
+                while queue and queue[-1][0] <= value:
+                    queue.pop()
+            queue.append((value, index))
+
+
+    def _popWindow(self):
+
+        entry = self.window.popleft()
+        self.windowSumX -= entry[1]
+        self.windowSumY -= entry[2]
+        for queue in (self.minX, self.maxX, self.minY, self.maxY):
+            if queue and queue[0][1] == entry[6]:
+                queue.popleft()
+        return entry
+
+
+    def _clearWindow(self):
+
+        self.window.clear()
+        for queue in (self.minX, self.maxX, self.minY, self.maxY):
+            queue.clear()
+        self.windowSumX = self.windowSumY = 0.0
+        self.fixationConfirmed = False
+
+
+    def _emitWindow(self):
+
+        count = len(self.window)
+        self._emit(_makeEvent(FIXATION, self.window[0][0], self.window[-1][0],
+                              count,
+                              AvgGazePointX = self.windowSumX / count,
+                              AvgGazePointY = self.windowSumY / count,
+                              Dispersion = self._dispersionWith(
+                                  self.window[-1])))
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+# Timing animations against measured frame intervals
+
+# Summary: Animations that move a stimulus a fixed amount per flip take
+# longer on a 60 Hz display than on a 144 Hz one, and fall behind whenever a
+# frame is dropped. A FrameTimer flips the window, measures the time between
+# flips, and counts dropped frames, i.e. intervals well over the refresh
+# period. Animations are given in seconds instead: the path is computed once
+# as an array with one entry per expected frame, and each flip shows the
+# entry for the time elapsed, so an animation takes the same time at any
+# refresh rate and skips ahead after a dropped frame.
+
+import time
+
+import numpy as np
+
+
+# refresh period assumed until one has been measured
+DEFAULT_FRAME_PERIOD = 1.0 / 60.0
+
+# intervals longer than this many refresh periods count as dropped frames
+DROP_THRESHOLD = 1.5
+
+# the refresh period is first measured as the median of this many intervals,
+# so a frame dropped right at the start does not double it
+MEASURE_INTERVALS = 5
+
+
+# -----Class for flipping a window and measuring frame intervals-----
+class FrameTimer:
+
+    # framePeriod (s) is measured from the flips if not given
+    def __init__(self, framePeriod = None):
+
+        # check argument values
+        if framePeriod is not None and framePeriod <= 0:
+            raise ValueError("framePeriod must be a positive number of " +
+                             "seconds.")
+
+        self.periodGiven = framePeriod is not None
+        self.framePeriod = framePeriod if framePeriod is not None \
+            else DEFAULT_FRAME_PERIOD
+        self.periodMeasured = self.periodGiven
+        # intervals kept until the refresh period is measured
+        self.firstIntervals = []
+        self.lastFlipTime = None
+        self.frameCount = 0
+        self.droppedFrames = 0
+
+
+    # function for flipping the window, returns the time of the flip
+    def flip(self, win):
+
+        win.flip()
+        return self.recordFlip()
+
+
+    # function for recording a flip made elsewhere at flipTime (seconds, on
+    # any clock, now if None), returns the time of the flip
+    def recordFlip(self, flipTime = None):
+
+        if flipTime is None:
+            flipTime = time.time()
+        if self.lastFlipTime is not None:
+            self._addInterval(flipTime - self.lastFlipTime)
+        self.lastFlipTime = flipTime
+        self.frameCount += 1
+        return flipTime
+
+
+    # function for getting the number of frames an animation of duration
+    # seconds is expected to take at the measured refresh rate
+    def numFrames(self, duration):
+        return max(1, int(round(duration / self.framePeriod)))
+
+
+    # measure the refresh period, ignoring dropped frames, and count the
+    # frames that were missed
+    def _addInterval(self, interval):
+
+        if not self.periodMeasured:
+            self.firstIntervals.append(interval)
+            if len(self.firstIntervals) < MEASURE_INTERVALS:
+                return
+            self.framePeriod = float(np.median(self.firstIntervals))
+            self.periodMeasured = True
+            # frames dropped while measuring
+            for firstInterval in self.firstIntervals:
+                self._countDropped(firstInterval)
+            self.firstIntervals = []
+        elif not self._countDropped(interval) and not self.periodGiven:
+            self.framePeriod += 0.05 * (interval - self.framePeriod)
+
+
+    # count the frames missed in an interval, returns True if there were any
+    def _countDropped(self, interval):
+
+        if interval <= DROP_THRESHOLD * self.framePeriod:
+            return False
+        self.droppedFrames += int(round(interval / self.framePeriod)) - 1
+        return True
+
+
+# function for interpolating linearly from start to end in numSteps steps,
+# returns a (numSteps + 1, ...) array that begins at start and ends at end
+def linearPath(start, end, numSteps):
+
+    start = np.asarray(start, dtype = np.float64)
+    end = np.asarray(end, dtype = np.float64)
+    fractions = np.linspace(0.0, 1.0, numSteps + 1)
+    fractions = fractions.reshape((-1,) + (1,) * start.ndim)
+    return start + (end - start) * fractions
+
+
+# function for getting the step of a path with numSteps steps to show
+# elapsed seconds into an animation of duration seconds
+def pathIndex(elapsed, duration, numSteps):
+
+    if elapsed >= duration:
+        return numSteps
+    return min(int(elapsed / duration * numSteps + 0.5), numSteps)
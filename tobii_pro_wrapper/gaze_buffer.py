@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+
+# Lossless storage for gaze samples streamed by the Tobii Pro SDK
+
+# Summary: The SDK calls TobiiHelper.gazeDataCallback from its own thread for
+# every sample the eyetracker produces. Keeping only the most recent sample
+# loses everything that arrives between two reads, so every sample is copied
+# into a preallocated, fixed-capacity numpy structured array that is used as
+# a ring buffer. Consumers call drain() to get all samples collected since
+# their previous call as one contiguous block. drain() keeps the one shared
+# read position, so readCount, overrunCount, and len() only describe the
+# drain() consumer. Consumers with their own position (readSince(), e.g. the
+# recorder and the publisher) count their own lost samples.
+
+import threading
+import time
+
+import numpy as np
+
+
+# -----Layout of a single gaze sample-----
+# one compact record per sample, the SDK gaze data dictionary is unpacked
+# once into float32 and int8 columns (94 bytes per sample)
+GAZE_DTYPE = np.dtype([
+    ('device_time_stamp', np.int64),
+    ('system_time_stamp', np.int64),
+    ('left_gaze_point_on_display_area', np.float32, (2,)),
+    ('left_gaze_point_validity', np.int8),
+    ('left_pupil_diameter', np.float32),
+    ('left_pupil_validity', np.int8),
+    ('left_gaze_origin_in_user_coordinate_system', np.float32, (3,)),
+    ('left_gaze_origin_in_trackbox_coordinate_system', np.float32, (3,)),
+    ('left_gaze_origin_validity', np.int8),
+    ('right_gaze_point_on_display_area', np.float32, (2,)),
+    ('right_gaze_point_validity', np.int8),
+    ('right_pupil_diameter', np.float32),
+    ('right_pupil_validity', np.int8),
+    ('right_gaze_origin_in_user_coordinate_system', np.float32, (3,)),
+    ('right_gaze_origin_in_trackbox_coordinate_system', np.float32, (3,)),
+    ('right_gaze_origin_validity', np.int8)])
+
+
+# function for unpacking an SDK gaze data dictionary into a tuple that can be
+# assigned to a GAZE_DTYPE record in a single step
+def unpackGazeData(gazeData):
+    return (gazeData['device_time_stamp'],
+            gazeData['system_time_stamp'],
+            gazeData['left_gaze_point_on_display_area'],
+            gazeData['left_gaze_point_validity'],
+            gazeData['left_pupil_diameter'],
+            gazeData['left_pupil_validity'],
+            gazeData['left_gaze_origin_in_user_coordinate_system'],
+            gazeData['left_gaze_origin_in_trackbox_coordinate_system'],
+            gazeData['left_gaze_origin_validity'],
+            gazeData['right_gaze_point_on_display_area'],
+            gazeData['right_gaze_point_validity'],
+            gazeData['right_pupil_diameter'],
+            gazeData['right_pupil_validity'],
+            gazeData['right_gaze_origin_in_user_coordinate_system'],
+            gazeData['right_gaze_origin_in_trackbox_coordinate_system'],
+            gazeData['right_gaze_origin_validity'])
+
+
+# -----Functions for summarizing both eyes over arrays of samples-----
+
+# average of left and right eye values, ignoring an eye whose value is nan
+def _eyeMean(left, right):
+    leftFound = ~np.isnan(left)
+    rightFound = ~np.isnan(right)
+    total = np.where(leftFound, left, 0.0) + np.where(rightFound, right, 0.0)
+    # nan where neither eye has a value
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return total / (leftFound.astype(np.int8) + rightFound)
+
+
+# average (x, y) gaze position of both eyes in ada units, nan where the
+# tracker reported no gaze
+def avgGazePos(samples):
+    left = samples['left_gaze_point_on_display_area']
+    right = samples['right_gaze_point_on_display_area']
+    gazePos = _eyeMean(left, right)
+    # hide samples where any eye axis was reported as missing
+    gazePos[((left == -1.0) | (right == -1.0)).any(axis = 1)] = np.nan
+    return gazePos
+
+
+# average (x, y, z) eye position of both eyes in mm from the tracker origin,
+# zeros where no eye was found
+def avgEyePos(samples):
+    eyePos = _eyeMean(samples['left_gaze_origin_in_user_coordinate_system'],
+                      samples['right_gaze_origin_in_user_coordinate_system'])
+    eyePos[np.isnan(eyePos).all(axis = 1)] = 0.0
+    return eyePos
+
+
+# average distance of both eyes from the tracker origin in cm, zero where
+# no eye was found
+def avgEyeDist(samples):
+    return _eyeDist(avgEyePos(samples))
+
+
+# distance in cm of average eye positions given in mm
+def _eyeDist(eyePos):
+    eyeDist = np.sqrt(np.sum((eyePos / 10.0) ** 2, axis = 1))
+    eyeDist[~(np.sum(eyePos, axis = 1) > 0)] = 0.0
+    return eyeDist
+
+
+# average pupil diameter of both eyes in mm, zero where a pupil is missing
+def avgPupilSize(samples):
+    left = samples['left_pupil_diameter']
+    right = samples['right_pupil_diameter']
+    pupSize = _eyeMean(left, right)
+    pupSize[(left == -1) | (right == -1)] = 0.0
+    return pupSize
+
+
+# validity of both eyes as 0 (neither), 1 (left), 2 (right), or 3 (both)
+def eyeValidities(samples):
+    leftValid = samples['left_gaze_origin_validity'] == 1
+    rightValid = samples['right_gaze_origin_validity'] == 1
+    return (leftValid + 2 * rightValid.astype(np.int8)).astype(np.int8)
+
+
+# -----Layout of a summarized sample-----
+# the values returned by TobiiHelper.getCurrentData, with eye position and
+# distance in mm and gaze position in ada units
+DATA_DTYPE = np.dtype([
+    ('DeviceTimeStamp', np.int64),
+    ('SystemTimeStamp', np.int64),
+    ('AvgGazePointX', np.float32),
+    ('AvgGazePointY', np.float32),
+    ('AvgPupilDiam', np.float32),
+    ('AvgEyePosX', np.float32),
+    ('AvgEyePosY', np.float32),
+    ('AvgEyePosZ', np.float32),
+    ('AvgEyeDistance', np.float32),
+    ('EyeValidities', np.int8)])
+
+
+# function for summarizing an array of gaze samples in a single vectorized 
+# pass, returns one DATA_DTYPE record per sample
+def summarizeGazeData(samples):
+
+    summary = np.zeros(len(samples), dtype = DATA_DTYPE)
+    summary['DeviceTimeStamp'] = samples['device_time_stamp']
+    summary['SystemTimeStamp'] = samples['system_time_stamp']
+
+    gazePos = avgGazePos(samples)
+    summary['AvgGazePointX'] = gazePos[:, 0]
+    summary['AvgGazePointY'] = gazePos[:, 1]
+    summary['AvgPupilDiam'] = avgPupilSize(samples)
+
+    # eye position is averaged once and reused for the distance
+    eyePos = avgEyePos(samples)
+    summary['AvgEyePosX'] = eyePos[:, 0]
+    summary['AvgEyePosY'] = eyePos[:, 1]
+    summary['AvgEyePosZ'] = eyePos[:, 2]
+    summary['AvgEyeDistance'] = _eyeDist(eyePos) * 10.0
+    summary['EyeValidities'] = eyeValidities(samples)
+
+    return summary
+
+
+# -----Class for buffering gaze samples between the SDK and consumers-----
+class GazeRingBuffer:
+
+    # clock is an optional function returning the current time, e.g. the
+    # SDK's get_system_time_stamp, used to stamp every sample with the time
+    # it was received
+    def __init__(self, capacity = 72000, clock = None):
+
+        # check argument values
+        if capacity is None or int(capacity) < 1:
+            raise ValueError("Buffer capacity must be at least one sample.")
+
+        # preallocate storage for all samples
+        self.capacity = int(capacity)
+        self.data = np.zeros(self.capacity, dtype = GAZE_DTYPE)
+        # time each sample was received, zero if there is no clock
+        self.clock = clock
+        self.receiveTimes = np.zeros(self.capacity, dtype = np.int64)
+
+        # the SDK writes from its own thread, consumers read from theirs
+        self.lock = threading.Lock()
+        # signalled every time a new sample is written
+        self.newSample = threading.Condition(self.lock)
+
+        # total number of samples ever written to the buffer
+        self.writeCount = 0
+        # total number of samples handed out by drain() or lost to overruns,
+        # the position of drain() only
+        self.readCount = 0
+        # number of samples overwritten before drain() got them. Without a
+        # drain() consumer it grows with every sample once the buffer is
+        # full, so it is not a count of lost samples for readSince()
+        self.overrunCount = 0
+
+
+    # function for copying one SDK gaze data dictionary into the buffer,
+    # called from the SDK callback thread so it must never block for long
+    def append(self, gazeData):
+
+        # build the record outside of the lock
+        receiveTime = self.clock() if self.clock is not None else 0
+        record = unpackGazeData(gazeData)
+
+        with self.lock:
+            index = self.writeCount % self.capacity
+            self.data[index] = record
+            self.receiveTimes[index] = receiveTime
+            self.writeCount += 1
+            # if the oldest undrained sample was just overwritten, count it
+            if self.writeCount - self.readCount > self.capacity:
+                self.readCount += 1
+                self.overrunCount += 1
+            # wake up anyone waiting for the next sample
+            self.newSample.notify_all()
+
+
+    # function for getting every sample written since the last call as a
+    # single contiguous structured array, oldest sample first
+    def drain(self):
+
+        with self.lock:
+            start, stop = self.readCount, self.writeCount
+            self.readCount = stop
+            return self._copyRange(start, stop)
+
+
+    # function for reading without draining, for consumers that keep their
+    # own position. Returns the samples written after the first sampleCount
+    # samples and the new sample count to pass in on the next call. Samples
+    # that were already overwritten are skipped
+    def readSince(self, sampleCount):
+
+        with self.lock:
+            stop = self.writeCount
+            start = max(sampleCount, stop - self.capacity)
+            return self._copyRange(start, stop), stop
+
+
+    # function for blocking until more than sampleCount samples have been 
+    # written, or until timeout (in seconds) runs out. Returns the number of
+    # samples written so far
+    def waitForSample(self, sampleCount, timeout = None):
+
+        with self.newSample:
+            if timeout is None:
+                while self.writeCount <= sampleCount:
+                    self.newSample.wait()
+            else:
+                endTime = time.time() + timeout
+                remaining = timeout
+                while self.writeCount <= sampleCount and remaining > 0:
+                    self.newSample.wait(remaining)
+                    remaining = endTime - time.time()
+            return self.writeCount
+
+
+    # copy samples start to stop (counted from the first sample ever written)
+    # out of the buffer, must be called with the lock held
+    def _copyRange(self, start, stop):
+
+        # nothing new
+        if start >= stop:
+            return np.zeros(0, dtype = GAZE_DTYPE)
+
+        first, last = start % self.capacity, stop % self.capacity
+        # samples do not wrap around the end of the buffer
+        if first < last:
+            return self.data[first:last].copy()
+        # samples wrap around, join both parts
+        return np.concatenate((self.data[first:], self.data[:last]))
+
+
+    # function for getting the most recent sample as a one record array,
+    # without removing anything from the buffer. Empty if nothing arrived yet
+    def latest(self):
+
+        with self.lock:
+            if self.writeCount == 0:
+                return np.zeros(0, dtype = GAZE_DTYPE)
+            last = (self.writeCount - 1) % self.capacity
+            return self.data[last:last + 1].copy()
+
+
+    # function for getting the most recent count samples, oldest first, and
+    # the time the newest one was received (zero if there is no clock), read
+    # together so the time belongs to the newest sample
+    def latestReceived(self, count = 1):
+
+        with self.lock:
+            if self.writeCount == 0:
+                return np.zeros(0, dtype = GAZE_DTYPE), 0
+            start = max(0, self.writeCount - count,
+                        self.writeCount - self.capacity)
+            last = (self.writeCount - 1) % self.capacity
+            return (self._copyRange(start, self.writeCount),
+                    int(self.receiveTimes[last]))
+
+
+    # number of samples waiting to be drained, at most capacity. Not changed
+    # by readSince()
+    def __len__(self):
+        return self.writeCount - self.readCount
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+# Gaze contingent drawing with end to end latency measurement
+
+# Summary: A GazeContingentDisplay is used inside the draw loop instead of
+# getAvgGazePos(). getGaze() returns the freshest sample in the gaze buffer
+# together with its age, and can extrapolate the gaze position to the time
+# of the next screen refresh. flip() flips the window and records, for the
+# sample drawn in that frame, how long each step took:
+#   CaptureToReceive  eyetracker time stamp to the SDK callback
+#   ReceiveToDraw     SDK callback to getGaze()
+#   DrawToFlip        getGaze() to the end of the flip
+#   CaptureToFlip     the whole chain
+# All times are taken on the SDK system clock, the clock of
+# SystemTimeStamp, and kept as fixed size histograms, so measuring costs the
+# same on the first and the millionth frame. getLatencyReport() summarizes
+# them for checking a latency budget.
+
+import numpy as np
+
+from . import gaze_buffer
+from .frame_timing import FrameTimer
+
+
+# -----Latency stages-----
+STAGES = ('CaptureToReceive', 'ReceiveToDraw', 'DrawToFlip', 'CaptureToFlip')
+
+
+# -----Class for gaze contingent drawing-----
+class GazeContingentDisplay:
+
+    # tobiiHelper must be collecting gaze data. win is the psychopy window
+    # flipped by flip(). With predict, gaze is extrapolated to the next
+    # refresh from the velocity over the last velocityWindow seconds, but
+    # never by more than maxPrediction seconds. frameRate (Hz) is measured
+    # from the flips by a FrameTimer if not given. Histograms have binWidth ms wide bins up
+    # to maxLatency ms, longer latencies are counted in the last bin
+    def __init__(self, tobiiHelper, win = None, predict = False,
+                 frameRate = None, velocityWindow = 0.02,
+                 maxPrediction = 0.05, binWidth = 0.5, maxLatency = 100.0):
+
+        # check argument values
+        if tobiiHelper is None:
+            raise ValueError("No TobiiHelper given to read gaze data from.")
+        if frameRate is not None and frameRate <= 0:
+            raise ValueError("frameRate must be a positive number of Hz.")
+        if binWidth <= 0 or maxLatency <= binWidth:
+            raise ValueError("binWidth must be positive and smaller than " +
+                             "maxLatency.")
+
+        self.tobiiHelper = tobiiHelper
+        self.win = win
+        self.clock = tobiiHelper.backend.get_system_time_stamp
+        self.predict = predict
+        self.velocityWindow = velocityWindow * 1e6
+        self.maxPrediction = maxPrediction * 1e6
+
+        # refresh period, measured from the flips if not given, and the time
+        # of the last flip in microseconds
+        self.frameTimer = FrameTimer(1.0 / frameRate if frameRate is not None
+                                     else None)
+        self.lastFlipTime = None
+
+        # latency histograms
+        self.binWidth = float(binWidth)
+        self.numBins = int(np.ceil(maxLatency / self.binWidth))
+        self.reset()
+
+
+    # function for clearing the latency histograms
+    def reset(self):
+
+        self.histograms = dict((stage, np.zeros(self.numBins, dtype = np.int64))
+                               for stage in STAGES)
+        self.latencySums = dict((stage, 0.0) for stage in STAGES)
+        self.latencyMax = dict((stage, 0.0) for stage in STAGES)
+        # frames flipped, and how many of them showed a sample
+        self.frameCount = 0
+        self.measuredFrames = 0
+        # time stamps of the sample returned by getGaze(), until the flip
+        self.pending = None
+
+
+    # function for getting the freshest gaze position, as a dictionary with
+    # AvgGazePointX and AvgGazePointY (ada units, nan if gaze was lost),
+    # SystemTimeStamp of the sample, SampleAge (ms), and PredictionTime (ms
+    # the position was extrapolated by, zero without prediction). Returns
+    # None if no sample has arrived yet
+    def getGaze(self):
+
+        if not self.tobiiHelper.tracking:
+            raise ValueError("Data is not being recorded by the eyetracker.")
+
+        # enough recent samples to measure velocity
+        count = 1
+        frequency = self.tobiiHelper.gazeFrequency
+        if self.predict and frequency:
+            count = int(np.ceil(self.velocityWindow * frequency / 1e6)) + 1
+        samples, receiveTime = self.tobiiHelper.gazeBuffer.latestReceived(count)
+        drawTime = self.clock()
+        if len(samples) == 0:
+            return None
+
+        positions = gaze_buffer.avgGazePos(samples)
+        gazePos = positions[-1]
+        captureTime = int(samples['system_time_stamp'][-1])
+
+        # extrapolate to the next refresh
+        predictionTime = 0.0
+        if self.predict and len(samples) > 1:
+            horizon = self._timeToNextFlip(drawTime) + drawTime - captureTime
+            gazePos, predictionTime = self._extrapolate(samples, positions,
+                                                        horizon)
+
+        self.pending = (captureTime, receiveTime, drawTime)
+        return {'AvgGazePointX': float(gazePos[0]),
+                'AvgGazePointY': float(gazePos[1]),
+                'SystemTimeStamp': captureTime,
+                'SampleAge': (drawTime - captureTime) / 1000.0,
+                'PredictionTime': predictionTime / 1000.0}
+
+
+    # function for flipping the window and recording the latency of the
+    # sample drawn in this frame
+    def flip(self):
+
+        if self.win is None:
+            raise ValueError("No psychopy window given, try calling " +
+                             "recordFlip() after flipping yourself.")
+        self.win.flip()
+        self.recordFlip()
+
+
+    # function for recording a flip that just happened, for when the window
+    # is flipped elsewhere
+    def recordFlip(self):
+
+        flipTime = self.clock()
+        self.frameCount += 1
+        self.frameTimer.recordFlip(flipTime / 1e6)
+        self.lastFlipTime = flipTime
+
+        # nothing was drawn from gaze this frame
+        if self.pending is None:
+            return
+        captureTime, receiveTime, drawTime = self.pending
+        self.pending = None
+        self.measuredFrames += 1
+
+        latencies = {'DrawToFlip': flipTime - drawTime,
+                     'CaptureToFlip': flipTime - captureTime}
+        # receive times are only known if the gaze buffer has a clock
+        if receiveTime:
+            latencies['CaptureToReceive'] = receiveTime - captureTime
+            latencies['ReceiveToDraw'] = drawTime - receiveTime
+        for stage, latency in latencies.items():
+            self._addLatency(stage, latency / 1000.0)
+
+
+    # function for summarizing the latency of every stage in ms, as count,
+    # mean, max, and the 50th, 95th, and 99th percentile (upper edge of the
+    # histogram bin), plus the number of frames flipped and measured
+    def getLatencyReport(self):
+
+        report = {'FrameCount': self.frameCount,
+                  'MeasuredFrames': self.measuredFrames}
+        for stage in STAGES:
+            counts = self.histograms[stage]
+            total = int(counts.sum())
+            if total == 0:
+                report[stage] = {'count': 0}
+                continue
+            cumulative = np.cumsum(counts)
+            report[stage] = {'count': total,
+                             'mean': self.latencySums[stage] / total,
+                             'max': self.latencyMax[stage]}
+            for name, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+                index = int(np.searchsorted(cumulative, q * total))
+                report[stage][name] = (index + 1) * self.binWidth
+        return report
+
+
+    # count one latency (ms) in the histogram of its stage
+    def _addLatency(self, stage, latency):
+
+        index = min(max(int(latency / self.binWidth), 0), self.numBins - 1)
+        self.histograms[stage][index] += 1
+        self.latencySums[stage] += latency
+        if latency > self.latencyMax[stage]:
+            self.latencyMax[stage] = latency
+
+
+    # microseconds from now until the next refresh, zero until the refresh
+    # period is known
+    def _timeToNextFlip(self, now):
+
+        if not self.frameTimer.periodMeasured or self.lastFlipTime is None:
+            return 0.0
+        framePeriod = self.frameTimer.framePeriod * 1e6
+        elapsed = now - self.lastFlipTime
+        framesAhead = max(1.0, np.ceil(elapsed / framePeriod))
+        return self.lastFlipTime + framesAhead * framePeriod - now
+
+
+    # extrapolate the newest position horizon microseconds ahead from the
+    # velocity between the oldest and newest valid samples, returns the
+    # position and how far ahead it is
+    def _extrapolate(self, samples, positions, horizon):
+
+        gazePos = positions[-1]
+        valid = ~np.isnan(positions).any(axis = 1)
+        if not valid[-1] or valid.sum() < 2:
+            return gazePos, 0.0
+        times = samples['system_time_stamp'][valid]
+        validPositions = positions[valid]
+        dt = float(times[-1] - times[0])
+        if dt <= 0:
+            return gazePos, 0.0
+
+        horizon = min(max(horizon, 0.0), self.maxPrediction)
+        velocity = (validPositions[-1] - validPositions[0]) / dt
+        return gazePos + velocity * horizon, horizon
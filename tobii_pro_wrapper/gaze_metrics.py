@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+# Accuracy, precision, and validity of gaze samples collected at targets
+
+# Summary: Gaze samples collected while looking at known targets, during a
+# calibration or a validation, are held as flat arrays with the id of the
+# target each sample belongs to. Every per target statistic is then a
+# grouped reduction (np.bincount over the target ids), computed for all
+# targets and samples at once instead of looping over them. For each eye
+# and target this gives the mean gaze position, accuracy (mean angular
+# offset from the target, in degrees and in pixels), precision as the RMS of
+# sample to sample distances (RMS-S2S) and as the standard deviation (SD)
+# around the mean, both in degrees, and the fraction of valid samples.
+# Distances on the display area are converted to degrees of visual angle
+# with the display area size and the eye to screen distance.
+
+import numpy as np
+
+
+# eye to screen distance (mm) used when it is unknown
+DEFAULT_EYE_DISTANCE = 650.0
+
+# -----Layout of the samples of a calibration result-----
+# validity is True where the SDK marked the sample valid and used
+CALIBRATION_SAMPLE_DTYPE = np.dtype([
+    ('Point', np.int32),
+    ('Left', np.float64, (2,)),
+    ('LeftValidity', np.bool_),
+    ('Right', np.float64, (2,)),
+    ('RightValidity', np.bool_)])
+
+# -----Layout of the metrics of one target-----
+# positions in ada units, accuracy and precision in degrees unless marked
+# Pix, validity as the fraction of valid samples
+EYES = ('Left', 'Right')
+METRICS_DTYPE = np.dtype(
+    [('PointX', np.float64), ('PointY', np.float64),
+     ('SampleCount', np.int32)] +
+    [(eye + name, np.float64) for eye in EYES
+     for name in ('MeanX', 'MeanY', 'Accuracy', 'AccuracyPix', 'PrecisionRMS',
+                  'PrecisionSD', 'Validity')])
+
+
+# function for unpacking an SDK calibration result in a single pass, returns
+# the (P, 2) array of calibration point positions and one
+# CALIBRATION_SAMPLE_DTYPE record per sample, with the index of its point.
+# validAndUsed is the backend's VALIDITY_VALID_AND_USED
+def unpackCalibrationResult(calibResult, validAndUsed):
+
+    targets = []
+    rows = []
+    for pointId, point in enumerate(calibResult.calibration_points):
+        targets.append(tuple(point.position_on_display_area))
+        rows.extend((pointId,
+                     tuple(sample.left_eye.position_on_display_area),
+                     sample.left_eye.validity == validAndUsed,
+                     tuple(sample.right_eye.position_on_display_area),
+                     sample.right_eye.validity == validAndUsed)
+                    for sample in point.calibration_samples)
+
+    return (np.array(targets, dtype = np.float64).reshape(-1, 2),
+            np.array(rows, dtype = CALIBRATION_SAMPLE_DTYPE))
+
+
+# mean of the values in each group, given the number of values per group,
+# nan for empty groups (call with division warnings turned off)
+def _groupMean(groups, values, counts):
+    return np.bincount(groups, weights = values,
+                       minlength = len(counts)) / counts
+
+
+# angle in degrees of offsets given in mm, seen from eyeDistance mm away
+def _degrees(offsetsMm, eyeDistance):
+    return np.degrees(np.arctan(np.sqrt(np.sum(offsetsMm ** 2, axis = -1)) /
+                                eyeDistance))
+
+
+# function for computing the metrics of every target at once. targets is a
+# (P, 2) array of target positions, pointIds gives the target of each of
+# the N samples, eyes maps 'Left' and 'Right' to an (N, 2) array of gaze
+# positions and an (N,) array that is True for valid samples. Positions are
+# in ada units, displaySize is the (width, height) of the display area in
+# mm, eyeDistance (mm) is a single value or one per sample, and sizePix is
+# the monitor size for accuracy in pixels (nan without it). Samples of a
+# target must be in the order they were collected. Returns one METRICS_DTYPE
+# record per target
+def computeMetrics(targets, pointIds, eyes, displaySize,
+                   eyeDistance = DEFAULT_EYE_DISTANCE, sizePix = None):
+
+    targets = np.asarray(targets, dtype = np.float64).reshape(-1, 2)
+    pointIds = np.asarray(pointIds, dtype = np.intp)
+    displaySize = np.asarray(displaySize, dtype = np.float64)
+    eyeDistance = np.broadcast_to(np.asarray(eyeDistance, dtype = np.float64),
+                                  pointIds.shape)
+    numPoints = len(targets)
+
+    metrics = np.zeros(numPoints, dtype = METRICS_DTYPE)
+    metrics['PointX'] = targets[:, 0]
+    metrics['PointY'] = targets[:, 1]
+    total = np.bincount(pointIds, minlength = numPoints)
+    metrics['SampleCount'] = total
+
+    # empty groups give nan
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        for eye in EYES:
+            _eyeMetrics(metrics, eye, eyes[eye], targets, pointIds, total,
+                        displaySize, eyeDistance, sizePix)
+    return metrics
+
+
+# metrics of one eye, filled into the metrics array
+def _eyeMetrics(metrics, eye, eyeSamples, targets, pointIds, total,
+                displaySize, eyeDistance, sizePix):
+
+    positions, valid = eyeSamples
+    valid = np.asarray(valid, dtype = bool)
+    ids = pointIds[valid]
+    positions = np.asarray(positions, dtype = np.float64)[valid]
+    distance = eyeDistance[valid]
+    counts = np.bincount(ids, minlength = len(targets)).astype(np.float64)
+
+    metrics[eye + 'Validity'] = counts / total
+
+    # mean gaze position
+    means = np.column_stack((_groupMean(ids, positions[:, 0], counts),
+                             _groupMean(ids, positions[:, 1], counts)))
+    metrics[eye + 'MeanX'] = means[:, 0]
+    metrics[eye + 'MeanY'] = means[:, 1]
+
+    # accuracy, mean offset of each sample from its target
+    offsets = positions - targets[ids]
+    metrics[eye + 'Accuracy'] = _groupMean(
+            ids, _degrees(offsets * displaySize, distance), counts)
+    if sizePix is not None:
+        offsetsPix = offsets * np.asarray(sizePix, dtype = np.float64)
+        metrics[eye + 'AccuracyPix'] = _groupMean(
+                ids, np.sqrt(np.sum(offsetsPix ** 2, axis = 1)), counts)
+    else:
+        metrics[eye + 'AccuracyPix'] = np.nan
+
+    # precision as the spread around the mean
+    spread = _degrees((positions - means[ids]) * displaySize, distance)
+    metrics[eye + 'PrecisionSD'] = np.sqrt(_groupMean(ids, spread ** 2,
+                                                      counts))
+
+    # precision as the distance between successive valid samples of the
+    # same target
+    successive = ids[1:] == ids[:-1]
+    steps = _degrees((positions[1:] - positions[:-1])[successive] *
+                     displaySize, distance[1:][successive])
+    stepIds = ids[1:][successive]
+    stepCounts = np.bincount(stepIds, minlength = len(targets))
+    metrics[eye + 'PrecisionRMS'] = np.sqrt(_groupMean(stepIds, steps ** 2,
+                                                       stepCounts))
+
+
+# function for finding targets that were not really shown: targets without
+# a single valid sample from either eye, and targets outside the display
+# area. Returns True for each real target
+def realPoints(metrics):
+
+    inside = (metrics['PointX'] > 0) & (metrics['PointX'] < 1) & \
+             (metrics['PointY'] > 0) & (metrics['PointY'] < 1)
+    anyValid = (metrics['LeftValidity'] > 0) | (metrics['RightValidity'] > 0)
+    return inside & anyValid
+
+
+# function for checking metrics against thresholds. An eye passes a target
+# if its accuracy and RMS-S2S precision (degrees) are within maxAccuracy and
+# maxPrecision and at least minValidity of its samples are valid. A target
+# passes if all of the given eyes pass. With maxPrecision None precision is
+# not checked. Returns True for each target passed
+def checkMetrics(metrics, maxAccuracy = 1.0, maxPrecision = 0.5,
+                 minValidity = 0.8, eyes = EYES):
+
+    passed = np.ones(len(metrics), dtype = bool)
+    for eye in eyes:
+        # nan, e.g. an eye that was never found, never passes
+        passed &= (metrics[eye + 'Accuracy'] <= maxAccuracy) & \
+                  (metrics[eye + 'Validity'] >= minValidity)
+        if maxPrecision is not None:
+            passed &= metrics[eye + 'PrecisionRMS'] <= maxPrecision
+    return passed
+
+
+# function for averaging the accuracy, precision, and validity of each eye
+# over all targets, ignoring targets where an eye has no value. Returns a
+# dictionary with keys like LeftAccuracy
+def summarizeMetrics(metrics):
+
+    summary = {}
+    for eye in EYES:
+        for name in ('Accuracy', 'AccuracyPix', 'PrecisionRMS', 'PrecisionSD',
+                     'Validity'):
+            values = metrics[eye + name]
+            values = values[~np.isnan(values)]
+            summary[eye + name] = float(np.mean(values)) if len(values) \
+                else float('nan')
+    return summary
@@ -0,0 +1,465 @@
+# -*- coding: utf-8 -*-
+
+# Streaming live gaze samples to other programs over sockets
+
+# Summary: A GazePublisher reads new samples from a gaze buffer every
+# batchInterval seconds and sends them as binary frames to every connected
+# GazeSubscriber, e.g. a monitoring station or analysis workers, over TCP
+# (address given as (host, port)) or a Unix socket (address given as a
+# path). Each frame starts with a magic string, a frame type, and the
+# payload length. A subscriber first receives a handshake frame with the
+# record layout as JSON, then sample frames holding a frame number, the
+# position of the first sample in the gaze stream, and the raw GAZE_DTYPE
+# records, which the subscriber turns back into an array without parsing.
+# Every subscriber has its own queue of frames and its own sending thread,
+# so a slow subscriber can not hold up the others, unless asked to: when a
+# queue is full the 'drop-oldest' policy drops the oldest frame, and the
+# 'block' policy makes the publisher wait for the subscriber to catch up.
+# getStats() reports for every subscriber what was sent, queued, and
+# dropped, and how far it lags behind, in samples and in time.
+
+import collections
+import json
+import os
+import socket
+import struct
+import threading
+
+import numpy as np
+
+from .gaze_buffer import GAZE_DTYPE
+from .recorder import _dtypeFromDescr
+
+
+# -----Frame layout-----
+# magic, frame type, payload length
+FRAME_HEADER = struct.Struct('<4sBI')
+FRAME_MAGIC = b'TPWG'
+HANDSHAKE_FRAME = 0
+SAMPLES_FRAME = 1
+# frame number and position of the first sample, followed by the records
+SAMPLES_HEADER = struct.Struct('<Qq')
+STREAM_VERSION = 1
+
+POLICIES = ('drop-oldest', 'block')
+
+
+# function for packing a frame
+def _packFrame(frameType, payload):
+    return FRAME_HEADER.pack(FRAME_MAGIC, frameType, len(payload)) + payload
+
+
+# function for reading exactly size bytes from a socket, returns None if the
+# connection was closed first
+def _receiveExactly(sock, size):
+
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+# function for making a socket for an address, (host, port) for TCP or a
+# path for a Unix socket
+def _makeSocket(address):
+
+    if isinstance(address, tuple):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # frames are sent as soon as they are ready
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+    if not hasattr(socket, 'AF_UNIX'):
+        raise ValueError("Unix sockets are not available here, give the " +
+                         "address as (host, port).")
+    return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+
+# -----Class for one subscriber connected to a GazePublisher-----
+class _Subscription:
+
+    def __init__(self, publisher, sock, address):
+
+        self.publisher = publisher
+        self.sock = sock
+        self.address = address
+        # frames waiting to be sent, as (frame, sample count, position after
+        # its last sample, system time stamp of its last sample)
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.closed = False
+
+        self.sentFrames = 0
+        self.sentSamples = 0
+        self.sentBytes = 0
+        self.droppedFrames = 0
+        self.droppedSamples = 0
+        # position after the last sample sent and its system time stamp
+        self.sentPosition = None
+        self.sentTime = None
+
+        self.thread = threading.Thread(target = self._run,
+                                       name = 'GazeSubscription')
+        self.thread.daemon = True
+
+
+    # add a frame, applying the publisher's policy if the queue is full
+    def put(self, frame, numSamples, endPosition, lastTime):
+
+        stopEvent = self.publisher.stopEvent
+        with self.condition:
+            while len(self.queue) >= self.publisher.maxQueue and \
+                    not self.closed:
+                if self.publisher.policy == 'block':
+                    # give up waiting when the publisher stops
+                    if stopEvent.is_set():
+                        return
+                    self.condition.wait(0.1)
+                else:
+                    dropped = self.queue.popleft()
+                    self.droppedFrames += 1
+                    self.droppedSamples += dropped[1]
+            if self.closed:
+                return
+            self.queue.append((frame, numSamples, endPosition, lastTime))
+            self.condition.notify_all()
+
+
+    # sending thread
+    def _run(self):
+
+        try:
+            while True:
+                with self.condition:
+                    while not self.queue and not self.closed:
+                        self.condition.wait()
+                    if self.closed:
+                        return
+                    frame, numSamples, endPosition, lastTime = \
+                        self.queue.popleft()
+                    # room for a publisher that is blocked
+                    self.condition.notify_all()
+                self.sock.sendall(frame)
+                self.sentFrames += 1
+                self.sentSamples += numSamples
+                self.sentBytes += len(frame)
+                self.sentPosition = endPosition
+                self.sentTime = lastTime
+        except socket.error:
+            # the subscriber went away
+            pass
+        finally:
+            self.close()
+            self.publisher._removeSubscription(self)
+
+
+    # stop sending and close the connection
+    def close(self):
+
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify_all()
+        try:
+            # wakes up a sending thread blocked on a full socket, which
+            # close() alone does not
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+
+
+    # lag and counters of this subscriber
+    def getStats(self, position, now):
+
+        with self.condition:
+            queuedSamples = sum(entry[1] for entry in self.queue)
+            queuedFrames = len(self.queue)
+        sentPosition = self.sentPosition
+        sentTime = self.sentTime
+        return {'Address': self.address,
+                'SentFrames': self.sentFrames,
+                'SentSamples': self.sentSamples,
+                'SentBytes': self.sentBytes,
+                'QueuedFrames': queuedFrames,
+                'QueuedSamples': queuedSamples,
+                'DroppedFrames': self.droppedFrames,
+                'DroppedSamples': self.droppedSamples,
+                'LagSamples': position - sentPosition
+                if sentPosition is not None else None,
+                'LagTime': (now - sentTime) / 1000.0
+                if sentTime is not None and now else None}
+
+
+# -----Class for sending gaze samples to subscribers-----
+class GazePublisher:
+
+    # gazeBuffer is read from (a GazeRingBuffer, or the ring of an
+    # acquisition server), address is (host, port), port 0 picks a free
+    # one, or the path of a Unix socket. Samples are read every
+    # batchInterval seconds, at most maxQueue frames wait per subscriber.
+    # clock (e.g. the SDK's get_system_time_stamp) gives lag in time
+    def __init__(self, gazeBuffer, address = ('127.0.0.1', 0),
+                 policy = 'drop-oldest', maxQueue = 100,
+                 batchInterval = 0.01, clock = None, info = None):
+
+        # check argument values
+        if gazeBuffer is None:
+            raise ValueError("No gaze buffer given to publish from.")
+        if policy not in POLICIES:
+            raise ValueError("policy must be one of " + ", ".join(POLICIES) +
+                             ".")
+        if maxQueue is None or maxQueue < 1:
+            raise ValueError("maxQueue must be at least one frame.")
+        if batchInterval is None or batchInterval <= 0:
+            raise ValueError("batchInterval must be a positive number of " +
+                             "seconds.")
+
+        self.gazeBuffer = gazeBuffer
+        self.address = address
+        self.policy = policy
+        self.maxQueue = int(maxQueue)
+        self.batchInterval = batchInterval
+        self.clock = clock if clock is not None else gazeBuffer.clock
+        # extra information for the handshake, e.g. the gaze frequency
+        self.info = info or {}
+
+        self.subscriptions = []
+        self.subscriptionLock = threading.Lock()
+        self.frameCount = 0
+        self.position = 0
+        self.lostCount = 0
+
+        self.listener = None
+        self.threads = []
+        self.stopEvent = threading.Event()
+
+
+    # function for listening for subscribers and starting to publish, only
+    # samples arriving after this call are sent. Returns the address
+    # subscribers connect to
+    def start(self):
+
+        if self.listener is not None:
+            raise ValueError("Publisher is already running.")
+
+        self.listener = _makeSocket(self.address)
+        if isinstance(self.address, tuple):
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR,
+                                     1)
+        self.listener.bind(self.address)
+        self.listener.listen(8)
+        # the port that was picked
+        self.address = self.listener.getsockname()
+        self.listener.settimeout(0.1)
+
+        self.position = self.gazeBuffer.writeCount
+        self.stopEvent.clear()
+        self.threads = [threading.Thread(target = self._accept,
+                                         name = 'GazePublisherAccept'),
+                        threading.Thread(target = self._publish,
+                                         name = 'GazePublisher')]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+        return self.address
+
+
+    # function for disconnecting every subscriber and stopping
+    def stop(self):
+
+        if self.listener is None:
+            return
+        self.stopEvent.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self.listener.close()
+        self.listener = None
+        # a Unix socket leaves its file behind
+        if not isinstance(self.address, tuple) and \
+                os.path.exists(self.address):
+            os.remove(self.address)
+        with self.subscriptionLock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            subscription.close()
+        for subscription in subscriptions:
+            if subscription.thread is not threading.current_thread():
+                subscription.thread.join()
+
+
+    # function for getting the counters of every connected subscriber, as a
+    # list of dictionaries. LagSamples is how many samples have arrived in
+    # the gaze buffer that the subscriber has not been sent, LagTime (ms) the
+    # age of the last sample sent
+    def getStats(self):
+
+        now = self.clock() if self.clock is not None else None
+        position = self.gazeBuffer.writeCount
+        with self.subscriptionLock:
+            subscriptions = list(self.subscriptions)
+        return [subscription.getStats(position, now)
+                for subscription in subscriptions]
+
+
+    # number of connected subscribers
+    def __len__(self):
+        return len(self.subscriptions)
+
+
+    # thread accepting subscribers and sending them the handshake
+    def _accept(self):
+
+        handshake = dict(self.info)
+        handshake.update({'version': STREAM_VERSION,
+                          'dtype': GAZE_DTYPE.descr})
+        handshake = _packFrame(HANDSHAKE_FRAME,
+                               json.dumps(handshake).encode('ascii'))
+
+        while not self.stopEvent.is_set():
+            try:
+                sock, address = self.listener.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                if self.stopEvent.is_set():
+                    return
+                raise
+            sock.settimeout(None)
+            try:
+                sock.sendall(handshake)
+            except socket.error:
+                sock.close()
+                continue
+            subscription = _Subscription(self, sock, address)
+            with self.subscriptionLock:
+                self.subscriptions.append(subscription)
+            subscription.thread.start()
+
+
+    # thread reading new samples and queueing them for every subscriber
+    def _publish(self):
+
+        while not self.stopEvent.wait(self.batchInterval):
+            lastPosition = self.position
+            samples, self.position = self.gazeBuffer.readSince(lastPosition)
+            # samples overwritten in the buffer before they were read
+            self.lostCount += (self.position - lastPosition) - len(samples)
+            if len(samples) == 0:
+                continue
+
+            firstPosition = self.position - len(samples)
+            frame = _packFrame(SAMPLES_FRAME,
+                               SAMPLES_HEADER.pack(self.frameCount,
+                                                   firstPosition) +
+                               samples.tobytes())
+            self.frameCount += 1
+            lastTime = int(samples['system_time_stamp'][-1])
+
+            with self.subscriptionLock:
+                subscriptions = list(self.subscriptions)
+            for subscription in subscriptions:
+                subscription.put(frame, len(samples), self.position, lastTime)
+
+
+    # forget a subscriber that disconnected
+    def _removeSubscription(self, subscription):
+
+        with self.subscriptionLock:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+
+
+# -----Class for receiving gaze samples from a GazePublisher-----
+class GazeSubscriber:
+
+    # address as given by GazePublisher.start(). timeout (seconds) applies
+    # to connecting and to every receive, None waits forever
+    def __init__(self, address, timeout = 5.0):
+
+        self.address = address
+        self.sock = _makeSocket(address)
+        self.sock.settimeout(timeout)
+        self.sock.connect(address)
+
+        # record layout and information sent by the publisher
+        frame = self._receiveFrame()
+        if frame is None:
+            self.sock.close()
+            raise ValueError("The publisher at " + str(address) + " closed " +
+                             "the connection before the handshake.")
+        frameType, payload = frame
+        if frameType != HANDSHAKE_FRAME:
+            self.sock.close()
+            raise ValueError("Expected a handshake from the publisher, got " +
+                             "frame type " + str(frameType) + ".")
+        self.info = json.loads(payload.decode('ascii'))
+        if self.info.get('version') != STREAM_VERSION:
+            self.sock.close()
+            raise ValueError("The publisher streams version " +
+                             str(self.info.get('version')) + ".")
+        self.dtype = _dtypeFromDescr(self.info['dtype'])
+
+        self.frameCount = 0
+        self.sampleCount = 0
+        # samples missing between frames, dropped for being too slow
+        self.missedSamples = 0
+        self.nextPosition = None
+
+
+    # function for receiving the next frame of samples as a structured
+    # array, or None if the publisher closed the connection
+    def receive(self):
+
+        frame = self._receiveFrame()
+        if frame is None:
+            return None
+        frameType, payload = frame
+        if frameType != SAMPLES_FRAME:
+            raise ValueError("Unexpected frame type " + str(frameType))
+
+        frameNumber, firstPosition = SAMPLES_HEADER.unpack_from(payload)
+        samples = np.frombuffer(payload, dtype = self.dtype,
+                                offset = SAMPLES_HEADER.size)
+        if self.nextPosition is not None and \
+                firstPosition > self.nextPosition:
+            self.missedSamples += firstPosition - self.nextPosition
+        self.nextPosition = firstPosition + len(samples)
+        self.frameCount += 1
+        self.sampleCount += len(samples)
+        return samples
+
+
+    # function for iterating over frames until the publisher closes
+    def __iter__(self):
+
+        while True:
+            samples = self.receive()
+            if samples is None:
+                return
+            yield samples
+
+
+    # function for disconnecting
+    def close(self):
+        self.sock.close()
+
+
+    # read one frame, returns (type, payload) or None at the end
+    def _receiveFrame(self):
+
+        header = _receiveExactly(self.sock, FRAME_HEADER.size)
+        if header is None:
+            return None
+        magic, frameType, length = FRAME_HEADER.unpack(header)
+        if magic != FRAME_MAGIC:
+            raise ValueError("Not a gaze stream.")
+        payload = _receiveExactly(self.sock, length)
+        if payload is None:
+            return None
+        return frameType, payload
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+# Deferred imports for the heavy optional dependencies of TobiiHelper
+
+# Summary: gtk, psychopy, and the Tobii Pro SDK take seconds to import and
+# are missing on headless acquisition machines, but most of TobiiHelper
+# (gaze buffering, recording, coordinate conversion) never uses them. A
+# LazyModule stands in for such a module at import time and only imports the
+# real module the first time one of its attributes is used, so importing
+# tobii_pro_wrapper stays fast and an ImportError is raised by the function
+# that actually needs the missing dependency.
+
+import importlib
+
+
+# -----Class standing in for a module until it is first used-----
+class LazyModule:
+
+    def __init__(self, name):
+
+        # stored directly in the instance so __getattr__ is never involved
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+
+    # function for importing the real module, once, and returning it
+    def _load(self):
+
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+
+    # function for checking whether the module has been imported yet
+    def isLoaded(self):
+        return self._module is not None
+
+
+    # only called for attributes the proxy itself does not have
+    def __getattr__(self, attr):
+
+        # never import the module for special method lookups
+        if attr.startswith('__') and attr.endswith('__'):
+            raise AttributeError(attr)
+        return getattr(self._load(), attr)
+
+
+    def __repr__(self):
+        state = 'loaded' if self.isLoaded() else 'not loaded'
+        return "<lazy module '" + self._name + "' (" + state + ")>"
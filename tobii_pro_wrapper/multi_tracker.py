@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+# Recording from several eyetrackers at once
+
+# Summary: A TobiiHelper talks to a single eyetracker. A MultiTrackerManager
+# connects to any number of eyetrackers by serial number, e.g. for dual
+# participant setups, and gives each one a TrackerDevice with its own gaze
+# buffer, clock model, and counters. The SDK calls each eyetracker's
+# callbacks from its own thread, and a callback only touches the state of
+# its own device (the buffer lock is never shared), so a slow or stalled
+# eyetracker can not hold up the others. Samples of every eyetracker are
+# put on the common system clock by mapping their device time stamps with
+# the device's ClockModel, fitted to its time synchronization packets, and
+# can be read per eyetracker or merged into a single time ordered stream.
+# getStats() reports the sample rate of each eyetracker, samples it skipped
+# (gaps in device time), and samples overwritten in its buffer before read()
+# got them.
+
+import collections
+
+import numpy as np
+
+from .clock_sync import ClockModel
+from .gaze_buffer import GAZE_DTYPE, GazeRingBuffer
+from .lazy_import import LazyModule
+
+tobii = LazyModule('tobii_research')
+
+
+# gaps in device time longer than this many sample periods count as
+# skipped samples
+GAP_THRESHOLD = 1.5
+
+
+# -----Class for one eyetracker of a MultiTrackerManager-----
+class TrackerDevice:
+
+    def __init__(self, backend, eyetracker, bufferCapacity = 72000):
+
+        self.backend = backend
+        self.eyetracker = eyetracker
+        self.serialNumber = eyetracker.serial_number
+        self.gazeBuffer = GazeRingBuffer(
+                bufferCapacity, clock = backend.get_system_time_stamp)
+        self.clockModel = ClockModel()
+        self.tracking = False
+
+        self.frequency = None
+        self.startTime = None
+        self.stopTime = None
+        self.startCount = 0
+        # samples the eyetracker skipped, found from gaps in device time
+        self.droppedCount = 0
+        self.lastDeviceTime = None
+        self.samplePeriod = None
+
+
+    # function called by the SDK for every sample of this eyetracker
+    def gazeDataCallback(self, gazeData):
+
+        self.gazeBuffer.append(gazeData)
+        deviceTime = gazeData['device_time_stamp']
+        lastDeviceTime = self.lastDeviceTime
+        self.lastDeviceTime = deviceTime
+        if lastDeviceTime is not None:
+            gap = deviceTime - lastDeviceTime
+            if gap > GAP_THRESHOLD * self.samplePeriod:
+                self.droppedCount += int(round(gap / self.samplePeriod)) - 1
+
+
+    # function called by the SDK for every time synchronization packet
+    def timeSyncCallback(self, timeSyncData):
+        self.clockModel.addSyncData(timeSyncData)
+
+
+    # function for subscribing to gaze and time synchronization data
+    def start(self):
+
+        if self.tracking:
+            return
+        self.frequency = self.eyetracker.get_gaze_output_frequency()
+        self.samplePeriod = 1e6 / self.frequency
+        self.lastDeviceTime = None
+        self.droppedCount = 0
+        self.clockModel.reset()
+        self.startTime = self.backend.get_system_time_stamp()
+        self.stopTime = None
+        self.startCount = self.gazeBuffer.writeCount
+
+        self.eyetracker.subscribe_to(
+                self.backend.EYETRACKER_TIME_SYNCHRONIZATION_DATA,
+                self.timeSyncCallback, as_dictionary = True)
+        self.eyetracker.subscribe_to(self.backend.EYETRACKER_GAZE_DATA,
+                                     self.gazeDataCallback,
+                                     as_dictionary = True)
+        self.tracking = True
+
+
+    # function for unsubscribing from gaze and time synchronization data
+    def stop(self):
+
+        if not self.tracking:
+            return
+        self.eyetracker.unsubscribe_from(self.backend.EYETRACKER_GAZE_DATA,
+                                         self.gazeDataCallback)
+        self.eyetracker.unsubscribe_from(
+                self.backend.EYETRACKER_TIME_SYNCHRONIZATION_DATA,
+                self.timeSyncCallback)
+        self.stopTime = self.backend.get_system_time_stamp()
+        self.tracking = False
+
+
+    # function for getting the common clock time (system time stamps in
+    # microseconds, float64) of samples from this eyetracker. Until the clock
+    # model has a packet, the SDK's own system time stamps are used
+    def commonTimes(self, samples):
+
+        if self.clockModel.isFitted():
+            return self.clockModel.deviceToSystem(samples['device_time_stamp'])
+        return samples['system_time_stamp'].astype(np.float64)
+
+
+    # function for getting the counters of this eyetracker as a dictionary
+    def getStats(self):
+
+        if self.startTime is None:
+            raise ValueError("Eyetracker " + self.serialNumber + " has not " +
+                             "been started.")
+        endTime = self.stopTime if self.stopTime is not None \
+            else self.backend.get_system_time_stamp()
+        elapsed = (endTime - self.startTime) / 1e6
+        sampleCount = self.gazeBuffer.writeCount - self.startCount
+        drift = self.clockModel.getDrift() if self.clockModel.isFitted() \
+            else {'DriftPPM': float('nan'), 'ResidualSD': float('nan')}
+
+        return {'SerialNumber': self.serialNumber,
+                'Tracking': self.tracking,
+                'Frequency': self.frequency,
+                'Duration': elapsed,
+                'SampleCount': sampleCount,
+                'SampleRate': sampleCount / elapsed if elapsed > 0 else 0.0,
+                'DroppedCount': self.droppedCount,
+                'OverrunCount': self.gazeBuffer.overrunCount,
+                'DriftPPM': drift['DriftPPM'],
+                'ClockResidualSD': drift['ResidualSD']}
+
+
+# -----Class for connecting to and reading from several eyetrackers-----
+class MultiTrackerManager:
+
+    # backend as for TobiiHelper, the Tobii Pro SDK unless given.
+    # bufferCapacity is the size of each eyetracker's gaze buffer
+    def __init__(self, backend = None, bufferCapacity = 72000):
+
+        # use the Tobii Pro SDK unless told otherwise
+        if backend is None:
+            try:
+                backend = tobii._load()
+            except ImportError:
+                raise ImportError("The Tobii Pro SDK (tobii_research) is " +
+                                  "not installed. Install it, or pass a " +
+                                  "simulated backend.")
+        self.backend = backend
+        self.bufferCapacity = bufferCapacity
+        # TrackerDevice for each serial number, in the order connected
+        self.devices = collections.OrderedDict()
+
+
+    # function for connecting to the eyetrackers with the given serial
+    # numbers, or to every eyetracker found. Returns the serial numbers of
+    # all connected eyetrackers
+    def connect(self, serialNumbers = None):
+
+        allTrackers = self.backend.find_all_eyetrackers()
+        if len(allTrackers) < 1:
+            raise ValueError("Cannot find any eyetrackers.")
+
+        found = dict((eyetracker.serial_number, eyetracker)
+                     for eyetracker in allTrackers)
+        if serialNumbers is None:
+            serialNumbers = [eyetracker.serial_number
+                             for eyetracker in allTrackers]
+        missing = [serial for serial in serialNumbers if serial not in found]
+        if missing:
+            raise ValueError("Cannot find eyetrackers with serial numbers " +
+                             ", ".join(missing) + ".")
+
+        for serial in serialNumbers:
+            if serial in self.devices:
+                continue
+            eyetracker = self.backend.EyeTracker(found[serial].address)
+            self.devices[serial] = TrackerDevice(self.backend, eyetracker,
+                                                 self.bufferCapacity)
+            print ("Connected to eyetracker " + serial + " at " +
+                   eyetracker.address)
+        return list(self.devices.keys())
+
+
+    # function for getting the TrackerDevice of an eyetracker
+    def __getitem__(self, serialNumber):
+        return self.devices[serialNumber]
+
+
+    def __len__(self):
+        return len(self.devices)
+
+
+    # function for starting gaze and time synchronization data from every
+    # connected eyetracker
+    def start(self):
+
+        if not self.devices:
+            raise ValueError("No eyetrackers are connected.\n" +
+                             "Try running connect().")
+        for device in self.devices.values():
+            device.start()
+
+
+    # function for stopping every eyetracker
+    def stop(self):
+        for device in self.devices.values():
+            device.stop()
+
+
+    # function for getting the samples of every eyetracker that arrived
+    # since the last read, as a dictionary of serial number to a tuple of
+    # the samples and their common clock times
+    def read(self):
+
+        data = collections.OrderedDict()
+        for serial, device in self.devices.items():
+            samples = device.gazeBuffer.drain()
+            data[serial] = (samples, device.commonTimes(samples))
+        return data
+
+
+    # function for getting the samples of every eyetracker that arrived
+    # since the last read as one stream in common clock order. Returns the
+    # times, the index of the eyetracker each sample came from (its position
+    # in self.devices), and the samples
+    def readMerged(self):
+
+        times, indices, samples = [], [], []
+        for index, (deviceSamples, deviceTimes) in \
+                enumerate(self.read().values()):
+            times.append(deviceTimes)
+            indices.append(np.full(len(deviceSamples), index,
+                                   dtype = np.int16))
+            samples.append(deviceSamples)
+        if not samples:
+            return (np.zeros(0), np.zeros(0, dtype = np.int16),
+                    np.zeros(0, dtype = GAZE_DTYPE))
+
+        times = np.concatenate(times)
+        # stable, so samples of one eyetracker stay in the order they came
+        order = np.argsort(times, kind = 'mergesort')
+        return (times[order], np.concatenate(indices)[order],
+                np.concatenate(samples)[order])
+
+
+    # function for getting the most recent sample of every eyetracker, as a
+    # dictionary of serial number to a one record array (empty if nothing
+    # arrived yet), without removing anything from the buffers
+    def getLatest(self):
+
+        return collections.OrderedDict(
+                (serial, device.gazeBuffer.latest())
+                for serial, device in self.devices.items())
+
+
+    # function for getting the counters of every eyetracker, as a dictionary
+    # of serial number to TrackerDevice.getStats()
+    def getStats(self):
+
+        return collections.OrderedDict(
+                (serial, device.getStats())
+                for serial, device in self.devices.items())
@@ -0,0 +1,552 @@
+# -*- coding: utf-8 -*-
+
+# Streaming gaze samples from the gaze buffer to disk, and reading them back
+
+# Summary: A GazeRecorder runs a background thread that regularly reads every
+# new sample from a GazeRingBuffer and appends it to a binary file, so the
+# SDK callback thread never waits on disk I/O. The file starts with a fixed
+# size header (magic string, header size, and a JSON description of the
+# record layout) followed by one fixed size record per sample, in the order
+# they were received. Records hold the raw GAZE_DTYPE columns and the
+# summarized DATA_DTYPE columns returned by getCurrentData, so a GazeSession
+# can memory map the file and hand out any column or trial as a numpy view
+# without parsing or copying. The index of trials and events, and marks,
+# time stamped annotations with a label and a payload, are kept next to the
+# recording in files that are only ever appended to, one JSON line per
+# entry, each with its record number, so there is no limit on their number.
+# Recordings made before (format version 2, magic TPWGAZE2), with the index
+# in the header, can still be read.
+
+import collections
+import json
+import os
+import struct
+import threading
+
+import numpy as np
+
+from .gaze_buffer import GAZE_DTYPE, DATA_DTYPE, summarizeGazeData
+
+
+# -----File layout-----
+# identifies a gaze recording and its format version
+MAGIC = b'TPWGAZE3'
+# formats that can be read, version 2 has the index in the header
+READABLE_MAGICS = (b'TPWGAZE2', MAGIC)
+# records start at this offset, the rest of the header is JSON padded with
+# spaces
+HEADER_SIZE = 65536
+# the trial and event index and the marks are stored in the file name of
+# the recording plus these
+INDEX_SUFFIX = '.index'
+MARKS_SUFFIX = '.marks'
+
+# summarized columns that are only copies of raw columns
+_ALIASES = {'DeviceTimeStamp': 'device_time_stamp',
+            'SystemTimeStamp': 'system_time_stamp'}
+
+# one record per sample, raw columns followed by the summarized ones
+SESSION_DTYPE = np.dtype(GAZE_DTYPE.descr +
+                         [field for field in DATA_DTYPE.descr
+                          if field[0] not in _ALIASES])
+
+
+# function for building session records from gaze buffer samples
+def _sessionRecords(samples):
+
+    records = np.zeros(len(samples), dtype = SESSION_DTYPE)
+    summary = summarizeGazeData(samples)
+    for name in GAZE_DTYPE.names:
+        records[name] = samples[name]
+    for name in DATA_DTYPE.names:
+        if name not in _ALIASES:
+            records[name] = summary[name]
+    return records
+
+
+# function for building the file header from the header information
+def _makeHeader(info):
+
+    text = json.dumps(info).encode('ascii')
+    # magic, header size, then JSON
+    prefix = MAGIC + struct.pack('<I', HEADER_SIZE)
+    if len(prefix) + len(text) > HEADER_SIZE:
+        raise ValueError("The recording header is too large.")
+    return prefix + text + b' ' * (HEADER_SIZE - len(prefix) - len(text))
+
+
+# function for reading the header of a gaze recording, returns the header
+# information as a dictionary and the dtype of the records
+def readHeader(fileName):
+
+    with open(fileName, 'rb') as f:
+        prefix = f.read(len(MAGIC) + 4)
+        if prefix[:len(MAGIC)] not in READABLE_MAGICS:
+            raise ValueError(fileName + " is not a gaze recording.")
+        headerSize = struct.unpack('<I', prefix[len(MAGIC):])[0]
+        info = json.loads(f.read(headerSize - len(prefix)).decode('ascii'))
+
+    info['headerSize'] = headerSize
+    return info, _dtypeFromDescr(info['dtype'])
+
+
+# JSON turns the dtype description into nested lists of unicode strings,
+# turn it back into something numpy accepts
+def _dtypeFromDescr(descr):
+
+    fields = []
+    for field in descr:
+        if len(field) == 3:
+            fields.append((str(field[0]), str(field[1]), tuple(field[2])))
+        else:
+            fields.append((str(field[0]), str(field[1])))
+    return np.dtype(fields)
+
+
+# function for adding a trial or event boundary to lists of trials, as
+# [label, first record, record after last], and events, as [label, record]
+def _addIndexEntry(trials, events, kind, label, record):
+
+    if kind == 'begin':
+        trials.append([label, record, None])
+    elif kind == 'end':
+        if trials:
+            trials[-1][2] = record
+    else:
+        events.append([label, record])
+
+
+# function for reading the trial and event index stored with a recording,
+# returns the lists of trials and events. A last line that was only
+# partially written is ignored
+def readIndex(fileName):
+
+    trials, events = [], []
+    if not os.path.isfile(fileName + INDEX_SUFFIX):
+        return trials, events
+    with open(fileName + INDEX_SUFFIX, 'rb') as f:
+        for line in f:
+            try:
+                entry = json.loads(line.decode('ascii'))
+            except ValueError:
+                break
+            _addIndexEntry(trials, events, entry['Kind'], entry['Label'],
+                           entry['Record'])
+    return trials, events
+
+
+# function for reading the marks stored with a recording, as (time, label,
+# payload, record) tuples in time order. A last line that was only partially
+# written is ignored
+def readMarks(fileName):
+
+    marks = []
+    if not os.path.isfile(fileName + MARKS_SUFFIX):
+        return marks
+    with open(fileName + MARKS_SUFFIX, 'rb') as f:
+        for line in f:
+            try:
+                mark = json.loads(line.decode('ascii'))
+            except ValueError:
+                break
+            marks.append((mark['Time'], mark['Label'], mark['Payload'],
+                          mark['Record']))
+    marks.sort(key = lambda mark: mark[0])
+    return marks
+
+
+# function for loading every record of a gaze recording into memory
+def readRecording(fileName):
+    return np.array(GazeSession(fileName).records)
+
+
+# -----Class for writing gaze samples to disk in the background-----
+class GazeRecorder:
+
+    # fsync policies: never, after every flush, or only when stopping
+    FSYNC_POLICIES = ('never', 'flush', 'close')
+
+    def __init__(self, gazeBuffer, fileName, flushInterval = 0.1,
+                 fsync = 'close'):
+
+        # check argument values
+        if gazeBuffer is None:
+            raise ValueError("No gaze buffer given to record from.")
+        if flushInterval is None or flushInterval <= 0:
+            raise ValueError("flushInterval must be a positive number of " +\
+                             "seconds.")
+        if fsync not in self.FSYNC_POLICIES:
+            raise ValueError("fsync must be one of " +
+                             ", ".join(self.FSYNC_POLICIES) + ".")
+
+        self.gazeBuffer = gazeBuffer
+        self.fileName = fileName
+        self.flushInterval = flushInterval
+        self.fsync = fsync
+
+        # number of samples written to the file
+        self.sampleCount = 0
+        # number of samples overwritten in the buffer before they were written
+        self.lostCount = 0
+        # number of flushes to disk
+        self.flushCount = 0
+
+        # index of trials as [label, first record, record after last] and of
+        # events as [label, record], appended to the index file
+        self.trials = []
+        self.events = []
+        self.indexFile = None
+        # trial and event boundaries given as gaze buffer positions, waiting
+        # for the writer thread to turn them into record numbers
+        self.pendingIndex = []
+        self.indexLock = threading.Lock()
+        self.trialOpen = False
+
+        # marks as (time, label, payload), appended by any thread without a
+        # lock and taken off by the writer thread, and marks the writer has
+        # taken that are newer than every sample written so far
+        self.markQueue = collections.deque()
+        self.pendingMarks = []
+        self.markCount = 0
+        self.lastSampleTime = None
+        self.marksFile = None
+
+        self.file = None
+        self.thread = None
+        self.error = None
+        # first error writing the index, which never stops the samples
+        self.indexError = None
+        self.stopEvent = threading.Event()
+        # position in the gaze buffer
+        self.bufferCount = 0
+
+
+    # function for creating the file and starting the writer thread, only
+    # samples arriving after this call are recorded
+    def start(self):
+
+        if self.thread is not None:
+            raise ValueError("Recorder is already running.")
+
+        self.file = open(self.fileName, 'wb')
+        self._writeHeader()
+        self.file.flush()
+        self.indexFile = open(self.fileName + INDEX_SUFFIX, 'wb')
+        self.marksFile = open(self.fileName + MARKS_SUFFIX, 'wb')
+
+        self.bufferCount = self.gazeBuffer.writeCount
+        self.stopEvent.clear()
+        self.thread = threading.Thread(target = self._run,
+                                       name = 'GazeRecorder')
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    # function for writing any remaining samples, then stopping the writer
+    # thread and closing the file
+    def stop(self):
+
+        if self.thread is None:
+            return
+
+        self.stopEvent.set()
+        self.thread.join()
+        self.thread = None
+
+        try:
+            if self.error is None:
+                # last samples that arrived while stopping
+                self._writeNewSamples()
+                # a trial that was never ended lasts until the end, and so
+                # do marks after the last sample
+                if self.trials and self.trials[-1][2] is None:
+                    self._writeIndex([('end', None, self.sampleCount)])
+                self._indexMarks(np.zeros(0, dtype = GAZE_DTYPE), 
+                                 self.sampleCount, final = True)
+            for f in (self.file, self.indexFile, self.marksFile):
+                f.flush()
+                if self.fsync != 'never':
+                    os.fsync(f.fileno())
+        finally:
+            self.file.close()
+            self.file = None
+            self.indexFile.close()
+            self.indexFile = None
+            self.marksFile.close()
+            self.marksFile = None
+
+        # report anything that went wrong in the writer thread
+        if self.error is not None:
+            raise self.error
+        if self.indexError is not None:
+            raise ValueError("Every sample was recorded, but the trial and " +
+                             "event index is incomplete: " +
+                             str(self.indexError))
+
+
+    # function for marking the start of a trial at the next sample that
+    # arrives, ending any trial that is still open
+    def beginTrial(self, label):
+
+        if self.trialOpen:
+            self.endTrial()
+        self._addToIndex('begin', label)
+        self.trialOpen = True
+
+
+    # function for marking the end of the current trial, after the last
+    # sample that has arrived
+    def endTrial(self):
+
+        if not self.trialOpen:
+            raise ValueError("There is no trial to end, try beginTrial().")
+        self._addToIndex('end', None)
+        self.trialOpen = False
+
+
+    # function for marking an event at the next sample that arrives
+    def addEvent(self, label):
+        self._addToIndex('event', label)
+
+
+    # function for marking the time stamp (system time, microseconds) with a
+    # label and a payload that JSON can store, e.g. a dictionary of trial
+    # conditions. timestamp is taken from the gaze buffer's clock if not
+    # given. Safe to call from any thread, it only appends to a queue
+    def mark(self, label, payload = None, timestamp = None):
+
+        if self.error is not None:
+            raise self.error
+        if timestamp is None:
+            if self.gazeBuffer.clock is None:
+                raise ValueError("The gaze buffer has no clock, give the " +
+                                 "timestamp of the mark.")
+            timestamp = self.gazeBuffer.clock()
+        self.markQueue.append((int(timestamp), label, payload))
+
+
+    # store a trial or event boundary as the position of the next sample
+    # in the gaze buffer
+    def _addToIndex(self, kind, label):
+
+        if self.error is not None:
+            raise self.error
+        with self.indexLock:
+            self.pendingIndex.append((kind, label, self.gazeBuffer.writeCount))
+
+
+    # writer thread, wakes up every flushInterval seconds
+    def _run(self):
+
+        try:
+            while not self.stopEvent.wait(self.flushInterval):
+                if self._writeNewSamples():
+                    self.file.flush()
+                    if self.fsync == 'flush':
+                        os.fsync(self.file.fileno())
+                    self.flushCount += 1
+        except Exception as error:
+            # kept for stop() to raise in the thread that started recording
+            self.error = error
+
+
+    # copy new samples from the buffer to the file, returns how many
+    def _writeNewSamples(self):
+
+        lastCount = self.bufferCount
+        samples, self.bufferCount = self.gazeBuffer.readSince(lastCount)
+        # samples that were overwritten before this pass
+        self.lostCount += (self.bufferCount - lastCount) - len(samples)
+
+        # buffer position and record number of the first new sample
+        firstCount = self.bufferCount - len(samples)
+        firstRecord = self.sampleCount
+
+        if len(samples) > 0:
+            self.file.write(_sessionRecords(samples).tobytes())
+            self.sampleCount += len(samples)
+
+        try:
+            self._updateIndex(firstCount, firstRecord)
+        except Exception as error:
+            if self.indexError is None:
+                self.indexError = error
+        marksWritten = self._indexMarks(samples, firstRecord)
+        return len(samples) + marksWritten
+
+
+    # write the marks the samples written so far have reached, each with the
+    # record of the first sample at or after it, found by binary search in
+    # the new samples. Returns how many were written
+    def _indexMarks(self, samples, firstRecord, final = False):
+
+        # popleft is safe while other threads append
+        queue = self.markQueue
+        while queue:
+            self.pendingMarks.append(queue.popleft())
+        if not self.pendingMarks:
+            return 0
+
+        times = samples['system_time_stamp']
+        if len(times) > 0:
+            self.lastSampleTime = int(times[-1])
+        self.pendingMarks.sort(key = lambda mark: mark[0])
+        if final:
+            numReady = len(self.pendingMarks)
+        elif self.lastSampleTime is None:
+            return 0
+        else:
+            numReady = int(np.searchsorted([mark[0] for mark in 
+                                            self.pendingMarks],
+                                           self.lastSampleTime, 
+                                           side = 'right'))
+        if numReady == 0:
+            return 0
+        ready = self.pendingMarks[:numReady]
+        self.pendingMarks = self.pendingMarks[numReady:]
+
+        # marks before the new samples arrived late and go to the first
+        records = firstRecord + np.searchsorted(
+                times, [mark[0] for mark in ready], side = 'left')
+        lines = [json.dumps({'Time': mark[0], 'Label': mark[1], 
+                             'Payload': mark[2], 'Record': int(record)},
+                            default = str) + '\n'
+                 for mark, record in zip(ready, records)]
+        self.marksFile.write(''.join(lines).encode('ascii'))
+        self.marksFile.flush()
+        self.markCount += len(ready)
+        return len(ready)
+
+
+    # turn pending trial and event boundaries that the writer has reached
+    # into record numbers and append them to the index file
+    def _updateIndex(self, firstCount, firstRecord):
+
+        with self.indexLock:
+            ready = [entry for entry in self.pendingIndex
+                     if entry[2] <= self.bufferCount]
+            self.pendingIndex = self.pendingIndex[len(ready):]
+
+        # boundaries at lost samples move to the next recorded sample
+        self._writeIndex([(kind, label,
+                           firstRecord + max(0, bufferCount - firstCount))
+                          for kind, label, bufferCount in ready])
+
+
+    # append (kind, label, record) entries to the index and the index file
+    def _writeIndex(self, entries):
+
+        if not entries:
+            return
+        lines = []
+        for kind, label, record in entries:
+            _addIndexEntry(self.trials, self.events, kind, label, record)
+            lines.append(json.dumps({'Kind': kind, 'Label': label,
+                                     'Record': int(record)},
+                                    default = str) + '\n')
+        self.indexFile.write(''.join(lines).encode('ascii'))
+        self.indexFile.flush()
+
+
+    # write the header at the start of the file
+    def _writeHeader(self):
+
+        header = _makeHeader({'version': 3,
+                              'dtype': SESSION_DTYPE.descr})
+        self.file.seek(0)
+        self.file.write(header)
+        self.file.seek(0, os.SEEK_END)
+
+
+# -----Class for reading a recording without loading it-----
+class GazeSession:
+
+    def __init__(self, fileName):
+
+        self.fileName = fileName
+        self.info, dtype = readHeader(fileName)
+        headerSize = self.info['headerSize']
+
+        # ignore a record that was only partially written
+        nRecords = (os.path.getsize(fileName) - headerSize) // dtype.itemsize
+        if nRecords > 0:
+            self.records = np.memmap(fileName, dtype = dtype, mode = 'r',
+                                     offset = headerSize, shape = (nRecords,))
+        else:
+            self.records = np.zeros(0, dtype = dtype)
+
+        # the index is in the header of recordings made before version 3
+        if 'trials' in self.info:
+            trials, events = self.info['trials'], self.info['events']
+        else:
+            trials, events = readIndex(fileName)
+        # trials as [label, first record, record after last]
+        self.trials = [(trial[0], trial[1],
+                        nRecords if trial[2] is None else trial[2])
+                       for trial in trials]
+        # events as [label, record]
+        self.events = [tuple(event) for event in events]
+        # marks as (time, label, payload, record), in time order
+        self.marks = readMarks(fileName)
+
+
+    # number of recorded samples
+    def __len__(self):
+        return len(self.records)
+
+
+    # any raw or getCurrentData column, e.g. session['AvgGazePointX'], as a
+    # view into the file
+    def __getitem__(self, name):
+        return self.records[_ALIASES.get(name, name)]
+
+
+    # function for getting the records of a trial as a view into the file,
+    # trial can be its label or its position in the list of trials
+    def getTrial(self, trial):
+
+        if isinstance(trial, int):
+            label, start, stop = self.trials[trial]
+            return self.records[start:stop]
+        for label, start, stop in self.trials:
+            if label == trial:
+                return self.records[start:stop]
+        raise ValueError("There is no trial labelled " + str(trial))
+
+
+    # function for getting the marks, or only those with label, as (time,
+    # label, payload, record) tuples
+    def getMarks(self, label = None):
+        return [mark for mark in self.marks
+                if label is None or mark[1] == label]
+
+
+    # function for getting the records with a system time stamp from
+    # startTime up to (not including) endTime as a view into the file, found
+    # by binary search on the time stamps
+    def getTimeRange(self, startTime, endTime):
+
+        times = self.records['system_time_stamp']
+        start = int(np.searchsorted(times, startTime, side = 'left'))
+        stop = int(np.searchsorted(times, endTime, side = 'left'))
+        return self.records[start:max(start, stop)]
+
+
+    # function for getting the records from a mark labelled startLabel to
+    # the next mark labelled endLabel, or to the end of the recording. With
+    # occurrence, the nth mark labelled startLabel is used
+    def getBetweenMarks(self, startLabel, endLabel = None, occurrence = 0):
+
+        starts = self.getMarks(startLabel)
+        if occurrence >= len(starts):
+            raise ValueError("There is no mark labelled " + str(startLabel) +
+                             " number " + str(occurrence))
+        startTime = starts[occurrence][0]
+        for mark in self.marks:
+            if mark[1] == endLabel and mark[0] >= startTime:
+                return self.getTimeRange(startTime, mark[0])
+        if endLabel is not None:
+            raise ValueError("There is no mark labelled " + str(endLabel) +
+                             " after " + str(startLabel))
+        return self.records[int(np.searchsorted(
+                self.records['system_time_stamp'], startTime, side = 'left')):]
@@ -0,0 +1,522 @@
+# -*- coding: utf-8 -*-
+
+# Simulated Tobii eyetracker for running the wrapper without hardware
+
+# Summary: TobiiHelper only talks to the Tobii Pro SDK through a handful of
+# functions and classes (find_all_eyetrackers, EyeTracker, subscribe_to and
+# unsubscribe_from, get_display_area, get_track_box, ScreenBasedCalibration,
+# get_system_time_stamp, and a few constants). A SimulatedBackend provides
+# the same names, so it can be passed to TobiiHelper(backend = ...) in place
+# of the tobii_research module. Its eyetrackers emit gaze data dictionaries
+# in the same format as the SDK, at any output frequency, from their own
+# thread. The gaze follows fixations and main-sequence saccades between
+# random targets, and includes blinks, single-eye dropouts, sample noise,
+# and a device clock that drifts away from the system clock. Calibrations
+# return results in the same structure as the SDK, and reduce the gaze
+# error of the simulated eyetracker once applied.
+
+import json
+import math
+import random
+import threading
+import time
+
+
+# -----Constants with the same values and meaning as in the SDK-----
+EYETRACKER_GAZE_DATA = "gaze_data"
+EYETRACKER_TIME_SYNCHRONIZATION_DATA = "time_synchronization_data"
+CALIBRATION_STATUS_SUCCESS = "calibration_status_success"
+CALIBRATION_STATUS_FAILURE = "calibration_status_failure"
+VALIDITY_INVALID_AND_NOT_USED = "validity_invalid_and_not_used"
+VALIDITY_VALID_BUT_NOT_USED = "validity_valid_but_not_used"
+VALIDITY_VALID_AND_USED = "validity_valid_and_used"
+
+# seconds on a monotonic clock where available
+_clock = getattr(time, 'monotonic', time.time)
+
+
+# system time stamp in microseconds, on the same clock as the system time
+# stamps of simulated gaze data
+def get_system_time_stamp():
+    return int(_clock() * 1000000)
+
+
+# -----Geometry of a simulated 24 inch display and its eyetracker-----
+class DisplayArea:
+
+    def __init__(self, width = 509.2, height = 286.4, bottom = 15.0):
+
+        # display stands upright above the eyetracker, units are mm in the
+        # user coordinate system
+        self.width = width
+        self.height = height
+        self.top_left = (-width / 2, bottom + height, 0.0)
+        self.top_right = (width / 2, bottom + height, 0.0)
+        self.bottom_left = (-width / 2, bottom, 0.0)
+        self.bottom_right = (width / 2, bottom, 0.0)
+
+
+class TrackBox:
+
+    # centered on the eyetracker like TobiiHelper's trackbox conversions
+    # expect
+    def __init__(self, left = -150.0, right = 150.0, bottom = -150.0,
+                 top = 150.0, front = 500.0, back = 800.0):
+
+        self.front_lower_left = (left, bottom, front)
+        self.front_lower_right = (right, bottom, front)
+        self.front_upper_left = (left, top, front)
+        self.front_upper_right = (right, top, front)
+        self.back_lower_left = (left, bottom, back)
+        self.back_lower_right = (right, bottom, back)
+        self.back_upper_left = (left, top, back)
+        self.back_upper_right = (right, top, back)
+
+
+# -----Calibration results with the same structure as in the SDK-----
+class CalibrationEyeData:
+
+    def __init__(self, position_on_display_area, validity):
+        self.position_on_display_area = position_on_display_area
+        self.validity = validity
+
+
+class CalibrationSample:
+
+    def __init__(self, left_eye, right_eye):
+        self.left_eye = left_eye
+        self.right_eye = right_eye
+
+
+class CalibrationPoint:
+
+    def __init__(self, position_on_display_area, calibration_samples):
+        self.position_on_display_area = position_on_display_area
+        self.calibration_samples = calibration_samples
+
+
+class CalibrationResult:
+
+    def __init__(self, status, calibration_points):
+        self.status = status
+        self.calibration_points = calibration_points
+
+
+# -----Class for a simulated eyetracker-----
+class SimulatedEyeTracker:
+
+    def __init__(self, address = 'sim://0', serialNumber = 'SIM-0000',
+                 frequency = 600.0, seed = None, blinkRate = 0.25,
+                 dropoutRate = 0.01, noise = 0.003, clockDrift = 20.0,
+                 calibrationError = 0.04, syncInterval = 0.5,
+                 collectDuration = 0.05, collectFailureRate = 0.0,
+                 badPointRate = 0.1, frequencies = (60.0, 120.0, 300.0,
+                                                    600.0, 1200.0)):
+
+        # device information, named like the SDK's EyeTracker
+        self.address = address
+        self.serial_number = serialNumber
+        self.model = 'Simulated Eyetracker'
+        self.device_name = 'Simulated ' + serialNumber
+        self.firmware_version = '0.0.0'
+
+        # behaviour of the simulation
+        self.frequencies = tuple(float(f) for f in frequencies)
+        self.frequency = float(frequency)
+        self.blinkRate = blinkRate  # blinks per second
+        self.dropoutRate = dropoutRate  # chance of losing an eye per sample
+        self.noise = noise  # sample to sample noise in ada units
+        self.clockDrift = clockDrift  # device clock error in ppm
+        self.syncInterval = syncInterval  # seconds between sync packets
+        self.collectDuration = collectDuration  # seconds per calibration point
+        self.collectFailureRate = collectFailureRate
+        self.badPointRate = badPointRate  # chance of a badly calibrated point
+
+        self.random = random.Random(seed)
+        self.displayArea = DisplayArea()
+        self.trackBox = TrackBox()
+        # device clock starts at an arbitrary offset from the system clock
+        self.clockOffset = self.random.uniform(1000.0, 100000.0)
+
+        # gaze error in ada units for the left and right eye, reduced by
+        # applying a calibration
+        self.gazeBias = [self._randomOffset(calibrationError),
+                         self._randomOffset(calibrationError)]
+
+        # subscribed callbacks for each data stream
+        self.subscriptions = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+
+        # number of samples emitted since the first subscription
+        self.sampleCount = 0
+        self._resetGaze(_clock())
+
+
+    # -----Functions named like the SDK's EyeTracker-----
+    def get_display_area(self):
+        return self.displayArea
+
+
+    def get_track_box(self):
+        return self.trackBox
+
+
+    def get_gaze_output_frequency(self):
+        return self.frequency
+
+
+    def get_all_gaze_output_frequencies(self):
+        return self.frequencies
+
+
+    def set_gaze_output_frequency(self, frequency):
+        if float(frequency) not in self.frequencies:
+            raise ValueError("Unsupported gaze output frequency.")
+        self.frequency = float(frequency)
+
+
+    # calibrations are stored as the gaze error they leave behind
+    def retrieve_calibration_data(self):
+        return json.dumps({'serial': self.serial_number,
+                           'gazeBias': self.gazeBias}).encode('ascii')
+
+
+    def apply_calibration_data(self, calibrationData):
+
+        data = json.loads(calibrationData.decode('ascii'))
+        if data.get('serial') != self.serial_number:
+            raise ValueError("Calibration data is from another eyetracker.")
+        self.gazeBias = [list(bias) for bias in data['gazeBias']]
+
+
+    def subscribe_to(self, stream, callback, as_dictionary = True):
+
+        if stream not in (EYETRACKER_GAZE_DATA,
+                          EYETRACKER_TIME_SYNCHRONIZATION_DATA):
+            raise ValueError("The simulated eyetracker does not provide " +
+                             str(stream))
+        with self.lock:
+            self.subscriptions.setdefault(stream, []).append(callback)
+        # start emitting data with the first subscription
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target = self._run,
+                                           name = self.device_name)
+            self.thread.daemon = True
+            self.thread.start()
+
+
+    def unsubscribe_from(self, stream, callback = None):
+
+        with self.lock:
+            callbacks = self.subscriptions.get(stream, [])
+            if callback is None:
+                del callbacks[:]
+            elif callback in callbacks:
+                callbacks.remove(callback)
+            stopping = not any(self.subscriptions.values())
+        # stop emitting once nothing is subscribed
+        if stopping and self.thread is not None:
+            self.running = False
+            if self.thread is not threading.current_thread():
+                self.thread.join()
+            self.thread = None
+
+
+    # -----Simulation-----
+
+    # thread emitting samples at the output frequency, catching up with a
+    # burst of samples whenever the thread was delayed, like the SDK does
+    def _run(self):
+
+        nextSample = _clock()
+        nextSync = nextSample
+        while self.running:
+            now = _clock()
+            period = 1.0 / self.frequency
+
+            while nextSample <= now and self.running:
+                self._emit(EYETRACKER_GAZE_DATA, self._makeSample(nextSample))
+                nextSample += period
+            if nextSync <= now:
+                self._emit(EYETRACKER_TIME_SYNCHRONIZATION_DATA,
+                           self._makeSyncData())
+                nextSync = now + self.syncInterval
+
+            time.sleep(max(0.0, min(nextSample, nextSync) - _clock()))
+
+
+    # call every callback subscribed to a stream
+    def _emit(self, stream, data):
+
+        with self.lock:
+            callbacks = list(self.subscriptions.get(stream, []))
+        for callback in callbacks:
+            callback(data)
+
+
+    # device clock in microseconds at a system clock time in seconds
+    def _deviceTime(self, systemTime):
+        return int((systemTime * (1.0 + self.clockDrift * 1e-6) +
+                    self.clockOffset) * 1000000)
+
+
+    # time synchronization packet, with an occasional slow round trip
+    def _makeSyncData(self):
+
+        request = _clock()
+        roundTrip = self.random.uniform(0.0002, 0.0006)
+        if self.random.random() < 0.05:
+            roundTrip += self.random.uniform(0.002, 0.02)
+        deviceTime = request + roundTrip * self.random.uniform(0.3, 0.7)
+        return {'system_request_time_stamp': int(request * 1000000),
+                'device_time_stamp': self._deviceTime(deviceTime),
+                'system_response_time_stamp': int((request + roundTrip) *
+                                                  1000000)}
+
+
+    # random offset in ada units with the given size
+    def _randomOffset(self, size):
+        angle = self.random.uniform(0.0, 2 * math.pi)
+        return [size * math.cos(angle), size * math.sin(angle)]
+
+
+    # start with a fixation on a random target
+    def _resetGaze(self, t):
+
+        self.gazePos = [self.random.uniform(0.1, 0.9),
+                        self.random.uniform(0.1, 0.9)]
+        self.saccade = None
+        self.fixationEnd = t + self.random.gammavariate(4.0, 0.0625)
+        self.blinkEnd = t
+        self.nextBlink = t + self.random.expovariate(self.blinkRate) \
+            if self.blinkRate > 0 else float('inf')
+
+
+    # move the gaze along fixations and saccades up to time t
+    def _updateGaze(self, t):
+
+        # start a saccade to a new target when the fixation is over
+        if self.saccade is None and t >= self.fixationEnd:
+            target = [self.random.uniform(0.05, 0.95),
+                      self.random.uniform(0.05, 0.95)]
+            # main sequence, duration grows with amplitude in degrees
+            distance = math.hypot(
+                    (target[0] - self.gazePos[0]) * self.displayArea.width,
+                    (target[1] - self.gazePos[1]) * self.displayArea.height)
+            amplitude = math.degrees(math.atan2(distance, 650.0))
+            duration = 0.021 + 0.0022 * amplitude
+            self.saccade = (t, t + duration, list(self.gazePos), target)
+
+        if self.saccade is not None:
+            start, end, origin, target = self.saccade
+            if t >= end:
+                # land on the target and fixate
+                self.gazePos = list(target)
+                self.saccade = None
+                self.fixationEnd = end + self.random.gammavariate(4.0, 0.0625)
+            else:
+                # smooth velocity profile
+                progress = (1 - math.cos(math.pi * (t - start) /
+                                         (end - start))) / 2
+                self.gazePos = [origin[0] + (target[0] - origin[0]) * progress,
+                                origin[1] + (target[1] - origin[1]) * progress]
+
+        # start a blink
+        if t >= self.nextBlink:
+            self.blinkEnd = t + self.random.uniform(0.08, 0.25)
+            self.nextBlink = self.blinkEnd + \
+                self.random.expovariate(self.blinkRate)
+
+
+    # gaze data dictionary for the sample captured at system time t
+    def _makeSample(self, t):
+
+        self._updateGaze(t)
+        self.sampleCount += 1
+        blinking = t < self.blinkEnd
+
+        # head sways slowly in front of the eyetracker
+        head = (20.0 * math.sin(t * 0.3), 10.0 * math.sin(t * 0.2),
+                650.0 + 30.0 * math.sin(t * 0.1))
+        pupil = 3.5 + 0.3 * math.sin(t * 0.5)
+
+        data = {'device_time_stamp': self._deviceTime(t),
+                'system_time_stamp': int(t * 1000000)}
+        for eye, side, bias in (('left', -1, self.gazeBias[0]),
+                                ('right', 1, self.gazeBias[1])):
+            found = not blinking and self.random.random() >= self.dropoutRate
+            data.update(self._eyeData(eye, found, head, side * 32.0, bias,
+                                      pupil))
+        return data
+
+
+    # gaze data dictionary entries for one eye
+    def _eyeData(self, eye, found, head, eyeOffset, bias, pupil):
+
+        nan = float('nan')
+        if not found:
+            return {eye + '_gaze_point_on_display_area': (nan, nan),
+                    eye + '_gaze_point_in_user_coordinate_system': (nan, nan,
+                                                                    nan),
+                    eye + '_gaze_point_validity': 0,
+                    eye + '_pupil_diameter': nan,
+                    eye + '_pupil_validity': 0,
+                    eye + '_gaze_origin_in_user_coordinate_system': (nan, nan,
+                                                                     nan),
+                    eye + '_gaze_origin_in_trackbox_coordinate_system': (nan,
+                                                                         nan,
+                                                                         nan),
+                    eye + '_gaze_origin_validity': 0}
+
+        area, box = self.displayArea, self.trackBox
+        gaze = (self.gazePos[0] + bias[0] + self.random.gauss(0, self.noise),
+                self.gazePos[1] + bias[1] + self.random.gauss(0, self.noise))
+        origin = (head[0] + eyeOffset, head[1], head[2])
+        # trackbox origin is its upper right front corner
+        boxWidth = box.front_upper_right[0] - box.front_upper_left[0]
+        boxHeight = box.front_upper_right[1] - box.front_lower_right[1]
+        boxDepth = box.back_upper_right[2] - box.front_upper_right[2]
+
+        return {eye + '_gaze_point_on_display_area': gaze,
+                eye + '_gaze_point_in_user_coordinate_system': (
+                    area.top_left[0] + gaze[0] * area.width,
+                    area.top_left[1] - gaze[1] * area.height,
+                    area.top_left[2]),
+                eye + '_gaze_point_validity': 1,
+                eye + '_pupil_diameter': pupil + self.random.gauss(0, 0.02),
+                eye + '_pupil_validity': 1,
+                eye + '_gaze_origin_in_user_coordinate_system': origin,
+                eye + '_gaze_origin_in_trackbox_coordinate_system': (
+                    (box.front_upper_right[0] - origin[0]) / boxWidth,
+                    (box.front_upper_right[1] - origin[1]) / boxHeight,
+                    (origin[2] - box.front_upper_right[2]) / boxDepth),
+                eye + '_gaze_origin_validity': 1}
+
+
+# -----Class for calibrating a simulated eyetracker-----
+class SimulatedCalibration:
+
+    def __init__(self, eyetracker):
+
+        self.eyetracker = eyetracker
+        self.inCalibrationMode = False
+        # collected samples for each calibration point
+        self.points = {}
+        self.pointOrder = []
+
+
+    def enter_calibration_mode(self):
+        self.inCalibrationMode = True
+
+
+    def leave_calibration_mode(self):
+        self.inCalibrationMode = False
+
+
+    # collect samples at a point, blocking like the SDK does
+    def collect_data(self, x, y):
+
+        if not self.inCalibrationMode:
+            raise ValueError("Not in calibration mode.")
+        tracker = self.eyetracker
+        time.sleep(tracker.collectDuration)
+        if tracker.random.random() < tracker.collectFailureRate:
+            return CALIBRATION_STATUS_FAILURE
+
+        # some points end up badly calibrated
+        error = 0.06 if tracker.random.random() < tracker.badPointRate \
+            else 0.008
+        leftBias = tracker._randomOffset(error)
+        rightBias = tracker._randomOffset(error)
+        samples = []
+        for i in range(tracker.random.randint(6, 10)):
+            eyes = []
+            for bias in (leftBias, rightBias):
+                position = (x + bias[0] + tracker.random.gauss(0, tracker.noise),
+                            y + bias[1] + tracker.random.gauss(0, tracker.noise))
+                eyes.append(CalibrationEyeData(position,
+                                               VALIDITY_VALID_AND_USED))
+            samples.append(CalibrationSample(eyes[0], eyes[1]))
+
+        if (x, y) not in self.points:
+            self.pointOrder.append((x, y))
+        self.points[(x, y)] = samples
+        return CALIBRATION_STATUS_SUCCESS
+
+
+    def discard_data(self, x, y):
+
+        if (x, y) in self.points:
+            del self.points[(x, y)]
+            self.pointOrder.remove((x, y))
+
+
+    # compute the calibration from the collected points and apply it
+    def compute_and_apply(self):
+
+        if not self.inCalibrationMode:
+            raise ValueError("Not in calibration mode.")
+        if len(self.points) < 2:
+            return CalibrationResult(CALIBRATION_STATUS_FAILURE, ())
+
+        # like the SDK, results can start with a point at (0, 0) that has
+        # no valid samples
+        invalid = CalibrationEyeData((0.0, 0.0), VALIDITY_INVALID_AND_NOT_USED)
+        points = [CalibrationPoint((0.0, 0.0),
+                                   [CalibrationSample(invalid, invalid)])]
+        points += [CalibrationPoint(point, self.points[point])
+                   for point in self.pointOrder]
+
+        # applied calibration leaves a small gaze error
+        tracker = self.eyetracker
+        tracker.gazeBias = [tracker._randomOffset(0.005),
+                            tracker._randomOffset(0.005)]
+        return CalibrationResult(CALIBRATION_STATUS_SUCCESS, tuple(points))
+
+
+# -----Class standing in for the tobii_research module-----
+class SimulatedBackend:
+
+    # same constants as the SDK
+    EYETRACKER_GAZE_DATA = EYETRACKER_GAZE_DATA
+    EYETRACKER_TIME_SYNCHRONIZATION_DATA = EYETRACKER_TIME_SYNCHRONIZATION_DATA
+    CALIBRATION_STATUS_SUCCESS = CALIBRATION_STATUS_SUCCESS
+    CALIBRATION_STATUS_FAILURE = CALIBRATION_STATUS_FAILURE
+    VALIDITY_INVALID_AND_NOT_USED = VALIDITY_INVALID_AND_NOT_USED
+    VALIDITY_VALID_BUT_NOT_USED = VALIDITY_VALID_BUT_NOT_USED
+    VALIDITY_VALID_AND_USED = VALIDITY_VALID_AND_USED
+
+    # any keyword accepted by SimulatedEyeTracker applies to all eyetrackers
+    def __init__(self, numTrackers = 1, seed = None, **trackerOptions):
+
+        self.eyetrackers = []
+        for i in range(numTrackers):
+            self.eyetrackers.append(SimulatedEyeTracker(
+                    address = 'sim://' + str(i),
+                    serialNumber = 'SIM-' + str(i).zfill(4),
+                    seed = None if seed is None else seed + i,
+                    **trackerOptions))
+
+
+    # functions named like the SDK's module functions and classes
+    def find_all_eyetrackers(self):
+        return tuple(self.eyetrackers)
+
+
+    def EyeTracker(self, address):
+
+        for eyetracker in self.eyetrackers:
+            if eyetracker.address == address:
+                return eyetracker
+        raise ValueError("No simulated eyetracker at " + str(address))
+
+
+    def ScreenBasedCalibration(self, eyetracker):
+        return SimulatedCalibration(eyetracker)
+
+
+    def get_system_time_stamp(self):
+        return get_system_time_stamp()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+# Constant time smoothing of gaze and eye positions, one sample at a time
+
+# Summary: A GazeSmoother filters a stream of values with a fixed number of
+# dimensions, e.g. (x, y) gaze positions, and returns the smoothed values
+# after every sample. All state is allocated once, and every sample is
+# handled with a fixed amount of work, so it can be called every frame (or
+# for every eyetracker sample) without growing or copying arrays. Missing
+# values (nan) are ignored, each dimension on its own. Three modes are
+# available:
+#   'average'      moving average over the last window samples, kept as
+#                  running sums and counts of the values that are not nan
+#   'exponential'  exponential moving average, alpha is the weight of the
+#                  newest sample
+#   'oneeuro'      the 1 euro filter (Casiez, Roussel, and Vogel, 2012),
+#                  which smooths strongly while gaze is still and follows
+#                  quickly when it moves. minCutoff (Hz) sets the smoothing
+#                  at rest and beta how fast the cutoff rises with speed
+
+import math
+
+
+MODES = ('average', 'exponential', 'oneeuro')
+
+
+# -----Class for smoothing a stream of values-----
+class GazeSmoother:
+
+    def __init__(self, mode = 'average', window = 5, dimensions = 2,
+                 alpha = 0.5, minCutoff = 1.0, beta = 0.007, dCutoff = 1.0,
+                 frequency = 60.0):
+
+        # check argument values
+        if mode not in MODES:
+            raise ValueError("mode must be one of " + ", ".join(MODES) + ".")
+        if window is None or int(window) < 1:
+            raise ValueError("The smoothing window must be at least one " +
+                             "sample.")
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha must be between 0 and 1.")
+        if minCutoff <= 0 or dCutoff <= 0 or frequency <= 0:
+            raise ValueError("Cutoffs and frequency must be positive.")
+
+        self.mode = mode
+        self.window = int(window)
+        self.dimensions = int(dimensions)
+        self.alpha = float(alpha)
+        self.minCutoff = float(minCutoff)
+        self.beta = float(beta)
+        self.dCutoff = float(dCutoff)
+        # sampling rate assumed when no time stamps are given
+        self.frequency = float(frequency)
+        self.reset()
+
+
+    # function for forgetting every sample, e.g. between trials
+    def reset(self):
+
+        nan = float('nan')
+        dims = range(self.dimensions)
+        # smoothed values, nan until a dimension has a value
+        self.value = tuple(nan for i in dims)
+        self.sampleCount = 0
+
+        # moving average: the last window samples, and the sum and count of
+        # the values that are not nan in each dimension
+        self.history = [[nan for i in dims] for j in range(self.window)]
+        self.sums = [0.0 for i in dims]
+        self.counts = [0 for i in dims]
+        self.position = 0
+
+        # 1 euro filter: filtered derivative and time of the last sample
+        self.derivative = [0.0 for i in dims]
+        self.lastTime = None
+
+
+    # function for adding one sample, a sequence with one value per
+    # dimension, and getting the smoothed values as a tuple. timestamp (in
+    # seconds) is only used by the 1 euro filter, which otherwise assumes
+    # samples arrive at the given frequency
+    def add(self, values, timestamp = None):
+
+        if len(values) != self.dimensions:
+            raise ValueError("Expected {0} values per sample.".format(
+                    self.dimensions))
+
+        self.sampleCount += 1
+        if self.mode == 'average':
+            self.value = self._addAverage(values)
+        elif self.mode == 'exponential':
+            self.value = self._addExponential(values)
+        else:
+            self.value = self._addOneEuro(values, timestamp)
+        return self.value
+
+
+    # -----Moving average-----
+
+    def _addAverage(self, values):
+
+        slot = self.history[self.position]
+        sums, counts = self.sums, self.counts
+        smoothed = []
+        for i in range(self.dimensions):
+            # the oldest value leaves the window, the new one enters
+            old, new = slot[i], float(values[i])
+            if old == old:
+                sums[i] -= old
+                counts[i] -= 1
+            if new == new:
+                sums[i] += new
+                counts[i] += 1
+            slot[i] = new
+            smoothed.append(sums[i] / counts[i] if counts[i] else float('nan'))
+
+        self.position += 1
+        # recompute the sums once per pass through the window so rounding
+        # errors can not build up, which keeps the cost per sample constant
+        if self.position == self.window:
+            self.position = 0
+            for i in range(self.dimensions):
+                sums[i] = math.fsum(row[i] for row in self.history
+                                    if row[i] == row[i])
+        return tuple(smoothed)
+
+
+    # -----Exponential moving average-----
+
+    def _addExponential(self, values):
+
+        smoothed = []
+        for last, new in zip(self.value, values):
+            new = float(new)
+            if new != new:
+                # missing, keep the last value
+                smoothed.append(last)
+            elif last != last:
+                # first value
+                smoothed.append(new)
+            else:
+                smoothed.append(last + self.alpha * (new - last))
+        return tuple(smoothed)
+
+
+    # -----1 euro filter-----
+
+    # weight of the newest sample for a low pass filter with the given
+    # cutoff frequency (Hz), for samples dt seconds apart
+    @staticmethod
+    def _alpha(cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+
+    def _addOneEuro(self, values, timestamp):
+
+        # time since the last sample
+        if timestamp is None or self.lastTime is None or \
+                timestamp <= self.lastTime:
+            dt = 1.0 / self.frequency
+        else:
+            dt = timestamp - self.lastTime
+        if timestamp is not None:
+            self.lastTime = timestamp
+
+        dAlpha = self._alpha(self.dCutoff, dt)
+        smoothed = []
+        for i, (last, new) in enumerate(zip(self.value, values)):
+            new = float(new)
+            if new != new:
+                smoothed.append(last)
+                continue
+            if last != last:
+                smoothed.append(new)
+                self.derivative[i] = 0.0
+                continue
+            # filtered speed sets the cutoff for the value itself
+            derivative = self.derivative[i] + dAlpha * \
+                ((new - last) / dt - self.derivative[i])
+            self.derivative[i] = derivative
+            cutoff = self.minCutoff + self.beta * abs(derivative)
+            smoothed.append(last + self._alpha(cutoff, dt) * (new - last))
+        return tuple(smoothed)
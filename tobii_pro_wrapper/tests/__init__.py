@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+
+# Tests for tobii_pro_wrapper, run with python -m unittest discover or pytest.
+# They use the simulated eyetracker, so no hardware is needed.
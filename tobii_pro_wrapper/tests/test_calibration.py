@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# Tests for calibration metrics and choosing points to redo, run through the
+# simulated eyetracker, which reports sample validity as the SDK's strings
+
+import unittest
+
+import numpy as np
+
+from tobii_pro_wrapper import TobiiHelper
+from tobii_pro_wrapper.simulated_tracker import SimulatedBackend
+
+
+POINTS = [(0.1, 0.1), (0.9, 0.1), (0.5, 0.5), (0.1, 0.9), (0.9, 0.9)]
+
+
+class CalibrationMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.helper = TobiiHelper(backend = SimulatedBackend(
+                seed = 3, badPointRate = 0.0, collectDuration = 0.0,
+                collectFailureRate = 0.0))
+        self.helper.findTracker()
+        self.helper.getTrackerSpace()
+        self.tracker = self.helper.eyetracker
+        self.calibration = self.helper.backend.ScreenBasedCalibration(
+                self.tracker)
+        self.calibration.enter_calibration_mode()
+        self.curDict = dict((i + 1, point) for i, point in enumerate(POINTS))
+
+
+    def tearDown(self):
+        self.calibration.leave_calibration_mode()
+
+
+    # collect every point, with the one at degradedPoint badly calibrated
+    def _calibrate(self, degradedPoint = None):
+
+        for point in POINTS:
+            self.tracker.badPointRate = 1.0 if point == degradedPoint \
+                else 0.0
+            self.calibration.collect_data(point[0], point[1])
+        return self.calibration.compute_and_apply()
+
+
+    # set the validity of the left eye in the first count samples of point
+    def _setLeftValidity(self, calibResult, point, validity, count):
+
+        for calibPoint in calibResult.calibration_points:
+            if tuple(calibPoint.position_on_display_area) == point:
+                for sample in calibPoint.calibration_samples[:count]:
+                    sample.left_eye.validity = validity
+
+
+    def testValidityIsUnpackedFromSDKStrings(self):
+
+        metrics = self.helper.getCalibrationMetrics(self._calibrate())
+        self.assertEqual(len(metrics), len(POINTS))
+        np.testing.assert_array_equal(metrics['LeftValidity'], 1.0)
+        np.testing.assert_array_equal(metrics['RightValidity'], 1.0)
+        self.assertTrue(np.all(metrics['LeftAccuracy'] < 1.0))
+
+
+    def testOnlyDegradedPointIsRedone(self):
+
+        calibResult = self._calibrate(degradedPoint = (0.5, 0.5))
+        # a sample the SDK did not use does not make a point bad
+        self._setLeftValidity(calibResult, (0.1, 0.1),
+                              self.helper.backend.VALIDITY_VALID_BUT_NOT_USED,
+                              1)
+        redo = self.helper.findBadCalibrationPoints(calibResult, self.curDict)
+        self.assertEqual(list(redo.items()), [(3, (0.5, 0.5))])
+
+
+    def testPointWithoutValidSamplesIsRedone(self):
+
+        calibResult = self._calibrate()
+        self._setLeftValidity(
+                calibResult, (0.9, 0.9),
+                self.helper.backend.VALIDITY_INVALID_AND_NOT_USED, 100)
+        redo = self.helper.findBadCalibrationPoints(calibResult, self.curDict)
+        self.assertEqual(list(redo.items()), [(5, (0.9, 0.9))])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+# Tests for fitting system time to device time from synthetic time
+# synchronization packets with a known offset and drift
+
+import unittest
+
+import numpy as np
+
+from tobii_pro_wrapper.clock_sync import ClockModel
+
+
+# offset of system time from device time at the first packet, and how much
+# faster the device clock runs, in parts per million
+OFFSET = 7e8
+DRIFT_PPM = 20.0
+
+
+# function for making a time synchronization packet for a system time,
+# with the given round trip and the device time read that far from its
+# middle (microseconds)
+def makeSyncData(systemTime, roundTrip = 200.0, error = 0.0):
+
+    deviceTime = (systemTime - OFFSET - 1e9) * (1 + DRIFT_PPM * 1e-6) + \
+        1e9 - error
+    return {'device_time_stamp': int(round(deviceTime)),
+            'system_request_time_stamp': int(round(systemTime - roundTrip / 2)),
+            'system_response_time_stamp': int(round(systemTime +
+                                                    roundTrip / 2))}
+
+
+# function for making count packets two per second, with round trips and
+# device time readings that vary a little
+def makePackets(count, seed = 0):
+
+    rng = np.random.RandomState(seed)
+    return [makeSyncData(OFFSET + 1e9 + i * 5e5,
+                         roundTrip = 200.0 + rng.uniform(-20, 20),
+                         error = rng.normal(0, 5))
+            for i in range(count)]
+
+
+class ClockModelTest(unittest.TestCase):
+
+    def testNotFittedBeforeFirstPacket(self):
+
+        model = ClockModel()
+        self.assertFalse(model.isFitted())
+        self.assertRaises(ValueError, model.deviceToSystem, 0)
+        self.assertRaises(ValueError, model.getDrift)
+
+
+    def testOnePacketGivesOffsetOnly(self):
+
+        model = ClockModel()
+        model.addSyncData(makeSyncData(OFFSET + 1e9))
+        self.assertTrue(model.isFitted())
+        drift = model.getDrift()
+        self.assertEqual(drift['DriftPPM'], 0.0)
+        self.assertAlmostEqual(drift['Offset'], OFFSET, delta = 1)
+
+
+    def testFitFindsOffsetAndDrift(self):
+
+        model = ClockModel()
+        for syncData in makePackets(200):
+            model.addSyncData(syncData)
+
+        drift = model.getDrift()
+        self.assertAlmostEqual(drift['DriftPPM'], DRIFT_PPM, delta = 0.1)
+        self.assertAlmostEqual(drift['Offset'], OFFSET, delta = 5)
+        self.assertLess(drift['ResidualSD'], 10)
+        self.assertEqual(drift['UsedPackets'], 200)
+        self.assertEqual(drift['PacketCount'], 200)
+
+        # a sample a minute after the last packet
+        systemTime = OFFSET + 1e9 + 160e6
+        deviceTime = makeSyncData(systemTime)['device_time_stamp']
+        self.assertAlmostEqual(model.deviceToSystem(deviceTime), systemTime,
+                               delta = 5)
+
+
+    def testSlowRoundTripsAndOutliersAreLeftOut(self):
+
+        model = ClockModel()
+        packets = makePackets(200)
+        # slow round trips, the device time was read near their start
+        for i in range(10, 200, 20):
+            packets[i] = makeSyncData(OFFSET + 1e9 + i * 5e5,
+                                      roundTrip = 5000.0, error = 2000.0)
+        # fast round trips, but far from every other packet
+        for i in range(15, 200, 40):
+            packets[i] = makeSyncData(OFFSET + 1e9 + i * 5e5, error = 1000.0)
+        for syncData in packets:
+            model.addSyncData(syncData)
+
+        drift = model.getDrift()
+        self.assertEqual(drift['UsedPackets'], 200 - 10 - 5)
+        self.assertAlmostEqual(drift['DriftPPM'], DRIFT_PPM, delta = 0.1)
+        self.assertAlmostEqual(drift['Offset'], OFFSET, delta = 5)
+        self.assertLess(drift['ResidualSD'], 10)
+
+
+    def testOnlyRecentPacketsAreFitted(self):
+
+        model = ClockModel(capacity = 50)
+        for syncData in makePackets(120):
+            model.addSyncData(syncData)
+
+        drift = model.getDrift()
+        self.assertEqual(drift['PacketCount'], 120)
+        self.assertEqual(drift['UsedPackets'], 50)
+        self.assertAlmostEqual(drift['DriftPPM'], DRIFT_PPM, delta = 1)
+
+
+    def testSystemToDeviceInvertsDeviceToSystem(self):
+
+        model = ClockModel()
+        for syncData in makePackets(100):
+            model.addSyncData(syncData)
+
+        deviceTimes = np.array([p['device_time_stamp']
+                                for p in makePackets(100, seed = 1)],
+                               dtype = np.int64)
+        systemTimes = model.deviceToSystem(deviceTimes)
+        self.assertEqual(systemTimes.shape, deviceTimes.shape)
+        np.testing.assert_allclose(model.systemToDevice(systemTimes),
+                                   deviceTimes, rtol = 0, atol = 1e-3)
+        self.assertIsInstance(model.deviceToSystem(deviceTimes[0]), float)
+
+
+if __name__ == '__main__':
+    unittest.main()
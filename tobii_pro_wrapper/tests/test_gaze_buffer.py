@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+# Tests for the gaze ring buffer: order, wraparound, overruns, and the
+# readers that keep their own position
+
+import threading
+import unittest
+
+from tobii_pro_wrapper.gaze_buffer import GazeRingBuffer
+from tobii_pro_wrapper.simulated_tracker import SimulatedEyeTracker
+
+
+# function for making count gaze data dictionaries, numbered by their
+# system time stamp
+def makeSamples(count, start = 0):
+
+    tracker = SimulatedEyeTracker(seed = 1)
+    samples = []
+    for i in range(start, start + count):
+        gazeData = tracker._makeSample(1000.0 + i / 600.0)
+        gazeData['system_time_stamp'] = i
+        samples.append(gazeData)
+    return samples
+
+
+class GazeRingBufferTest(unittest.TestCase):
+
+    def testDrainReturnsSamplesInOrder(self):
+
+        buffer = GazeRingBuffer(10)
+        for gazeData in makeSamples(7):
+            buffer.append(gazeData)
+        self.assertEqual(len(buffer), 7)
+        self.assertEqual(list(buffer.drain()['system_time_stamp']),
+                         list(range(7)))
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(len(buffer.drain()), 0)
+
+
+    def testWraparoundKeepsNewestAndCountsOverruns(self):
+
+        buffer = GazeRingBuffer(10)
+        for gazeData in makeSamples(25):
+            buffer.append(gazeData)
+        self.assertEqual(buffer.writeCount, 25)
+        self.assertEqual(buffer.overrunCount, 15)
+        self.assertEqual(len(buffer), 10)
+        self.assertEqual(list(buffer.drain()['system_time_stamp']),
+                         list(range(15, 25)))
+
+        # drained in time, nothing more is lost
+        for gazeData in makeSamples(8, start = 25):
+            buffer.append(gazeData)
+        self.assertEqual(list(buffer.drain()['system_time_stamp']),
+                         list(range(25, 33)))
+        self.assertEqual(buffer.overrunCount, 15)
+
+
+    def testReadSinceSkipsOverwrittenAndLeavesDrainAlone(self):
+
+        buffer = GazeRingBuffer(10)
+        for gazeData in makeSamples(4):
+            buffer.append(gazeData)
+        samples, position = buffer.readSince(0)
+        self.assertEqual(list(samples['system_time_stamp']), [0, 1, 2, 3])
+        self.assertEqual(position, 4)
+
+        for gazeData in makeSamples(20, start = 4):
+            buffer.append(gazeData)
+        samples, position = buffer.readSince(position)
+        self.assertEqual(list(samples['system_time_stamp']),
+                         list(range(14, 24)))
+        self.assertEqual(position, 24)
+        self.assertEqual(buffer.readCount, 14)
+
+
+    def testLatestReceivedStampsNewestSample(self):
+
+        clockTimes = iter(range(100, 200))
+        buffer = GazeRingBuffer(10, clock = lambda: next(clockTimes))
+        self.assertEqual(len(buffer.latest()), 0)
+        for gazeData in makeSamples(12):
+            buffer.append(gazeData)
+        samples, receiveTime = buffer.latestReceived(3)
+        self.assertEqual(list(samples['system_time_stamp']), [9, 10, 11])
+        self.assertEqual(receiveTime, 111)
+        self.assertEqual(int(buffer.latest()['system_time_stamp'][0]), 11)
+
+
+    def testWaitForSample(self):
+
+        buffer = GazeRingBuffer(10)
+        self.assertEqual(buffer.waitForSample(0, timeout = 0.01), 0)
+        gazeData = makeSamples(1)[0]
+        timer = threading.Timer(0.05, buffer.append, (gazeData,))
+        timer.start()
+        self.assertEqual(buffer.waitForSample(0, timeout = 5.0), 1)
+        timer.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+# Tests for streaming gaze samples from a GazePublisher to GazeSubscribers:
+# the handshake, the samples sent, and dropping frames for a slow subscriber
+
+import json
+import socket
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from tobii_pro_wrapper import gaze_stream
+from tobii_pro_wrapper.gaze_buffer import GAZE_DTYPE, GazeRingBuffer
+from tobii_pro_wrapper.gaze_stream import GazePublisher, GazeSubscriber
+from tobii_pro_wrapper.tests.test_gaze_buffer import makeSamples
+
+
+# function for waiting until condition() is true, returns whether it became
+# true within timeout seconds
+def waitFor(condition, timeout = 5.0):
+
+    endTime = time.time() + timeout
+    while not condition():
+        if time.time() > endTime:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+class GazeStreamTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.buffer = GazeRingBuffer(200000)
+        self.publisher = None
+        self.subscriber = None
+
+
+    def tearDown(self):
+
+        if self.subscriber is not None:
+            self.subscriber.close()
+        if self.publisher is not None:
+            self.publisher.stop()
+
+
+    # start a publisher and connect a subscriber to it
+    def _connect(self, **kwargs):
+
+        self.publisher = GazePublisher(self.buffer, **kwargs)
+        address = self.publisher.start()
+        self.subscriber = GazeSubscriber(address)
+        self.assertTrue(waitFor(lambda: len(self.publisher) == 1))
+
+
+    def testHandshakeSendsRecordLayoutAndInfo(self):
+
+        self._connect(info = {'Frequency': 600})
+        self.assertEqual(self.subscriber.info['Frequency'], 600)
+        self.assertEqual(self.subscriber.info['version'],
+                         gaze_stream.STREAM_VERSION)
+        self.assertEqual(self.subscriber.dtype, GAZE_DTYPE)
+
+
+    def testSamplesMatchTheBuffer(self):
+
+        self._connect()
+        samples = makeSamples(300)
+        for gazeData in samples:
+            self.buffer.append(gazeData)
+
+        received = []
+        while sum(len(frame) for frame in received) < len(samples):
+            received.append(self.subscriber.receive())
+        received = np.concatenate(received)
+
+        self.assertEqual(list(received['system_time_stamp']),
+                         list(range(300)))
+        np.testing.assert_array_equal(
+                received['right_pupil_diameter'],
+                np.array([gazeData['right_pupil_diameter'] 
+                          for gazeData in samples], dtype = np.float32))
+        self.assertEqual(self.subscriber.missedSamples, 0)
+        self.assertTrue(waitFor(
+                lambda: self.publisher.getStats()[0]['LagSamples'] == 0))
+
+
+    def testEndOfStreamAfterPublisherStops(self):
+
+        self._connect()
+        self.publisher.stop()
+        self.assertIsNone(self.subscriber.receive())
+        self.assertEqual(list(self.subscriber), [])
+
+
+    def testCloseBeforeHandshakeRaisesValueError(self):
+
+        # a server that closes every connection straight away
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+
+        def acceptAndClose():
+            sock, address = listener.accept()
+            sock.close()
+
+        thread = threading.Thread(target = acceptAndClose)
+        thread.start()
+        try:
+            self.assertRaises(ValueError, GazeSubscriber,
+                              listener.getsockname())
+        finally:
+            thread.join()
+            listener.close()
+
+
+    def testWrongFirstFrameRaisesValueError(self):
+
+        # a server that sends samples, or a handshake of another version,
+        # instead of the handshake
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(2)
+        frames = [gaze_stream._packFrame(gaze_stream.SAMPLES_FRAME,
+                                         b'\0' * 16),
+                  gaze_stream._packFrame(gaze_stream.HANDSHAKE_FRAME,
+                                         json.dumps({'version': 99})
+                                         .encode('ascii'))]
+
+        def acceptAndSend():
+            for frame in frames:
+                sock, address = listener.accept()
+                sock.sendall(frame)
+                sock.close()
+
+        thread = threading.Thread(target = acceptAndSend)
+        thread.start()
+        try:
+            for frame in frames:
+                self.assertRaises(ValueError, GazeSubscriber,
+                                  listener.getsockname())
+        finally:
+            thread.join()
+            listener.close()
+
+
+    def testDropOldestCountsDropsForSlowSubscriber(self):
+
+        self._connect(policy = 'drop-oldest', maxQueue = 2)
+        gazeData = makeSamples(1)[0]
+
+        # the subscriber does not read until the socket buffers and the
+        # queue are full and frames are dropped
+        count = 0
+        while not self.publisher.getStats()[0]['DroppedSamples']:
+            self.assertLess(count, 2000000)
+            for i in range(count, count + 5000):
+                gazeData['system_time_stamp'] = i
+                self.buffer.append(gazeData)
+            count += 5000
+            time.sleep(0.02)
+
+        # read everything that was not dropped
+        received = 0
+        while self.subscriber.nextPosition is None or \
+                self.subscriber.nextPosition < count:
+            received += len(self.subscriber.receive())
+
+        # counted once the frame has been sent
+        self.assertTrue(waitFor(
+                lambda: self.publisher.getStats()[0]['LagSamples'] == 0))
+        stats = self.publisher.getStats()[0]
+        self.assertGreater(stats['DroppedFrames'], 0)
+        self.assertEqual(self.subscriber.missedSamples,
+                         stats['DroppedSamples'])
+        self.assertEqual(received + self.subscriber.missedSamples, count)
+        self.assertEqual(stats['SentSamples'], received)
+        self.assertEqual(self.publisher.lostCount, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+# Tests for writing gaze recordings and reading them back
+
+import json
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from tobii_pro_wrapper import recorder
+from tobii_pro_wrapper.gaze_buffer import GazeRingBuffer
+from tobii_pro_wrapper.recorder import GazeRecorder, GazeSession
+from tobii_pro_wrapper.tests.test_gaze_buffer import makeSamples
+
+
+class GazeRecorderTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.directory, 'recording.gaze')
+        self.buffer = GazeRingBuffer(10000)
+        # the writer thread stays asleep, stop() writes everything
+        self.recorder = GazeRecorder(self.buffer, self.fileName,
+                                     flushInterval = 3600.0)
+
+
+    def tearDown(self):
+
+        self.recorder.stop()
+        shutil.rmtree(self.directory)
+
+
+    def testRecordsRoundTrip(self):
+
+        self.recorder.start()
+        samples = makeSamples(50)
+        for gazeData in samples:
+            self.buffer.append(gazeData)
+        self.recorder.stop()
+
+        session = GazeSession(self.fileName)
+        self.assertEqual(len(session), 50)
+        self.assertEqual(list(session['system_time_stamp']), list(range(50)))
+        np.testing.assert_array_equal(
+                session['left_gaze_point_on_display_area'][7],
+                np.float32(samples[7]['left_gaze_point_on_display_area']))
+        self.assertEqual(self.recorder.lostCount, 0)
+
+
+    def testTrialsAndEventsBeyondHeaderSize(self):
+
+        self.recorder.start()
+        numSamples = 3000
+        self.recorder.beginTrial('first')
+        for i, gazeData in enumerate(makeSamples(numSamples)):
+            if i == 1000:
+                self.recorder.beginTrial('second')
+            if i == 2000:
+                self.recorder.endTrial()
+            # events at the next sample to arrive
+            self.recorder.addEvent('event' + str(i))
+            self.buffer.append(gazeData)
+        self.recorder.stop()
+
+        session = GazeSession(self.fileName)
+        self.assertEqual(len(session), numSamples)
+        self.assertEqual(session.trials, [('first', 0, 1000),
+                                          ('second', 1000, 2000)])
+        self.assertEqual(len(session.events), numSamples)
+        self.assertEqual(session.events[-1], ('event2999', 2999))
+        self.assertEqual(len(session.getTrial('second')), 1000)
+
+
+    def testOpenTrialLastsUntilTheEnd(self):
+
+        self.recorder.start()
+        self.recorder.beginTrial('open')
+        for gazeData in makeSamples(20):
+            self.buffer.append(gazeData)
+        self.recorder.stop()
+
+        self.assertEqual(GazeSession(self.fileName).trials,
+                         [('open', 0, 20)])
+
+
+    def testReadsVersion2Recordings(self):
+
+        records = recorder._sessionRecords(self._bufferSamples(5))
+        info = json.dumps({'version': 2,
+                           'dtype': recorder.SESSION_DTYPE.descr,
+                           'trials': [['old', 1, None]],
+                           'events': [['event', 2]]}).encode('ascii')
+        prefix = b'TPWGAZE2' + struct.pack('<I', recorder.HEADER_SIZE)
+        with open(self.fileName, 'wb') as f:
+            f.write(prefix + info +
+                    b' ' * (recorder.HEADER_SIZE - len(prefix) - len(info)))
+            f.write(records.tobytes())
+
+        session = GazeSession(self.fileName)
+        self.assertEqual(len(session), 5)
+        self.assertEqual(session.trials, [('old', 1, 5)])
+        self.assertEqual(session.events, [('event', 2)])
+
+
+    def testMarksAreStoredWithTheirRecord(self):
+
+        self.recorder.start()
+        self.recorder.mark('start', {'condition': 'a'}, timestamp = 10)
+        self.recorder.mark('end', timestamp = 20)
+        self.recorder.mark('start', {'condition': 'b'}, timestamp = 30)
+        # after the last sample
+        self.recorder.mark('late', timestamp = 1000)
+        for gazeData in makeSamples(50):
+            self.buffer.append(gazeData)
+        self.recorder.stop()
+
+        marks = recorder.readMarks(self.fileName)
+        self.assertEqual(marks, [(10, 'start', {'condition': 'a'}, 10),
+                                 (20, 'end', None, 20),
+                                 (30, 'start', {'condition': 'b'}, 30),
+                                 (1000, 'late', None, 50)])
+        session = GazeSession(self.fileName)
+        self.assertEqual([mark[2] for mark in session.getMarks('start')],
+                         [{'condition': 'a'}, {'condition': 'b'}])
+
+
+    def testRecordsBetweenMarks(self):
+
+        self.recorder.start()
+        self.recorder.mark('start', timestamp = 10)
+        self.recorder.mark('end', timestamp = 20)
+        self.recorder.mark('start', timestamp = 30)
+        for gazeData in makeSamples(50):
+            self.buffer.append(gazeData)
+        self.recorder.stop()
+
+        session = GazeSession(self.fileName)
+        self.assertEqual(list(session.getBetweenMarks('start', 'end')
+                              ['system_time_stamp']), list(range(10, 20)))
+        # the second start has no end after it, it lasts until the end
+        self.assertEqual(list(session.getBetweenMarks('start', occurrence = 1)
+                              ['system_time_stamp']), list(range(30, 50)))
+        self.assertEqual(len(session.getTimeRange(5, 8)), 3)
+        self.assertRaises(ValueError, session.getBetweenMarks, 'start',
+                          'missing')
+        self.assertRaises(ValueError, session.getBetweenMarks, 'start',
+                          occurrence = 2)
+
+
+    def testMarkTimeFromTheBufferClock(self):
+
+        self.assertRaises(ValueError, self.recorder.mark, 'noClock')
+
+        buffer = GazeRingBuffer(100, clock = lambda: 25)
+        fileName = os.path.join(self.directory, 'clock.gaze')
+        clockRecorder = GazeRecorder(buffer, fileName, flushInterval = 3600.0)
+        clockRecorder.start()
+        clockRecorder.mark('now')
+        for gazeData in makeSamples(50):
+            buffer.append(gazeData)
+        clockRecorder.stop()
+
+        self.assertEqual(recorder.readMarks(fileName), [(25, 'now', None, 25)])
+
+
+    # samples of a fresh buffer, as a structured array
+    def _bufferSamples(self, count):
+
+        buffer = GazeRingBuffer(count)
+        for gazeData in makeSamples(count):
+            buffer.append(gazeData)
+        return buffer.drain()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -30,24 +30,53 @@
 # added. 
 
 # -----Import Required Libraries-----
-import gtk, pygtk
+import numpy as np
 
-from psychopy import core as pcore
-from psychopy import monitors, visual, gui, data, event
-from psychopy.iohub import launchHubServer
+# gtk, psychopy, and the Tobii Pro SDK are slow to import and not needed for
+# acquisition or coordinate conversion, so each is only imported the first
+# time a function uses it
+from .lazy_import import LazyModule
 
-import datetime as dt
-import numpy as np
-from scipy.spatial import distance
+gtk = LazyModule('gtk')
+
+pcore = LazyModule('psychopy.core')
+monitors = LazyModule('psychopy.monitors')
+visual = LazyModule('psychopy.visual')
+event = LazyModule('psychopy.event')
 
-import tobii_research as tobii
+tobii = LazyModule('tobii_research')
 
 import collections
+import time
+
+from . import coordinates, frame_timing, gaze_buffer, gaze_metrics
+from .acquisition_server import AcquisitionServer
+from .calibration_collector import CalibrationCollector
+from .clock_sync import ClockModel
+from .event_detection import EventDetector
+from .frame_timing import FrameTimer
+from .gaze_buffer import GazeRingBuffer
+from .gaze_stream import GazePublisher
+from .recorder import GazeRecorder
+from .smoothing import GazeSmoother
 
 # -----Class for working with Tobii Eyetrackers -----
 class TobiiHelper:
     
-    def __init__(self):
+    # backend is the module (or an object providing the same functions) used
+    # to talk to eyetrackers, by default the Tobii Pro SDK. Pass a 
+    # simulated_tracker.SimulatedBackend() to run without hardware
+    def __init__(self, bufferCapacity = 72000, backend = None):
+        
+        # use the Tobii Pro SDK unless told otherwise
+        if backend is None:
+            try:
+                backend = tobii._load()
+            except ImportError:
+                raise ImportError("The Tobii Pro SDK (tobii_research) is " +\
+                                  "not installed. Install it, or pass a " +\
+                                  "simulated backend.")
+        self.backend = backend
         
         self.eyetracker = None
         
@@ -55,6 +84,10 @@ class TobiiHelper:
         
         self.tbCoordinates = {}
         
+        self.coordinateTransform = None
+        
+        self.trackerSpaceChanged = False
+        
         self.calibration = None
         
         self.tracking = False
@@ -63,8 +96,31 @@ class TobiiHelper:
                 
         self.gazeData = {}
         
+        # samples are stamped with the time they arrive, for measuring 
+        # latency
+        self.gazeBuffer = GazeRingBuffer(
+                bufferCapacity, clock = self.backend.get_system_time_stamp)
+        
+        self.gazeFrequency = None
+        
+        self.lastSampleCount = 0
+        
+        self.recorder = None
+        
+        self.publisher = None
+        
+        self.eventDetector = None
+        
+        # gaze data can be received by another process instead, the local 
+        # gaze buffer is kept meanwhile
+        self.acquisitionServer = None
+        self.localGazeBuffer = None
+        
         self.syncData = {}
         
+        # maps device time stamps to system time stamps
+        self.clockModel = ClockModel()
+        
         self.currentOutData = {}
           
 # ----- Functions for initialzing the eyetracker and class attributes -----      
@@ -73,7 +129,7 @@ class TobiiHelper:
     def findTracker(self, serialString = None):
         
         # try to find all eyetrackers
-        allTrackers = tobii.find_all_eyetrackers()
+        allTrackers = self.backend.find_all_eyetrackers()
         
         # if there are no eyetrackers
         if len(allTrackers) < 1:
@@ -89,7 +145,7 @@ class TobiiHelper:
             print("Name: " + eyetracker.device_name)
             print("Serial number: " + eyetracker.serial_number)
             # create eyetracker object
-            self.eyetracker = tobii.EyeTracker(address)
+            self.eyetracker = self.backend.EyeTracker(address)
         # if serial number is not given as a string
         elif not isinstance(serialString, basestring):
             raise TypeError("Serial number must be formatted as a string.")        
@@ -106,13 +162,21 @@ class TobiiHelper:
                     print("Serial number: " + eyetracker.serial_number)
 
                     # create eyetracker object
-                    self.eyetracker = tobii.EyeTracker(address)
+                    self.eyetracker = self.backend.EyeTracker(address)
 
         # check to see that eyetracker is connected
         if self.eyetracker is None:
             print("Eyetracker did not connect. Check serial number?")
         else:
             print("Eyetracker connected successfully.")
+            # keep the coordinate transforms up to date if the display area 
+            # is changed on the eyetracker
+            if hasattr(self.backend, 
+                       'EYETRACKER_NOTIFICATION_DISPLAY_AREA_CHANGED'):
+                self.eyetracker.subscribe_to(
+                        self.backend.EYETRACKER_NOTIFICATION_DISPLAY_AREA_CHANGED,
+                        self.displayAreaCallback,
+                        as_dictionary = True)
     
         
     # function for getting trackbox (tb) and active display area (ada)coordinates, returns
@@ -146,6 +210,11 @@ class TobiiHelper:
                                     trackBox.front_lower_right[0])
         self.tbCoordinates['height'] = trackBoxHeight
         self.tbCoordinates['width'] = trackBoxWidth
+        
+        
+        # precompute conversions between coordinate systems
+        self.trackerSpaceChanged = False
+        self._updateCoordinateTransform()
 
 
     # define and calibrate experimental monitor, set monitor dimensions
@@ -191,13 +260,22 @@ class TobiiHelper:
             # save monitor
             thisMon.saveMon()  # save monitor calibration
             self.win = thisMon
+            
+        # precompute conversions between coordinate systems
+        self._updateCoordinateTransform()
                          
              
 # ----- Functions for starting and stopping eyetracker data collection -----
 
-    # function for broadcasting real time gaze data
+    # function for broadcasting real time gaze data, every sample is also
+    # kept in the gaze buffer so nothing is lost between reads
     def gazeDataCallback(self,startGazeData):
         self.gazeData = startGazeData
+        self.gazeBuffer.append(startGazeData)
+        # classify the sample as part of a fixation, saccade, or blink
+        eventDetector = self.eventDetector
+        if eventDetector is not None:
+            eventDetector.addSample(startGazeData)
     
     
     # function for subscribing to real time gaze data from eyetracker
@@ -207,9 +285,19 @@ class TobiiHelper:
         if self.eyetracker is None:
             raise ValueError("There is no eyetracker.")
         
+        # samples already arrive through the acquisition server
+        if self.acquisitionServer is not None:
+            self.lastSampleCount = self.gazeBuffer.writeCount
+            self.tracking = True
+            return
+        
         # if it is, proceed
         print "Subscribing to eyetracker."
-        self.eyetracker.subscribe_to(tobii.EYETRACKER_GAZE_DATA, 
+        # samples are delivered at the eyetracker's own output frequency
+        self.gazeFrequency = self.eyetracker.get_gaze_output_frequency()
+        # only samples from this subscription count as new
+        self.lastSampleCount = self.gazeBuffer.writeCount
+        self.eyetracker.subscribe_to(self.backend.EYETRACKER_GAZE_DATA, 
                                      self.gazeDataCallback, 
                                      as_dictionary = True)
         self.tracking = True
@@ -221,17 +309,82 @@ class TobiiHelper:
         # check to see if eyetracker is there
         if self.eyetracker is None:
             raise ValueError("There is no eyetracker.")
+        # the acquisition server keeps receiving until it is stopped
+        if self.acquisitionServer is not None:
+            self.tracking = False
+            return
         # if it is, proceed
         print "Unsubscribing from eyetracker"
-        self.eyetracker.unsubscribe_from(tobii.EYETRACKER_GAZE_DATA, 
+        self.eyetracker.unsubscribe_from(self.backend.EYETRACKER_GAZE_DATA, 
                                          self.gazeDataCallback)
         self.tracking = False
     
+    
+    # function for receiving gaze data in a separate process, so the gaze 
+    # callback and psychopy do not compete for the GIL. The process 
+    # subscribes to this eyetracker and writes samples to shared memory, 
+    # which becomes self.gazeBuffer, so every function reading gaze data 
+    # works as before. backendFactory is called in the new process to get 
+    # the backend, by default the Tobii Pro SDK. Event detection needs the 
+    # gaze callback of this process and does not see these samples. Start 
+    # recording after starting the server
+    def startAcquisitionServer(self, backendFactory = None):
+        
+        # check to see if eyetracker is there
+        if self.eyetracker is None:
+            raise ValueError("There is no eyetracker.\n" +\
+                             "Try running findTracker().")
+        if self.acquisitionServer is not None:
+            raise ValueError("The acquisition server is already running.")
+        if self.tracking:
+            raise ValueError("Gaze data is already being received.\n" +\
+                             "Try running stopGazeData().")
+        
+        server = AcquisitionServer(self.eyetracker.serial_number, 
+                                   capacity = self.gazeBuffer.capacity,
+                                   backendFactory = backendFactory)
+        server.start()
+        print ("Acquisition server receiving from " + server.serialNumber)
+        # samples are stamped by the server, this clock is for marks
+        server.ring.clock = self.backend.get_system_time_stamp
+        
+        self.localGazeBuffer = self.gazeBuffer
+        self.gazeBuffer = server.ring
+        self.acquisitionServer = server
+        self.gazeFrequency = server.frequency
+        self.lastSampleCount = self.gazeBuffer.writeCount
+        self.tracking = True
+    
+    
+    # function for stopping the acquisition server and going back to the 
+    # local gaze buffer
+    def stopAcquisitionServer(self):
+        
+        if self.acquisitionServer is None:
+            raise ValueError("The acquisition server is not running.\n" +\
+                             "Try running startAcquisitionServer().")
+        if self.recorder is not None:
+            raise ValueError("Still recording from the acquisition server.\n" +\
+                             "Try running stopRecording().")
+        if self.publisher is not None:
+            raise ValueError("Still publishing from the acquisition server.\n" +\
+                             "Try running stopPublishing().")
+        
+        self.acquisitionServer.stop()
+        self.acquisitionServer = None
+        self.gazeBuffer = self.localGazeBuffer
+        self.localGazeBuffer = None
+        self.lastSampleCount = self.gazeBuffer.writeCount
+        self.tracking = False
+        print ("Acquisition server stopped.")
+    
         
 # ----- Helper functions -----
-    # function for checking tracker and computer synchronization
+    # function for checking tracker and computer synchronization, every 
+    # packet refines the clock model
     def timeSyncCallback(self, timeSyncData):
         self.syncData = timeSyncData
+        self.clockModel.addSyncData(timeSyncData)
     
     
     # broadcast synchronization data
@@ -242,16 +395,40 @@ class TobiiHelper:
             
         # if it is , proceed
         print "Subscribing to time synchronization data"
-        self.eyetracker.subscribe_to(tobii.EYETRACKER_TIME_SYNCHRONIZATION_DATA,
+        # packets from an earlier subscription may be from another eyetracker
+        self.clockModel.reset()
+        self.eyetracker.subscribe_to(self.backend.EYETRACKER_TIME_SYNCHRONIZATION_DATA,
                                      self.timeSyncCallback,
                                      as_dictionary=True)
    
      
     # stop broadcasting synchronization data    
     def stopSyncData(self):
-        self.eyetracker.unsubscribe_from(tobii.EYETRACKER_TIME_SYNCHRONIZATION_DATA,
+        self.eyetracker.unsubscribe_from(self.backend.EYETRACKER_TIME_SYNCHRONIZATION_DATA,
                                         self.timeSyncCallback)
         print "Unsubscribed from time synchronization data."
+    
+    
+    # function for converting device time stamps (microseconds, e.g. the 
+    # DeviceTimeStamp column of gaze data) to system time stamps, the clock of
+    # SystemTimeStamp and psychopy flips timed with get_system_time_stamp(). 
+    # Takes a single value or an array, returns float microseconds
+    def deviceToSystemTime(self, deviceTimeStamps):
+        
+        if not self.clockModel.isFitted():
+            raise ValueError("No time synchronization data yet.\n" +\
+                             "Try running startSyncData().")
+        return self.clockModel.deviceToSystem(deviceTimeStamps)
+    
+    
+    # function for converting system time stamps (microseconds) to device 
+    # time stamps, e.g. to find the samples at a stimulus onset
+    def systemToDeviceTime(self, systemTimeStamps):
+        
+        if not self.clockModel.isFitted():
+            raise ValueError("No time synchronization data yet.\n" +\
+                             "Try running startSyncData().")
+        return self.clockModel.systemToDevice(systemTimeStamps)
   
     # function for converting positions from trackbox coordinate system (mm) to 
     # normalized active display area coordinates   
@@ -264,25 +441,12 @@ class TobiiHelper:
             raise TypeError("XY coordinates must be given as tuple.")
         elif isinstance(xyCoor, tuple) and len(xyCoor) is not 2: 
             raise ValueError("Wrong number of coordinate dimensions")
-        # check tracker box and ada coordinates
-        if self.tbCoordinates is None or self.adaCoordinates is None:
-            raise ValueError("Missing trackbox coordinates. \n" +\
-                             "Try running getTrackerSpace()")
 
-        # get tb and ada values from eyetracker        
-        tbDict = self.tbCoordinates
-        tbLowLeft = (tbDict.get('bottomLeft')[0], 
-                     tbDict.get('bottomLeft')[1])
-        adaDict = self.adaCoordinates      
-        adaLowLeft = ((adaDict.get('width')/-2), 
-                       (adaDict.get('height')/-2))
-        
-        # create ratios for x and y coordinates
-        yRatio = tbLowLeft[1]/adaLowLeft[1]
-        xRatio = tbLowLeft[0]/adaLowLeft[0]
+        # get precomputed ratios for x and y coordinates
+        scale, offset = self._getCoordinateTransform().get('trackbox', 'ada')
        
         # convert and return coordinates
-        adaNorm = ((xyCoor[0] * xRatio), (xyCoor[1] * yRatio))
+        adaNorm = ((xyCoor[0] * scale[0]), (xyCoor[1] * scale[1]))
         return adaNorm
     
     
@@ -298,13 +462,12 @@ class TobiiHelper:
         elif isinstance(xyCoor, tuple) and len(xyCoor) is not 2: 
             raise ValueError("Wrong number of coordinate dimensions")
 
-        # convert track box coordinates to adac coordinates
-        adaCoors = self.tb2Ada(xyCoor)
-        # correct for psychopy window coordinates
-        centerScale = self.tb2Ada((1, 1))
-        centerShift = ((centerScale[0] / 2), (centerScale[1] / 2))
-        psychoNorm = (adaCoors[0] - centerShift[0], 
-                      adaCoors[1] - centerShift[1])
+        # convert track box coordinates to ada coordinates, corrected for 
+        # psychopy window coordinates
+        scale, offset = self._getCoordinateTransform().get('trackbox', 
+                                                           'psychoNorm')
+        psychoNorm = (xyCoor[0] * scale[0] + offset[0], 
+                      xyCoor[1] * scale[1] + offset[1])
         # return coordinates in psychowin 'norm' units
         return psychoNorm
     
@@ -327,11 +490,10 @@ class TobiiHelper:
             return psychoPix
 
         # convert to pixels and correct for psychopy window coordinates
-        monHW = (self.win.getSizePix()[0], 
-                 self.win.getSizePix()[1])
-        wShift, hShift = monHW[0] / 2 , monHW[1] / 2
-        psychoPix = (int(((xyCoor[0]* monHW[0]) - wShift)), 
-                     int(((xyCoor[1] * monHW[1]) - hShift) * -1))
+        transform = self._getCoordinateTransform(pixels = True)
+        scale, offset = transform.get('ada', 'psychoPix')
+        psychoPix = (int(xyCoor[0] * scale[0] + offset[0]), 
+                     int(xyCoor[1] * scale[1] + offset[1]))
         # return coordinates in psychowin 'pix' units
         return psychoPix
 
@@ -354,11 +516,70 @@ class TobiiHelper:
             return monPix
 
         # convert so point of gaze on monitor is accurate
-        monPix = (int(xyCoor[0] * self.win.getSizePix()[0]),
-                  int(xyCoor[1] * self.win.getSizePix()[1]))                                
+        transform = self._getCoordinateTransform(pixels = True)
+        scale, offset = transform.get('ada', 'monPix')
+        monPix = (int(xyCoor[0] * scale[0]), int(xyCoor[1] * scale[1]))
         return monPix        
     
         
+    # functions for converting whole arrays of coordinates at once. Each takes
+    # an (N, 2) array (or anything numpy can turn into one) and returns an 
+    # (N, 2) float array. Missing values stay nan, and pixel values are 
+    # truncated to whole pixels like the single coordinate versions above
+    def tb2AdaArray(self, xyCoors):
+        return self._getCoordinateTransform().convert('trackbox', 'ada', 
+                                                      xyCoors)
+    
+    
+    def tb2PsychoNormArray(self, xyCoors):
+        return self._getCoordinateTransform().convert('trackbox', 'psychoNorm',
+                                                      xyCoors)
+    
+    
+    def ada2PsychoPixArray(self, xyCoors):
+        return np.trunc(self._getCoordinateTransform(pixels = True).convert(
+                'ada', 'psychoPix', xyCoors))
+    
+    
+    def ada2MonPixArray(self, xyCoors):
+        return np.trunc(self._getCoordinateTransform(pixels = True).convert(
+                'ada', 'monPix', xyCoors))
+    
+    
+    # function called by the eyetracker when its display area is changed, 
+    # the coordinate transforms are rebuilt before they are next used
+    def displayAreaCallback(self, notification):
+        self.trackerSpaceChanged = True
+        
+        
+    # rebuild the coordinate transforms from the current trackbox, display
+    # area, and monitor size
+    def _updateCoordinateTransform(self):
+        
+        sizePix = None if self.win is None else self.win.getSizePix()
+        self.coordinateTransform = coordinates.CoordinateTransform(
+                self.tbCoordinates, self.adaCoordinates, sizePix)
+    
+    
+    # get the coordinate transforms, re-reading the display area first if 
+    # the eyetracker reported a change. For conversions to or from pixels
+    # (pixels = True) they are also rebuilt if the monitor size changed 
+    # without going through setMonitor()
+    def _getCoordinateTransform(self, pixels = False):
+        
+        if self.trackerSpaceChanged:
+            self.getTrackerSpace()
+        elif self.coordinateTransform is None:
+            self._updateCoordinateTransform()
+        elif pixels:
+            sizePix = None if self.win is None else self.win.getSizePix()
+            if sizePix is not None:
+                sizePix = tuple(sizePix)
+            if sizePix != self.coordinateTransform.sizePix:
+                self._updateCoordinateTransform()
+        return self.coordinateTransform
+    
+        
 # ----- Functions for collecting eye and gaze data -----
       
     # function for collecting gaze coordinates in tobiis ada coordinate 
@@ -372,23 +593,15 @@ class TobiiHelper:
         if self.tracking is False:
             raise ValueError("The eyetracker is not turned on.")
             
-        # while tracking
-        while True:
-            # access gaze data dictionary to get gaze position tuples
-            lGazeXYZ = self.gazeData['left_gaze_point_on_display_area']
-            rGazeXYZ = self.gazeData['right_gaze_point_on_display_area']       
-            # get 2D gaze positions for left and right eye
-            xs = (lGazeXYZ[0], rGazeXYZ[0])
-            ys = (lGazeXYZ[1], rGazeXYZ[1])   
-            
-            # if all of the axes have data from at least one eye
-            if all([x != -1.0 for x in xs]) and all([y != -1.0 for y in ys]):
-                # take x and y averages
-                avgGazePos = np.nanmean(xs), np.nanmean(ys)
-            else:
-                # or if no data, hide points by showing off screen
-                avgGazePos = (np.nan, np.nan)
-            return avgGazePos
+        # get the most recent sample from the gaze buffer
+        sample = self.gazeBuffer.latest()
+        # if no data, hide points by showing off screen
+        if len(sample) == 0:
+            return (np.nan, np.nan)
+        
+        # average x and y positions of both eyes
+        avgGazePos = gaze_buffer.avgGazePos(sample)[0]
+        return avgGazePos[0], avgGazePos[1]
 
                 
     # function for finding the avg 3d position of subject's eyes, so that they
@@ -402,42 +615,33 @@ class TobiiHelper:
         if self.tracking is False:
             raise ValueError("The eyetracker is not turned on.")
             
-        # while tracking
-        while True:     
-            # access gaze data dictionary to get eye position tuples, 
-            # in trackbox coordinate system
-            lTbXYZ = self.gazeData['left_gaze_origin_in_trackbox_coordinate_system']
-            rTbXYZ = self.gazeData['right_gaze_origin_in_trackbox_coordinate_system']
-
-            # left eye validity
-            lVal = self.gazeData['left_gaze_origin_validity']
-            # right eye validity
-            rVal = self.gazeData['right_gaze_origin_validity']
-                  
-            # if left eye is found by the eyetracker
-            if lVal == 1:
-                # update the left eye positions if the values are reasonable
-                # scale left eye position so that it fits in track box
-                leftTbPos = (-self.tb2PsychoNorm((lTbXYZ[0], 
-                                                  lTbXYZ[1]))[0] * 1.7,
-                              self.tb2PsychoNorm((lTbXYZ[0], 
-                                                  lTbXYZ[1]))[1])
-            else:
-                # hide by drawing in the corner
-                leftTbPos = [0.99, 0.99] 
-                    
-            # if right eye is found by the eyetracker
-            if rVal == 1:
-                # update the right eye positions if the values are reasonable
-                # scale right eye position so that it fits in track box
-                rightTbPos = (-self.tb2PsychoNorm((rTbXYZ[0], rTbXYZ[1]))[0] * 1.7, 
-                               self.tb2PsychoNorm((rTbXYZ[0], 
-                                                   rTbXYZ[1]))[1])
-            else:
-                # hide by drawing in the corner
-                rightTbPos = [0.99, 0.99]        
-            # return values for positio in track box
+        # hide both eyes by drawing in the corner until they are found
+        leftTbPos = [0.99, 0.99] 
+        rightTbPos = [0.99, 0.99] 
+        
+        # get the most recent sample from the gaze buffer
+        sample = self.gazeBuffer.latest()
+        if len(sample) == 0:
             return leftTbPos, rightTbPos
+        
+        # eye position in trackbox coordinate system
+        lTbXYZ = sample['left_gaze_origin_in_trackbox_coordinate_system'][0]
+        rTbXYZ = sample['right_gaze_origin_in_trackbox_coordinate_system'][0]
+              
+        # if left eye is found by the eyetracker
+        if sample['left_gaze_origin_validity'][0] == 1:
+            # scale left eye position so that it fits in track box
+            leftNorm = self.tb2PsychoNorm((float(lTbXYZ[0]), float(lTbXYZ[1])))
+            leftTbPos = (-leftNorm[0] * 1.7, leftNorm[1])
+                
+        # if right eye is found by the eyetracker
+        if sample['right_gaze_origin_validity'][0] == 1:
+            # scale right eye position so that it fits in track box
+            rightNorm = self.tb2PsychoNorm((float(rTbXYZ[0]), float(rTbXYZ[1])))
+            rightTbPos = (-rightNorm[0] * 1.7, rightNorm[1])
+            
+        # return values for positio in track box
+        return leftTbPos, rightTbPos
              
     
     # x, y, and z dimensions are given in mm from the tracker origin, gives the
@@ -451,27 +655,15 @@ class TobiiHelper:
         if self.tracking is False:
             raise ValueError("The eyetracker is not turned on.")
             
-        # while tracking
-        while True:     
-            # access gaze data dictionary to get eye position tuples, given in 
-            # mm in from eyetracker origin
-            lOriginXYZ = self.gazeData['left_gaze_origin_in_user_coordinate_system']  
-            rOriginXYZ = self.gazeData['right_gaze_origin_in_user_coordinate_system'] 
-                
-            # create arrays with positions of both eyes on x, y, and z axes
-            xs = (lOriginXYZ[0],rOriginXYZ[0])
-            ys = (lOriginXYZ[1],rOriginXYZ[1])
-            zs = (lOriginXYZ[2],rOriginXYZ[2])
-                        
-            # if all of the axes have data from at least one eye
-            if not (np.isnan(xs)).all() or not (np.isnan(ys)).all() or not (np.isnan(zs)).all():     
-                # update the distance if the values are reasonable 
-                avgEyePos = (np.nanmean(xs), np.nanmean(ys), np.nanmean(zs))
-            else:
-                # otherwise set to zero
-                avgEyePos = (0, 0, 0)
-            # return average eye position in mm
-            return avgEyePos
+        # get the most recent sample from the gaze buffer
+        sample = self.gazeBuffer.latest()
+        # if no eyes were found set to zero
+        if len(sample) == 0:
+            return (0, 0, 0)
+                    
+        # return average eye position in mm
+        avgEyePos = gaze_buffer.avgEyePos(sample)[0]
+        return avgEyePos[0], avgEyePos[1], avgEyePos[2]
             
             
     # get average distance of the eyes from the tracker origin, given in cm
@@ -483,21 +675,14 @@ class TobiiHelper:
         if self.tracking is False:
             raise ValueError("The eyetracker is not turned on.")
             
-        # while tracking
-        while True:
-            # get eye positions
-            eyeCoors = self.getAvgEyePos()
-           
-            # if eyes were found
-            if sum(eyeCoors) > 0:
-                # calculate the euclidean distance of eyes from tracker origin
-                avgEyeDist = distance.euclidean((eyeCoors[0]/10, 
-                                                 eyeCoors[1]/10,  
-                                                 eyeCoors[2]/10), (0, 0, 0))
-            else: # if eyes were not found, return zero values
-                avgEyeDist = 0
-            # return distance value in cm       
-            return avgEyeDist
+        # get the most recent sample from the gaze buffer
+        sample = self.gazeBuffer.latest()
+        # if eyes were not found, return zero values
+        if len(sample) == 0:
+            return 0
+            
+        # return distance value in cm       
+        return gaze_buffer.avgEyeDist(sample)[0]
             
         
     # get average size of pupils in mm, can easily be rewritten to return
@@ -510,24 +695,18 @@ class TobiiHelper:
         if self.tracking is False:
             raise ValueError("The eyetracker is not turned on.")
             
-        # while tracking
-        while True:
-            lPup = self.gazeData['left_pupil_diameter']
-            rPup = self.gazeData['right_pupil_diameter']
-            pupSizes = (lPup, rPup)
+        # get the most recent sample from the gaze buffer
+        sample = self.gazeBuffer.latest()
+        # if pupils were not found return zero
+        if len(sample) == 0:
+            return 0.0
             
-            # if pupils were found
-            if lPup != -1 and rPup != -1:
-                avgPupSize = np.nanmean(pupSizes)
-            else: # otherwise return zero
-                avgPupSize = (0.0)
-                
-            # return pupil size
-            return avgPupSize
+        # return pupil size
+        return gaze_buffer.avgPupilSize(sample)[0]
             
     
-    # check the validities of right and left eyes, returns as a tuple of 
-    # true/false values
+    # check the validities of right and left eyes, returns 0 if neither eye 
+    # is valid, 1 for just the left eye, 2 for just the right, 3 for both
     def checkEyeValidities(self):
         
         # check to see if the eyetracker is connected and turned on
@@ -536,26 +715,14 @@ class TobiiHelper:
         if self.tracking is False:
             raise ValueError("The eyetracker is not turned on.")
            
-        # while tracking
-        while True:
-            # get validity values
-            lVal = self.gazeData['left_gaze_origin_validity']
-            rVal = self.gazeData['right_gaze_origin_validity']
-            # default validity value
-            validities = 0 # neither eye is valid
-
-            # if both eyes are valid, return 3
-            if lVal == 1 and rVal == 1:
-                validities = 3
-            # if just left eye is valid, return 1
-            elif lVal == 1 and rVal == 0:
-                validities = 1
-            # if just right eye is valid, return 2
-            elif lVal == 0 and rVal == 1 : 
-                validities = 2
-
-            # return validity values
-            return validities
+        # get the most recent sample from the gaze buffer
+        sample = self.gazeBuffer.latest()
+        # default validity value, neither eye is valid
+        if len(sample) == 0:
+            return 0
+            
+        # return validity values
+        return gaze_buffer.eyeValidities(sample)[0]
         
                
 # ----- Functions for running calibration -----
@@ -600,12 +767,30 @@ class TobiiHelper:
                                   pos = [0.0, -0.65],
                                   height = 0.07)
 
+        # moving average of left and right eye positions and eye distance
+        smoother = GazeSmoother('average', window = 5, dimensions = 5)
+        nan = float('nan')
+
         # while tracking 
         while True:         
             # find and update eye positions
-            leftStim.pos, rightStim.pos = self.trackboxEyePos()
+            leftPos, rightPos = self.trackboxEyePos()
             eyeDist = self.getAvgEyeDist()
             
+            # smooth only what was found, eyes that were not found stay in 
+            # the corner so they are hidden below
+            leftFound, rightFound = leftPos[0] != 0.99, rightPos[0] != 0.99
+            smoothed = smoother.add(
+                    (leftPos[0] if leftFound else nan, 
+                     leftPos[1] if leftFound else nan,
+                     rightPos[0] if rightFound else nan, 
+                     rightPos[1] if rightFound else nan,
+                     eyeDist if eyeDist > 0 else nan))
+            leftStim.pos = smoothed[0:2] if leftFound else leftPos
+            rightStim.pos = smoothed[2:4] if rightFound else rightPos
+            if eyeDist > 0:
+                eyeDist = smoothed[4]
+            
                 # change color depending on distance
             if eyeDist >= 55 and eyeDist <= 75:
                 # correct distance
@@ -717,23 +902,17 @@ class TobiiHelper:
                                   lineColor = [1.0, -1.0, -1.0],  # red
                                   fillColor = [1.0, -1.0, -1.0])  # red
          
-        # create array for smoothing gaze position
-        gazePositions = np.array([0.0, 0.0])
-        maxLength = 6
+        # moving average for smoothing gaze position
+        smoother = GazeSmoother('average', window = 5)
     
         # while tracking 
         while True:   
     
             # smooth gaze data with moving window
-            gazePositions = np.vstack((gazePositions, 
-                                       np.array(self.getAvgGazePos())))
-            curPos = np.nanmean(gazePositions, axis = 0)
-            # remove previous position values
-            if len(gazePositions) == maxLength:
-                gazePositions = np.delete(gazePositions, 0, axis = 0)
+            curPos = smoother.add(self.getAvgGazePos())
     
             # update stimuli in window and draw
-            drawStim = self.ada2PsychoPix(tuple(curPos))
+            drawStim = self.ada2PsychoPix(curPos)
             
             # draw gaze position only if found
             if drawStim[0] is not self.win.getSizePix()[0]: 
@@ -765,6 +944,191 @@ class TobiiHelper:
             event.clearEvents(eventType='keyboard')   
     
             
+    # function for measuring calibration quality without an experimenter. 
+    # Shows each point of pointDict in turn, collects numSamples gaze samples
+    # from the gaze buffer once the eyes had settleTime seconds to reach it, 
+    # and computes accuracy and precision of each eye at each point in 
+    # degrees, using the distance of the eyes from the screen at every 
+    # sample. Returns a report dictionary with 
+    #   Metrics       gaze_metrics.METRICS_DTYPE record for each point
+    #   PointPassed   True for each point within the thresholds
+    #   FailedPoints  ordered dictionary of the points that failed, in the
+    #                 format of pointDict, e.g. for recalibrating them
+    #   Passed        True if every point passed
+    # plus the averages over all points from gaze_metrics.summarizeMetrics
+    # and the thresholds that were used
+    def runQuantitativeValidation(self, pointDict = None, numSamples = 60, 
+                                  settleTime = 0.5, maxAccuracy = 1.0, 
+                                  maxPrecision = 0.5, minValidity = 0.8):
+        
+        # check the values of the point dictionary
+        if pointDict is None: 
+            pointList = [('1',(0.1, 0.1)), ('2',(0.9, 0.1)), ('3',(0.5, 0.5)), 
+                         ('4',(0.1, 0.9)), ('5',(0.9, 0.9))]
+            pointDict = collections.OrderedDict(pointList)
+        if not isinstance(pointDict, dict):
+            raise TypeError('pointDict must be a dictionary with number ' +\
+                            'keys and coordinate values.')
+        if numSamples is None or numSamples < 2:
+            raise ValueError('numSamples must be at least 2.')
+        # check window attribute
+        if self.win is None:
+            raise ValueError('No experimental monitor has been specified.\n' +\
+                             'Try running setMonitor().')
+        if not self.adaCoordinates:
+            raise ValueError("Missing active display area coordinates. \n" +\
+                             "Try running getTrackerSpace()")
+        
+        # start eyetracker, unless it is already running
+        wasTracking = self.tracking
+        if not wasTracking:
+            self.startGazeData()
+        
+        # window stimuli
+        valWin = visual.Window(size = [self.win.getSizePix()[0], 
+                                       self.win.getSizePix()[1]],
+                               pos = [0, 0],
+                               units = 'pix',
+                               fullscr = True,
+                               allowGUI = True,
+                               monitor = self.win,
+                               winType = 'pyglet',
+                               color = [0.4, 0.4, 0.4])
+        # stimulus for the validation point
+        valPoint = visual.Circle(valWin,
+                                 units = "pix",
+                                 radius = 20, 
+                                 lineColor = [1.0, -1.0, -1.0],  # red
+                                 fillColor = [1.0, -1.0, -1.0])  # red
+        
+        # samples at each point, and the index of the point for each sample
+        pointSamples = []
+        pointIds = []
+        try:
+            for i, point in enumerate(pointDict.values()):
+                # show the point and let the eyes settle on it
+                valPoint.pos = self.ada2PsychoPix(tuple(point))
+                valPoint.draw()
+                valWin.flip()
+                pcore.wait(settleTime)
+                
+                samples = self._collectSamples(numSamples)
+                pointSamples.append(samples)
+                pointIds.append(np.full(len(samples), i, dtype = np.intp))
+                
+                # check to quit
+                if event.getKeys(keyList=['q']):
+                    raise KeyboardInterrupt("You aborted the script manually.")
+                event.clearEvents(eventType='keyboard')
+        finally:
+            valWin.close()
+            if not wasTracking:
+                self.stopGazeData()
+        
+        samples = np.concatenate(pointSamples)
+        pointIds = np.concatenate(pointIds)
+        
+        # distance of the eyes from the screen at each sample, in mm
+        eyeDistance = gaze_buffer.avgEyeDist(samples) * 10.0
+        found = eyeDistance > 0
+        eyeDistance[~found] = np.median(eyeDistance[found]) if found.any() \
+            else gaze_metrics.DEFAULT_EYE_DISTANCE
+        
+        # accuracy and precision of both eyes at every point
+        eyes = {}
+        for eye in gaze_metrics.EYES:
+            positions = samples[eye.lower() + '_gaze_point_on_display_area']
+            valid = (samples[eye.lower() + '_gaze_point_validity'] == 1) & \
+                ~np.isnan(positions).any(axis = 1)
+            eyes[eye] = (positions, valid)
+        metrics = gaze_metrics.computeMetrics(
+                list(pointDict.values()), pointIds, eyes,
+                (self.adaCoordinates['width'], self.adaCoordinates['height']),
+                eyeDistance = eyeDistance, sizePix = self.win.getSizePix())
+        
+        # compare with the thresholds
+        pointPassed = gaze_metrics.checkMetrics(metrics, maxAccuracy, 
+                                                maxPrecision, minValidity)
+        failedPoints = collections.OrderedDict(
+                item for item, passed in zip(pointDict.items(), pointPassed)
+                if not passed)
+        
+        report = gaze_metrics.summarizeMetrics(metrics)
+        report.update({'Metrics': metrics,
+                       'PointPassed': pointPassed,
+                       'FailedPoints': failedPoints,
+                       'Passed': bool(pointPassed.all()),
+                       'Thresholds': {'maxAccuracy': maxAccuracy,
+                                      'maxPrecision': maxPrecision,
+                                      'minValidity': minValidity}})
+        
+        # feedback
+        print ("Validation {0}: accuracy {1:.2f} (left) {2:.2f} (right) " 
+               "degrees.".format('passed' if report['Passed'] else 'failed',
+                                 report['LeftAccuracy'], 
+                                 report['RightAccuracy']))
+        if failedPoints:
+            print ("Points outside the thresholds: " + 
+                   " ".join(str(key) for key in failedPoints.keys()))
+        return report
+    
+    
+    # collect the next numSamples samples from the gaze buffer, fewer if the
+    # eyetracker stops sending them
+    def _collectSamples(self, numSamples):
+        
+        sampleCount = self.gazeBuffer.writeCount
+        # allow three times as long as the samples should take
+        timeout = 1.0
+        if self.gazeFrequency:
+            timeout = max(timeout, 3.0 * numSamples / self.gazeFrequency)
+        
+        self.gazeBuffer.waitForSample(sampleCount + numSamples - 1, timeout)
+        samples, lastCount = self.gazeBuffer.readSince(sampleCount)
+        return samples[:numSamples]
+    
+    
+    # function for computing accuracy and precision at each calibration 
+    # point of a calibration result. Returns one gaze_metrics.METRICS_DTYPE 
+    # record per point, with mean gaze positions in ada units, accuracy in 
+    # degrees and pix, precision (RMS-S2S and SD) in degrees, and the 
+    # fraction of valid samples for each eye. Points that were never shown,
+    # like the (0,0) point the SDK may report, are left out
+    def getCalibrationMetrics(self, calibResult):
+        
+        # check argument values
+        if calibResult is None:
+            raise ValueError('No argument passed for calibResult')
+        if not self.adaCoordinates:
+            raise ValueError("Missing active display area coordinates. \n" +\
+                             "Try running getTrackerSpace()")
+        
+        # every sample of every point in one pass
+        targets, samples = gaze_metrics.unpackCalibrationResult(
+                calibResult, self.backend.VALIDITY_VALID_AND_USED)
+        eyes = {'Left': (samples['Left'], samples['LeftValidity']),
+                'Right': (samples['Right'], samples['RightValidity'])}
+        
+        sizePix = None if self.win is None else self.win.getSizePix()
+        metrics = gaze_metrics.computeMetrics(
+                targets, samples['Point'], eyes, 
+                (self.adaCoordinates['width'], self.adaCoordinates['height']),
+                eyeDistance = self._lastEyeDistance(), sizePix = sizePix)
+        return metrics[gaze_metrics.realPoints(metrics)]
+    
+    
+    # eye to screen distance in mm from the most recent sample, e.g. from 
+    # positioning the subject in the trackbox, or a typical distance
+    def _lastEyeDistance(self):
+        
+        sample = self.gazeBuffer.latest()
+        if len(sample) > 0:
+            eyeDist = gaze_buffer.avgEyeDist(sample)[0] * 10.0
+            if eyeDist > 0:
+                return eyeDist
+        return gaze_metrics.DEFAULT_EYE_DISTANCE
+    
+    
     # function for getting the average left and right gaze position coordinates
     # for each calibration point in psychopy pix units
     def calculateCalibration(self, calibResult):
@@ -773,44 +1137,61 @@ class TobiiHelper:
         if calibResult is None:
             raise ValueError('No argument passed for calibResult')
    
-        #create an empty list to hold values
-        calibDrawCoor = []
-        
-        # iterate through calibration points
-        for i in range(len(calibResult.calibration_points)):
-            # current point
-            curPoint = calibResult.calibration_points[i]
-            pointPosition = curPoint.position_on_display_area  # point position
-            pointSamples = curPoint.calibration_samples  # samples at point
-            # empty arrays for holding left and right eye gaze coordinates
-            leftOutput = np.zeros((len(pointSamples), 2))
-            rightOutput = np.zeros((len(pointSamples), 2))
-            
-            # find left and right gaze coordinates for all samples in point
-            for j in range(len(pointSamples)):
-                curSample = pointSamples[j]
-                leftEye = curSample.left_eye
-                rightEye = curSample.right_eye
-                leftOutput[j] = leftEye.position_on_display_area
-                rightOutput[j] = rightEye.position_on_display_area
-                
-            # get average x and y coordinates using all samples in point
-            lXY = tuple(np.mean(leftOutput, axis = 0))
-            rXY = tuple(np.mean(rightOutput, axis = 0))
-            point = tuple((pointPosition[0], pointPosition[1]))
-            # put current calibration point coordinates , l and r eye coordinates
-            # into list, and convert to psychopy window coordinates in pix
-            newList = [self.ada2PsychoPix(point), self.ada2PsychoPix(lXY), 
-                       self.ada2PsychoPix(rXY), pointPosition]
-            calibDrawCoor.insert(i, newList)
+        # spurious points are already filtered out
+        metrics = self.getCalibrationMetrics(calibResult)
+        points = np.column_stack((metrics['PointX'], metrics['PointY']))
+        # an eye without valid samples is drawn at the point itself
+        eyePositions = []
+        for eye in gaze_metrics.EYES:
+            means = np.column_stack((metrics[eye + 'MeanX'], 
+                                     metrics[eye + 'MeanY']))
+            eyePositions.append(np.where(
+                    (metrics[eye + 'Validity'] > 0)[:, np.newaxis], 
+                    means, points))
+        # convert calibration point, l and r eye coordinates to psychopy 
+        # window coordinates in pix, all at once
+        pointsPix, leftPix, rightPix = self.ada2PsychoPixArray(
+                np.array([points] + eyePositions)).astype(int).tolist()
+        
+        #create a list holding values for each point
+        calibDrawCoor = [[tuple(pointsPix[i]), tuple(leftPix[i]), 
+                          tuple(rightPix[i]), tuple(points[i].tolist())]
+                         for i in range(len(points))]
             
-        # for some weird reason my calibration always includes the point (0,0) at 
-        # index 0, so just remove it here
-        calibDrawCoor.pop(0)
         # return as list
         return(calibDrawCoor)
        
     
+    # function for choosing calibration points to redo without an operator.
+    # A point of curDict is redone if either eye's accuracy (degrees) is 
+    # worse than maxAccuracy, fewer than minValidity of its samples were 
+    # valid, or it is missing from the calibration result. Returns an ordered
+    # dictionary of the points to redo, like drawCalibrationResults()
+    def findBadCalibrationPoints(self, calibResult, curDict, 
+                                 maxAccuracy = 1.0, minValidity = 0.5):
+        
+        # check the values of the point dictionary
+        if curDict is None: 
+            raise ValueError('No dictionary object given.')
+        elif not isinstance(curDict, dict):
+            raise TypeError('curDict must be a dictionary with number \n' +\
+                            'keys and coordinate values.')
+        
+        metrics = self.getCalibrationMetrics(calibResult)
+        passed = gaze_metrics.checkMetrics(metrics, maxAccuracy = maxAccuracy,
+                                           maxPrecision = None, 
+                                           minValidity = minValidity)
+        goodPoints = np.column_stack((metrics['PointX'], 
+                                      metrics['PointY']))[passed]
+        
+        # points that do not match a good point in the result
+        redoDict = collections.OrderedDict()
+        for key, point in curDict.items():
+            if not np.any(np.all(np.isclose(goodPoints, point), axis = 1)):
+                redoDict[key] = point
+        return redoDict
+    
+    
     # function for drawing the results of the calibration
     def drawCalibrationResults(self, calibResult = None, calibWin = None, curDict = dict):
         
@@ -971,8 +1352,20 @@ class TobiiHelper:
 
 
     # function for drawing calibration points, collecting and applying 
-    # calibration data
-    def getCalibrationData(self, calibWin, pointList = list):
+    # calibration data. Data is collected on a worker thread while the point
+    # keeps being drawn; collection at a point that fails is retried up to 
+    # collectRetries times. A point still collecting after collectTimeout 
+    # seconds is redone at the end, up to timeoutRetries times, and if the 
+    # collection has still not returned collectTimeout seconds later the 
+    # calibration is abandoned with an error. Instead of fixed 
+    # pauses, each settle ends as soon as gaze rests on the point, or after 
+    # maxSettleTime seconds. The point moves to the next position in 
+    # moveDuration seconds and shrinks in shrinkDuration seconds, whatever 
+    # the refresh rate
+    def getCalibrationData(self, calibWin, pointList = list, 
+                           collectTimeout = 10.0, collectRetries = 3,
+                           timeoutRetries = 1, maxSettleTime = 0.5, 
+                           moveDuration = 0.8, shrinkDuration = 0.8):
         
         # check argument values
         if self.calibration is None:
@@ -986,12 +1379,22 @@ class TobiiHelper:
             raise ValueError('No list object given for pointList.')
         elif not isinstance(pointList, list):
             raise TypeError('pointList must be a list of coordinate tuples.')
+        if collectTimeout is None or collectTimeout <= 0:
+            raise ValueError('collectTimeout must be a positive number of ' +\
+                             'seconds.')
+        if timeoutRetries is None or timeoutRetries < 0:
+            raise ValueError('timeoutRetries must be zero or more.')
+        if moveDuration <= 0 or shrinkDuration <= 0:
+            raise ValueError('Animation durations must be positive numbers ' +\
+                             'of seconds.')
 
         # defaults
         pointSmallRadius = 5.0  # point radius
         pointLargeRadius = pointSmallRadius * 10.0  
-        moveFrames = 50 # number of frames to draw between points
         startPoint = (0.90, 0.90) # starter point for animation    
+        
+        # times the animations against the measured refresh rate
+        frameTimer = FrameTimer()
     
         # calibraiton point visual object
         calibPoint = visual.Circle(calibWin, 
@@ -999,80 +1402,117 @@ class TobiiHelper:
                                    lineColor = [1.0, -1.0, -1.0],  # red
                                    fillColor = [1.0, -1.0, -1.0],
                                    units = 'pix')
+        
+        # collects data without blocking the display
+        collector = CalibrationCollector(self.calibration, 
+                                         self.backend.CALIBRATION_STATUS_SUCCESS,
+                                         maxRetries = collectRetries)
+        
+        # gaze data tells when the eyes have settled on a point
+        wasTracking = self.tracking
+        if not wasTracking:
+            self.startGazeData()
 
-        # draw animation for each point
-        # converting psychopy window coordinate units from normal to px
-        for i in range(len(pointList)):    
-            
-            # if first point draw starting point
-            if i == 0:
-                firstPoint = [startPoint[0], startPoint[1]]
-                secondPoint = [pointList[i][0], pointList[i][1]]
-            else:
-                firstPoint = [pointList[i - 1][0], pointList[i - 1][1]]
-                secondPoint = [pointList[i][0], pointList[i][1]]
-                   
-            # draw and move dot
-            # step size for dot movement is new - old divided by frames
-            pointStep = [((secondPoint[0] - firstPoint[0]) / moveFrames), 
-                         ((secondPoint[1] - firstPoint[1]) / moveFrames)]
-            
-            # Move the point in position (smooth pursuit)
-            for frame in range(moveFrames - 1):
-                firstPoint[0] += pointStep[0]
-                firstPoint[1] += pointStep[1]
-                # draw & flip
-                calibPoint.pos = self.ada2PsychoPix(tuple(firstPoint))
-                calibPoint.draw()
-                calibWin.flip()          
-            # wait to let eyes settle    
-            pcore.wait(0.5)    
-            
-            # allow the eye to focus before beginning calibration
-            # point size change step
-            radiusStep = ((pointLargeRadius - pointSmallRadius) / moveFrames)
-            
-            # Shrink the outer point (gaze fixation) to encourage focusing
-            for frame in range(moveFrames):
-                pointLargeRadius -= radiusStep
-                calibPoint.radius = pointLargeRadius
-                calibPoint.draw()
-                calibWin.flip()    
-            # first wait to let the eyes settle 
-            pcore.wait(0.5)  
-            
-            # conduct calibration of point
-            print ("Collecting data at {0}." .format(i + 1))
-            while self.calibration.collect_data(pointList[i][0], 
-                                                pointList[i][1]) != tobii.CALIBRATION_STATUS_SUCCESS:
-                self.calibration.collect_data(pointList[i][0], 
-                                              pointList[i][1])   
+        # points to visit, points that timed out are added again to be redone
+        # up to timeoutRetries times. Their data is discarded once their
+        # collection has finished
+        points = list(pointList)
+        timeoutCounts = {}
+        discardPoints = []
+
+        try:
+            # draw animation for each point
+            # converting psychopy window coordinate units from normal to px
+            i = 0
+            while i < len(points):    
                 
-            # feedback from calibration
-            print ("{0} for data at point {1}." 
-                   .format(self.calibration.collect_data(pointList[i][0],
-                   pointList[i][1]), i + 1))
-            pcore.wait(0.3)  # wait before continuing
-          
-            # Return point to original size
-            for frame in range(moveFrames):
-                pointLargeRadius += radiusStep
-                calibPoint.radius = pointLargeRadius
-                calibPoint.draw()
-                calibWin.flip()      
-            # let the eyes settle and move to the next point 
-            pcore.wait(0.2)      
+                # if first point draw starting point
+                if i == 0:
+                    firstPoint = startPoint
+                else:
+                    firstPoint = points[i - 1]
+                droppedFrames = frameTimer.droppedFrames
+                
+                # Move the point in position (smooth pursuit), the path is 
+                # converted to psychopy pix once for the whole movement
+                numSteps = frameTimer.numFrames(moveDuration)
+                path = self.ada2PsychoPixArray(frame_timing.linearPath(
+                        firstPoint, points[i], numSteps))
+                self._animatePoint(frameTimer, calibPoint, calibWin, 
+                                   moveDuration, positions = path)
+                # wait to let eyes settle    
+                self._settleOnPoint(calibPoint, calibWin, points[i], 
+                                    maxSettleTime, frameTimer)
+                
+                # allow the eye to focus before beginning calibration
+                # Shrink the outer point (gaze fixation) to encourage focusing
+                numSteps = frameTimer.numFrames(shrinkDuration)
+                radii = frame_timing.linearPath(pointLargeRadius, 
+                                                pointSmallRadius, numSteps)
+                self._animatePoint(frameTimer, calibPoint, calibWin, 
+                                   shrinkDuration, radii = radii)
+                # first wait to let the eyes settle 
+                self._settleOnPoint(calibPoint, calibWin, points[i], 
+                                    maxSettleTime, frameTimer)
+                
+                # a collection that timed out must finish before the next 
+                # one starts
+                self._finishCollection(collector, discardPoints, calibPoint,
+                                       calibWin, frameTimer, collectTimeout)
+                
+                # conduct calibration of point, drawing it until done
+                print ("Collecting data at {0}." .format(i + 1))
+                future = collector.collect(points[i][0], points[i][1])
+                endTime = time.time() + collectTimeout
+                while not future.done() and time.time() < endTime:
+                    calibPoint.draw()
+                    frameTimer.flip(calibWin)
+                    
+                # feedback from calibration
+                if future.done():
+                    print ("{0} for data at point {1}." 
+                           .format(future.result(), i + 1))
+                else:
+                    # discarded once it finishes, and redone
+                    print ("Collecting data at point {0} timed out." 
+                           .format(i + 1))
+                    discardPoints.append(points[i])
+                    key = tuple(points[i])
+                    timeoutCounts[key] = timeoutCounts.get(key, 0) + 1
+                    if timeoutCounts[key] <= timeoutRetries:
+                        points.append(points[i])
+                        print ("Point {0} will be redone as point {1}."
+                               .format(i + 1, len(points)))
               
-            # check to quit  
-            # depending on response, either abort script or continue to calibration
-            if event.getKeys(keyList=['q']):
-                calibWin.close()
-                self.calibration.leave_calibration_mode()
-                raise KeyboardInterrupt("You aborted the script manually.")
-                return
+                # Return point to original size
+                self._animatePoint(frameTimer, calibPoint, calibWin, 
+                                   shrinkDuration, radii = radii[::-1])
                 
-            # clear events not accessed this iteration
-            event.clearEvents(eventType='keyboard')
+                # report frames the display missed at this point
+                if frameTimer.droppedFrames > droppedFrames:
+                    print ("Dropped {0} frames at point {1}." 
+                           .format(frameTimer.droppedFrames - droppedFrames, 
+                                   i + 1))
+                  
+                # check to quit  
+                # depending on response, either abort script or continue to calibration
+                if event.getKeys(keyList=['q']):
+                    collector.join(collectTimeout)
+                    calibWin.close()
+                    self.calibration.leave_calibration_mode()
+                    raise KeyboardInterrupt("You aborted the script manually.")
+                    return
+                    
+                # clear events not accessed this iteration
+                event.clearEvents(eventType='keyboard')
+                i += 1
+            
+            # the calibration can only be computed once collection is done
+            self._finishCollection(collector, discardPoints, calibPoint,
+                                   calibWin, frameTimer, collectTimeout)
+        finally:
+            if not wasTracking:
+                self.stopGazeData()
         
         # clear screen
         calibWin.flip()   
@@ -1084,6 +1524,107 @@ class TobiiHelper:
         return calibResult
     
     
+    # draw the calibration point moving along positions (psychopy pix) or 
+    # changing size along radii, as arrays with one entry per step, over 
+    # duration seconds. Each flip shows the step for the time elapsed, so 
+    # dropped frames are skipped over rather than slowing the animation
+    def _animatePoint(self, frameTimer, calibPoint, calibWin, duration, 
+                      positions = None, radii = None):
+        
+        steps = positions if positions is not None else radii
+        numSteps = len(steps) - 1
+        startTime = time.time()
+        while True:
+            elapsed = time.time() - startTime
+            index = frame_timing.pathIndex(elapsed, duration, numSteps)
+            if positions is not None:
+                calibPoint.pos = positions[index]
+            if radii is not None:
+                calibPoint.radius = radii[index]
+            calibPoint.draw()
+            frameTimer.flip(calibWin)
+            if index == numSteps:
+                return
+    
+    
+    # keep drawing the calibration point until the running collection, if
+    # any, has finished, then discard the data of the points in 
+    # discardPoints, whose collection timed out. A collection that does not 
+    # finish within timeout seconds is abandoned, since the SDK calibration
+    # can not be used while it is still running
+    def _finishCollection(self, collector, discardPoints, calibPoint, 
+                          calibWin, frameTimer, timeout):
+        
+        endTime = time.time() + timeout
+        while collector.isRunning():
+            if time.time() >= endTime:
+                calibWin.close()
+                raise ValueError(("Collecting calibration data did not " +\
+                                  "finish within {0} seconds of timing " +\
+                                  "out. Calibration abandoned.")
+                                 .format(timeout))
+            calibPoint.draw()
+            frameTimer.flip(calibWin)
+        collector.join()
+        for point in discardPoints:
+            self.calibration.discard_data(point[0], point[1])
+        del discardPoints[:]
+    
+    
+    # keep drawing the calibration point until gaze has settled on it, for 
+    # at least minSettleTime and at most maxSettleTime seconds
+    def _settleOnPoint(self, calibPoint, calibWin, point, maxSettleTime,
+                       frameTimer, minSettleTime = 0.1):
+        
+        startTime = time.time()
+        while True:
+            calibPoint.draw()
+            frameTimer.flip(calibWin)
+            elapsed = time.time() - startTime
+            if elapsed >= maxSettleTime:
+                return
+            if elapsed >= minSettleTime and self._gazeSettled(point):
+                return
+    
+    
+    # function for checking whether gaze rests on a point (ada units): over 
+    # the last window seconds, most samples must be valid, their mean within 
+    # radius degrees of the point (before calibration gaze can be off by a 
+    # few degrees), and their spread (x range plus y range) within 
+    # maxDispersion degrees
+    def _gazeSettled(self, point, window = 0.15, radius = 3.0, 
+                     maxDispersion = 1.0, minValid = 0.8):
+        
+        # without live gaze data it never settles
+        if not self.tracking or not self.gazeFrequency or \
+                not self.adaCoordinates:
+            return False
+        count = max(2, int(window * self.gazeFrequency))
+        samples, receiveTime = self.gazeBuffer.latestReceived(count)
+        if len(samples) < count:
+            return False
+        # the newest sample must be recent
+        age = self.backend.get_system_time_stamp() - \
+            samples['system_time_stamp'][-1]
+        if age > window * 1e6:
+            return False
+        
+        positions = gaze_buffer.avgGazePos(samples)
+        valid = ~np.isnan(positions).any(axis = 1)
+        if valid.mean() < minValid:
+            return False
+        
+        # ada units to degrees, small angles at the current eye distance
+        degreesPerAda = np.degrees(np.array([self.adaCoordinates['width'],
+                                             self.adaCoordinates['height']]) / 
+                                   self._lastEyeDistance())
+        positions = positions[valid] * degreesPerAda
+        offset = positions.mean(axis = 0) - np.asarray(point) * degreesPerAda
+        dispersion = np.sum(positions.max(axis = 0) - positions.min(axis = 0))
+        return np.hypot(offset[0], offset[1]) <= radius and \
+            dispersion <= maxDispersion
+    
+    
     # function for running simple gui to visualize subject eye position. Make 
     # sure that the eyes are in optimal location for eye tracker
     def runTrackBox(self):
@@ -1121,8 +1662,15 @@ class TobiiHelper:
         return 
 
     
-    # function for running a complete calibration routine 
-    def runFullCalibration(self, numCalibPoints = None):   
+    # function for running a complete calibration routine. With autoRedo, 
+    # points are not picked by the operator: after each calibration, points
+    # where either eye is less accurate than maxAccuracy degrees (or has 
+    # fewer than minValidity valid samples) are discarded and collected 
+    # again, for at most maxRetries rounds. Returns True if the calibration
+    # was applied, False if it was not successful
+    def runFullCalibration(self, numCalibPoints = None, autoRedo = False, 
+                           maxAccuracy = 1.0, minValidity = 0.5, 
+                           maxRetries = 2):   
         
         # check that eyetracker is connected before running
         if self.eyetracker is None:  # eyeTracker
@@ -1133,6 +1681,10 @@ class TobiiHelper:
         if self.win is None:
             raise ValueError('No experimental monitor has been specified.\n' +\
                              'Try running setMonitor().')
+        # accuracy is measured in degrees from the display area size
+        if autoRedo and not self.adaCoordinates:
+            raise ValueError("Missing active display area coordinates. \n" +\
+                             "Try running getTrackerSpace()")
                
         # create dictionary of calibration points
         # if nothing entered then default is nine
@@ -1191,7 +1743,7 @@ class TobiiHelper:
         self.runTrackBox()
     
         # initialize calibration
-        self.calibration = tobii.ScreenBasedCalibration(self.eyetracker)  # calib object 
+        self.calibration = self.backend.ScreenBasedCalibration(self.eyetracker)  # calib object 
         # enter calibration mode
         self.calibration.enter_calibration_mode()
         # subject instructions
@@ -1211,6 +1763,8 @@ class TobiiHelper:
         
         # create dictionary for holding points to be recalibrated
         redoCalDict = calibDict
+        # number of times points were redone automatically
+        numRetries = 0
         
         # loop through calibration process until calibration is complete
         while True:
@@ -1223,22 +1777,33 @@ class TobiiHelper:
     
             # Check status of calibration result
             # if calibration was successful, check calibration results
-            if calibResult.status != tobii.CALIBRATION_STATUS_FAILURE:      
+            if calibResult.status != self.backend.CALIBRATION_STATUS_FAILURE:      
                 # give feedback
                 calibMessage.text = ("Applying calibration...")
                 calibMessage.draw()
                 calibWin.flip()
                 pcore.wait(2)
-                # moving on to accuracy plot
-                calibMessage.text = ("Calculating calibration accuracy...")
-                calibMessage.draw()
-                calibWin.flip()
-                pcore.wait(2)
-                
-                # check calibration for poorly calibrated points
-                redoCalDict = self.drawCalibrationResults(calibResult, 
-                                                          calibWin, 
-                                                          calibDict)
+                # check calibration for poorly calibrated points, either 
+                # automatically or by the operator
+                if autoRedo:
+                    redoCalDict = self.findBadCalibrationPoints(
+                            calibResult, calibDict, maxAccuracy, minValidity)
+                    # stop redoing points once the retries are used up
+                    if redoCalDict and numRetries >= maxRetries:
+                        print ("Retries used up, keeping points: " + 
+                               " ".join(str(x) for x in redoCalDict.keys()))
+                        redoCalDict = collections.OrderedDict()
+                    numRetries += 1
+                else:
+                    # moving on to accuracy plot
+                    calibMessage.text = ("Calculating calibration accuracy...")
+                    calibMessage.draw()
+                    calibWin.flip()
+                    pcore.wait(2)
+                    
+                    redoCalDict = self.drawCalibrationResults(calibResult, 
+                                                              calibWin, 
+                                                              calibDict)
        
             else:  # if calibration was not successful, leave and abort
                 calibMessage.text = ("Calibration was not successful.\n\n" + \
@@ -1248,7 +1813,7 @@ class TobiiHelper:
                 pcore.wait(3)
                 calibWin.close()
                 self.calibration.leave_calibration_mode()
-                return
+                return False
                     
             # Redo calibration for specific points if necessary 
             if not redoCalDict:  # if no points to redo
@@ -1301,59 +1866,345 @@ class TobiiHelper:
         calibWin.flip()
         pcore.wait(3)
         calibWin.close() 
-        return
+        return True
+    
+    
+    # display geometry a calibration is made for: the corners of the active
+    # display area (mm) and the size of the monitor in pixels
+    def _displayGeometry(self):
+        
+        geometry = []
+        for corner in ('topLeft', 'topRight', 'bottomLeft', 'bottomRight'):
+            geometry.extend(self.adaCoordinates[corner])
+        geometry.extend(self.win.getSizePix())
+        return geometry
+    
+    
+    # check that the eyetracker, display area, and monitor are known, as
+    # they are part of the key of a stored calibration
+    def _checkStoreKey(self, store, participant):
+        
+        if store is None:
+            raise ValueError("No calibration store given.")
+        if participant is None or str(participant) == '':
+            raise ValueError("No participant ID given.")
+        if self.eyetracker is None:
+            raise ValueError("No eyetracker is specified. " +\
+                             "Try running findTracker().")
+        if not self.adaCoordinates:
+            raise ValueError("Missing active display area coordinates. \n" +\
+                             "Try running getTrackerSpace()")
+        if self.win is None:
+            raise ValueError('No experimental monitor has been specified.\n' +\
+                             'Try running setMonitor().')
+    
+    
+    # function for saving the calibration that is applied on the eyetracker
+    # to a calibration_store.CalibrationStore, for participant on this 
+    # eyetracker and display
+    def saveCalibration(self, store, participant):
+        
+        self._checkStoreKey(store, participant)
+        calibrationData = self.eyetracker.retrieve_calibration_data()
+        if not calibrationData:
+            raise ValueError("The eyetracker has no calibration to save.\n" +\
+                             "Try running runFullCalibration().")
+        store.save(participant, self.eyetracker.serial_number, 
+                   self._displayGeometry(), calibrationData)
+        print ("Saved calibration for participant {0}.".format(participant))
+    
+    
+    # function for applying the calibration stored for participant on this 
+    # eyetracker and display. Returns False if there is none
+    def loadCalibration(self, store, participant):
+        
+        self._checkStoreKey(store, participant)
+        calibrationData = store.load(participant, 
+                                     self.eyetracker.serial_number, 
+                                     self._displayGeometry())
+        if calibrationData is None:
+            return False
+        self.eyetracker.apply_calibration_data(calibrationData)
+        print ("Applied stored calibration for participant {0}."
+               .format(participant))
+        return True
+    
+    
+    # function for calibrating a participant who may have been calibrated 
+    # before. Their stored calibration is applied and checked with 
+    # runQuantitativeValidation() against maxAccuracy, maxPrecision, and 
+    # minValidity. If there is none, or it fails, a full calibration is run 
+    # (numCalibPoints and autoRedo as for runFullCalibration()) and saved. 
+    # Returns True if the stored calibration was used
+    def runStoredCalibration(self, store, participant, numCalibPoints = None,
+                             autoRedo = False, maxAccuracy = 1.0, 
+                             maxPrecision = 0.5, minValidity = 0.8):
+        
+        self._checkStoreKey(store, participant)
+        
+        if self.loadCalibration(store, participant):
+            # let the participant get into position before validating
+            self.runTrackBox()
+            report = self.runQuantitativeValidation(
+                    maxAccuracy = maxAccuracy, maxPrecision = maxPrecision, 
+                    minValidity = minValidity)
+            if report['Passed']:
+                print ("Stored calibration passed validation.")
+                return True
+            print ("Stored calibration failed validation at points: " +
+                   " ".join(str(x) for x in report['FailedPoints'].keys()) +
+                   ". Running a full calibration.")
+        else:
+            print ("No stored calibration for participant {0}. Running a " 
+                   "full calibration.".format(participant))
+        
+        # only successful calibrations are kept
+        if self.runFullCalibration(numCalibPoints, autoRedo = autoRedo):
+            self.saveCalibration(store, participant)
+        return False
      
 # ----- Functions for exporting gaze data  -----
         
-    # Function for getting all gaze and event data from the current sample 
+    # function for blocking until the eyetracker delivers a sample that has 
+    # not been returned before, without spinning. Returns the sample as a one
+    # record gaze buffer array, or None if timeout (in seconds) runs out
+    def waitForNextSample(self, timeout = 1.0):
+        # check gaze Data
+        if not self.tracking:
+            raise ValueError("Data is not being recorded by the eyetracker.")
+        
+        # sleep until the gaze callback signals a new sample
+        sampleCount = self.gazeBuffer.waitForSample(self.lastSampleCount, 
+                                                    timeout)
+        if sampleCount <= self.lastSampleCount:
+            return None
+        
+        self.lastSampleCount = sampleCount
+        return self.gazeBuffer.latest()
+    
+    
+    # function for getting a consistent summary of the most recent sample. 
+    # The sample is read from the gaze buffer once and every value is 
+    # computed from that same sample, so x and y values can not come from 
+    # different samples. SampleAge gives how long ago (ms) the SDK received 
+    # the sample, as a measure of latency. Returns None if no sample has 
+    # arrived yet
+    def getSnapshot(self):
+        # check gaze Data
+        if not self.tracking:
+            raise ValueError("Data is not being recorded by the eyetracker.")
+        
+        # grab the sample once
+        sample = self.gazeBuffer.latest()
+        if len(sample) == 0:
+            return None
+        
+        return self._summarizeSamples(sample)[0]
+    
+    
+    # convert an array of gaze buffer samples to a list of dictionaries with 
+    # the values of getCurrentData, all computed in one vectorized pass
+    def _summarizeSamples(self, samples):
+        
+        summary = gaze_buffer.summarizeGazeData(samples)
+        timeNow = self.backend.get_system_time_stamp()
+        
+        rows = []
+        for values in summary.tolist():
+            row = dict(zip(gaze_buffer.DATA_DTYPE.names, values))
+            row['SampleAge'] = (timeNow - row['SystemTimeStamp']) / 1000.0
+            rows.append(row)
+        return rows
+    
+    
+    # Function for getting all gaze and event data from the next sample 
     # collected by the eyetracker, returned as a dictionary. Can easily be 
     # converted into a pandas dataframe. Strongly suggest putting output into 
     # a psychopy data object, as psychopy.data comes with many convenient 
     # functions for organizing experiment flow, recording data, and saving 
-    # files. Gaze position is given in px, eye position, distance, and pupil size
-    # given in mm. 
-    def getCurrentData(self):
+    # files. Waits for the eyetracker to deliver a new sample, so rows follow
+    # the eyetracker's output frequency. Time stamps are the eyetracker's 
+    # device and system time stamps in microseconds. Gaze position is given in
+    # ada units, eye position, distance, and pupil size given in mm. 
+    def getCurrentData(self, timeout = 1.0):
         # check gaze Data
         if not self.tracking:
             raise ValueError("Data is not being recorded by the eyetracker.")
         
-        # output file at same frequency as eyetracker
-        timeCur = np.datetime64(dt.datetime.now())
-        timeNow = timeCur
-        timeDelta = np.absolute((timeCur - timeNow)/np.timedelta64(1, 'ms'))
-        
-        # when two data samples are slightly less than the eyetrackers frequency
-        # apart, request data from eyetracker
-        while timeDelta < 7.0:  # change according to eyetracker freq
-            pcore.wait(0.001)
-            timeNow = np.datetime64(dt.datetime.now())
-            timeDelta = np.absolute((timeCur - timeNow)/np.timedelta64(1, 'ms'))
-        
-        # code can easily be modified to get more than averages
-        timeMidnight = np.datetime64(dt.datetime.date(dt.datetime.today()))
-        
-        self.currentData = {}
-        self.currentData['DeviceTimeStamp'] = np.absolute((timeNow - timeMidnight)/np.timedelta64(1, 'ms'))
-        self.currentData['AvgGazePointX'] = self.getAvgGazePos()[0]
-        self.currentData['AvgGazePointY'] = self.getAvgGazePos()[1]            
-        self.currentData['AvgPupilDiam'] = self. getPupilSize()
-        self.currentData['AvgEyePosX'] = self.getAvgEyePos()[0]
-        self.currentData['AvgEyePosY'] = self.getAvgEyePos()[1]             
-        self.currentData['AvgEyePosZ'] = self.getAvgEyePos()[2]
-        self.currentData['AvgEyeDistance'] = self.getAvgEyeDist() * 10
-        self.currentData['EyeValidities'] = self.checkEyeValidities()
+        # wait for a sample that has not been returned yet
+        sample = self.waitForNextSample(timeout)
+        if sample is None:
+            raise ValueError("No gaze data was received from the " +\
+                             "eyetracker within %s seconds." % timeout)
         
+        # all values come from the same sample
+        self.currentData = self._summarizeSamples(sample)[0]
         return self.currentData
+    
+    
+    # Generator for getting the values of getCurrentData for every sample the 
+    # eyetracker delivers, in order and without skipping samples. Sleeps 
+    # while waiting for samples, and stops once gaze data is stopped.
+    def iterCurrentData(self, timeout = 1.0):
+        # check gaze Data
+        if not self.tracking:
+            raise ValueError("Data is not being recorded by the eyetracker.")
+        
+        # start with the next sample
+        sampleCount = self.gazeBuffer.writeCount
+        
+        while self.tracking:
+            # sleep until there are new samples, then check again if tracking
+            if self.gazeBuffer.waitForSample(sampleCount, timeout) <= sampleCount:
+                continue
+            
+            # summarize everything that arrived since the last pass at once
+            samples, sampleCount = self.gazeBuffer.readSince(sampleCount)
+            for row in self._summarizeSamples(samples):
+                yield row
   
 
+    
+    # function for recording every gaze sample to a binary file. A background
+    # thread copies new samples from the gaze buffer to the file every 
+    # flushInterval seconds, so collecting gaze data never waits on the disk.
+    # fsync can be 'never', 'flush' (after every write), or 'close'
+    def startRecording(self, fileName, flushInterval = 0.1, fsync = 'close'):
+        
+        # check argument values
+        if fileName is None:
+            raise ValueError("No file name given for the recording.")
+        if self.recorder is not None:
+            raise ValueError("Already recording, try running stopRecording().")
+        
+        self.recorder = GazeRecorder(self.gazeBuffer, fileName, 
+                                     flushInterval = flushInterval, 
+                                     fsync = fsync)
+        self.recorder.start()
+        print ("Recording gaze data to " + fileName)
+        
+        
+    # function for writing the last samples and closing the recording
+    def stopRecording(self):
+        
+        if self.recorder is None:
+            raise ValueError("Not recording, try running startRecording().")
+        
+        self.recorder.stop()
+        print ("Recorded {0} samples, {1} lost.".format(
+                self.recorder.sampleCount, self.recorder.lostCount))
+        self.recorder = None
 
+    
+    # functions for marking trials and events in the recording, so a trial's
+    # samples can later be read with GazeSession(fileName).getTrial(label)
+    def beginTrial(self, label):
+        
+        if self.recorder is None:
+            raise ValueError("Not recording, try running startRecording().")
+        self.recorder.beginTrial(label)
+        
+        
+    def endTrial(self):
+        
+        if self.recorder is None:
+            raise ValueError("Not recording, try running startRecording().")
+        self.recorder.endTrial()
+        
+        
+    def addEvent(self, label):
+        
+        if self.recorder is None:
+            raise ValueError("Not recording, try running startRecording().")
+        self.recorder.addEvent(label)
+    
+    
+    # function for marking this moment in the recording with a label and a 
+    # payload, e.g. mark('stimulus', {'condition': 2}) right after a flip. 
+    # Marks are stamped with the system clock of the gaze samples and cost 
+    # no more than a clock read and a queue append, so they can be set from
+    # a frame loop or another thread. Read them back with 
+    # GazeSession(fileName).getMarks() or getBetweenMarks(startLabel, endLabel)
+    def mark(self, label, payload = None):
+        
+        if self.recorder is None:
+            raise ValueError("Not recording, try running startRecording().")
+        self.recorder.mark(label, payload, 
+                           self.backend.get_system_time_stamp())
 
 
+# ----- Functions for streaming gaze data to other programs -----
 
+    # function for sending every new gaze sample to programs that connect 
+    # with gaze_stream.GazeSubscriber, e.g. on a monitoring computer. 
+    # address is (host, port), port 0 picks a free port, or the path of a 
+    # Unix socket. policy says what happens when a subscriber falls 
+    # maxQueue frames behind: 'drop-oldest' drops its oldest frame, 'block'
+    # holds up sending until it catches up. Returns the address to connect to
+    def startPublishing(self, address = ('127.0.0.1', 0), 
+                        policy = 'drop-oldest', maxQueue = 100, 
+                        batchInterval = 0.01):
+        
+        if self.publisher is not None:
+            raise ValueError("Already publishing, try running " +\
+                             "stopPublishing().")
+        
+        info = {}
+        if self.eyetracker is not None:
+            info['serialNumber'] = self.eyetracker.serial_number
+        if self.gazeFrequency:
+            info['frequency'] = self.gazeFrequency
+        self.publisher = GazePublisher(self.gazeBuffer, address, 
+                                       policy = policy, maxQueue = maxQueue,
+                                       batchInterval = batchInterval,
+                                       clock = self.backend.get_system_time_stamp,
+                                       info = info)
+        address = self.publisher.start()
+        print ("Publishing gaze data at " + str(address))
+        return address
+    
+    
+    # function for disconnecting every subscriber and stopping publishing
+    def stopPublishing(self):
+        
+        if self.publisher is None:
+            raise ValueError("Not publishing, try running startPublishing().")
+        self.publisher.stop()
+        self.publisher = None
 
 
+# ----- Functions for detecting fixations, saccades, and blinks -----
 
-
-
-
-
+    # function for classifying every gaze sample as it arrives, with the
+    # velocity ('ivt') or dispersion ('idt') threshold method. options are
+    # passed on to event_detection.EventDetector, e.g. velocityThreshold 
+    # (degrees/s), dispersionThreshold (degrees), or minFixationDuration (s).
+    # Returns the detector, use its subscribe(callback, eventTypes) to be 
+    # called with every event, or popEvents() to poll from a frame loop
+    def startEventDetection(self, method = 'ivt', **options):
+        
+        # gaze is converted to degrees using the active display area size
+        if not self.adaCoordinates:
+            raise ValueError("Missing active display area coordinates. \n" +\
+                             "Try running getTrackerSpace()")
+        if self.eventDetector is not None:
+            raise ValueError("Event detection is already running, try " +\
+                             "running stopEventDetection().")
+        
+        self.eventDetector = EventDetector((self.adaCoordinates['width'], 
+                                            self.adaCoordinates['height']),
+                                           method = method, **options)
+        return self.eventDetector
+    
+    
+    # function for stopping event detection, the event in progress is 
+    # emitted first. Returns the detector
+    def stopEventDetection(self):
+        
+        if self.eventDetector is None:
+            raise ValueError("Event detection is not running, try running " +\
+                             "startEventDetection().")
+        
+        eventDetector, self.eventDetector = self.eventDetector, None
+        eventDetector.flush()
+        return eventDetector